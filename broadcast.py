@@ -0,0 +1,147 @@
+from engineio import packet as eio_packet
+from socketio import Manager, RedisManager
+from socketio import packet as sio_packet
+
+# --------------------------------------------------------------------
+# Gated fan-out
+#
+# python-socketio (>= 5.8) already encodes a room emit once and queues
+# the same Engine.IO packets on every recipient. GatedManager keeps that
+# and adds what the stock manager lacks, on every worker's local delivery
+# – also for messages arriving through the Redis queue: sockets a `gate`
+# (Backpressure) refuses are skipped, and on_send(event, bytes) hears how
+# much was queued. Emits with an ack callback take the stock path.
+# It is a client manager (SocketIO(client_manager=...)), the library's
+# extension point, and hands packets to the server as Manager.emit does.
+# --------------------------------------------------------------------
+def encode_event(sio, event, data, namespace='/'):
+    """Shared Engine.IO text packet for `event` plus its binary attachments"""
+    pkt = sio.packet_class(sio_packet.EVENT, namespace=namespace,
+                           data=[event] + data)
+    encoded = pkt.encode()
+    if not isinstance(encoded, list):
+        encoded = [encoded]
+    text = eio_packet.Packet(eio_packet.MESSAGE, encoded[0])
+    text.encode()                   # ▶ warm the cache before fan-out
+    return text, encoded[1:]
+
+
+def recipients(manager, room, skip_sid=None, namespace='/'):
+    """(sid, eio_sid) of every local socket in the room minus skip_sid"""
+    if skip_sid is None:
+        skip = ()
+    elif isinstance(skip_sid, (list, tuple, set)):
+        skip = set(skip_sid)
+    else:
+        skip = {skip_sid}
+    return [(sid, eio_sid)
+            for sid, eio_sid in manager.get_participants(namespace, room)
+            if sid not in skip]
+
+
+class GatedManager(Manager):
+    gate = None         # ▶ Backpressure; None sends to everyone
+    on_send = None      # ▶ on_send(event, bytes queued on local sockets)
+
+    def emit(self, event, data, namespace, room=None, skip_sid=None,
+             callback=None, to=None, **kwargs):
+        room = to or room
+        if callback or namespace not in self.rooms:
+            return super().emit(event, data, namespace, room=room,
+                                skip_sid=skip_sid, callback=callback,
+                                **kwargs)
+        if isinstance(data, tuple):
+            data = list(data)       # ▶ several arguments, as Manager.emit
+        else:
+            data = [] if data is None else [data]
+        targets = recipients(self, room, skip_sid, namespace)
+        if self.gate is not None:
+            targets = [(sid, eio_sid) for sid, eio_sid in targets
+                       if self.gate.admit(sid, eio_sid)]
+        if not targets:
+            return
+        text, attachments = encode_event(self.server, event, data, namespace)
+        for _, eio_sid in targets:
+            self._send_encoded(eio_sid, text, attachments)
+        if self.on_send is not None:
+            size = len(text.encode()) + sum(len(a) for a in attachments)
+            self.on_send(event, size * len(targets))
+
+    def _send_encoded(self, eio_sid, text, attachments=()):
+        self.server._send_eio_packet(eio_sid, text)
+        for data in attachments:
+            # ▶ Engine.IO caches a binary packet's first encoding – raw for
+            #   websocket, base64 for polling – so each socket gets its own
+            #   wrapper around the shared bytes
+            self.server._send_eio_packet(
+                eio_sid, eio_packet.Packet(eio_packet.MESSAGE, data))
+
+
+class GatedRedisManager(RedisManager, GatedManager):
+    """Redis pub/sub fan-out; each worker delivers through GatedManager"""
+
+
+def gated_manager(url=None, channel='flask-socketio'):
+    """client_manager for SocketIO: in-process, or over Redis with a url"""
+    if url:
+        return GatedRedisManager(url, channel=channel)
+    return GatedManager()
+
+
+# --------------------------------------------------------------------
+# Backpressure
+#
+# Engine.IO gives every socket an unbounded send queue that its writer
+# drains as fast as the network allows. A socket whose queue holds
+# max_backlog Socket.IO messages is marked lagging and gets nothing more:
+# whatever it missed is stale anyway. Once its queue is down to
+# resume_backlog, recovered() hands it back so the caller can send one
+# fresh snapshot.
+#
+# Messages, not packets: a packed board goes out as one packet per stroke
+# (its binary attachments), and a snapshot must count as one message or
+# every resync of a big board would trip the limit again.
+# --------------------------------------------------------------------
+class Backpressure:
+    def __init__(self, sio, max_backlog, resume_backlog=None):
+        self.sio = sio
+        self.max_backlog = max_backlog
+        self.resume_backlog = (max_backlog // 4 if resume_backlog is None
+                               else resume_backlog)
+        # ▶ with msgpack every message is one binary packet, no attachments
+        self.attachments = sio.packet_class.uses_binary_events
+        self.lagging = {}           # ▶ sid -> eio_sid
+        self.dropped = 0            # ▶ sends skipped while lagging
+        self.stalls = 0             # ▶ times a socket was marked lagging
+
+    def backlog(self, eio_sid):
+        """Messages waiting in the socket's send queue"""
+        socket = self.sio.eio.sockets.get(eio_sid)
+        if socket is None:
+            return 0
+        queued = getattr(socket.queue, 'queue', None)   # ▶ its deque
+        if queued is None or not self.attachments:
+            return socket.queue.qsize()
+        # ▶ binary attachments ride with the text packet before them
+        return sum(1 for pkt in list(queued)
+                   if pkt is not None and not pkt.binary)
+
+    def admit(self, sid, eio_sid):
+        if sid not in self.lagging:
+            if self.backlog(eio_sid) < self.max_backlog:
+                return True
+            self.lagging[sid] = eio_sid
+            self.stalls += 1
+        self.dropped += 1
+        return False
+
+    def recovered(self):
+        """Lagging sids that caught up; they are admitted again"""
+        caught_up = [sid for sid, eio_sid in self.lagging.items()
+                     if self.backlog(eio_sid) <= self.resume_backlog]
+        for sid in caught_up:
+            del self.lagging[sid]
+        return caught_up
+
+    def forget(self, sid):
+        self.lagging.pop(sid, None)
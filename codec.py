@@ -0,0 +1,138 @@
+import sys
+from array import array
+
+# --------------------------------------------------------------------
+# Packed stroke points
+#
+# Clients that connect with ?encoding=packed send and receive a stroke's
+# `points` as one binary buffer of little-endian float32 x, y pairs
+# (the layout of array('f')). The server keeps such strokes packed in a
+# bytearray and only converts at the edge, for a peer that speaks the
+# other encoding.
+# --------------------------------------------------------------------
+JSON = 'json'
+PACKED = 'packed'
+ENCODINGS = (JSON, PACKED)
+
+# keys of board payloads that hold strokes / points
+_STROKE_LIST_KEYS = ('paths', 'insert')
+_STROKE_KEYS = ('stroke',)
+
+
+def is_packed(points):
+    return isinstance(points, (bytes, bytearray))
+
+
+def pack_points(points):
+    """float32 buffer for [{x, y}, ...] / [[x, y], ...], None if lossy"""
+    coords = array('f')
+    for point in points:
+        if isinstance(point, dict):
+            if len(point) != 2 or 'x' not in point or 'y' not in point:
+                return None     # ▶ pressure etc. – keep it as JSON
+            coords.append(point['x'])
+            coords.append(point['y'])
+        elif isinstance(point, (list, tuple)) and len(point) == 2:
+            coords.extend(point)
+        else:
+            return None
+    if sys.byteorder == 'big':
+        coords.byteswap()
+    return bytearray(coords.tobytes())
+
+
+def unpack_points(buf):
+    coords = array('f')
+    coords.frombytes(bytes(buf[:len(buf) - len(buf) % 8]))
+    if sys.byteorder == 'big':
+        coords.byteswap()
+    return [{'x': coords[i], 'y': coords[i + 1]}
+            for i in range(0, len(coords), 2)]
+
+
+def ingest_points(points):
+    """Storage form of incoming points: binary stays binary"""
+    return bytearray(points) if is_packed(points) else points
+
+
+def extend_points(stroke, points):
+    """Append incoming points to a stored stroke, whatever either format"""
+    stored = stroke.get('points')
+    if stored is None:
+        stroke['points'] = ingest_points(points)
+    elif is_packed(stored) == is_packed(points):
+        stored.extend(points)
+    elif is_packed(stored):
+        packed = pack_points(points)
+        if packed is None:
+            stroke['points'] = unpack_points(stored) + list(points)
+        else:
+            stored.extend(packed)
+    else:
+        stored.extend(unpack_points(points))
+
+
+def encode_points(points, encoding):
+    """Points as sent to a client using `encoding`"""
+    if is_packed(points):
+        return bytes(points) if encoding == PACKED else unpack_points(points)
+    if encoding == PACKED:
+        packed = pack_points(points)
+        if packed is not None:
+            return bytes(packed)
+    return points
+
+
+def encode_stroke(stroke, encoding):
+    if not isinstance(stroke, dict) or 'points' not in stroke:
+        return stroke
+    points = stroke['points']
+    encoded = encode_points(points, encoding)
+    if encoded is points:
+        return stroke
+    return dict(stroke, points=encoded)
+
+
+def encode_strokes(strokes, encoding):
+    return [encode_stroke(stroke, encoding) for stroke in strokes]
+
+
+def _map_payload(payload, stroke_fn, points_fn):
+    mapped = dict(payload)
+    for key in _STROKE_LIST_KEYS:
+        if key in mapped:
+            mapped[key] = [stroke_fn(stroke) for stroke in mapped[key]]
+    for key in _STROKE_KEYS:
+        if key in mapped:
+            mapped[key] = stroke_fn(mapped[key])
+    if 'points' in mapped:
+        mapped['points'] = points_fn(mapped['points'])
+    return mapped
+
+
+def encode_payload(payload, encoding):
+    """Copy of a board event payload with strokes in `encoding`"""
+    return _map_payload(payload,
+                        lambda stroke: encode_stroke(stroke, encoding),
+                        lambda points: encode_points(points, encoding))
+
+
+def _copy_points(points):
+    return bytearray(points) if is_packed(points) else list(points)
+
+
+def detach_stroke(stroke):
+    if not isinstance(stroke, dict) or 'points' not in stroke:
+        return stroke
+    return dict(stroke, points=_copy_points(stroke['points']))
+
+
+def detach_payload(payload):
+    """Copy of a payload that no longer shares points with the board"""
+    return _map_payload(payload, detach_stroke, _copy_points)
+
+
+def ingest_stroke(stroke):
+    if isinstance(stroke, dict) and is_packed(stroke.get('points')):
+        stroke['points'] = bytearray(stroke['points'])
+    return stroke
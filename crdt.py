@@ -0,0 +1,202 @@
+from collections import OrderedDict
+
+from codec import extend_points, is_packed
+
+# --------------------------------------------------------------------
+# Stroke-level CRDT
+#
+# Strokes are named "<client id>:<seq>" by the client that draws them
+# and carry a Lamport `clock`. Every replica – the server and each
+# client – applies the same three operations with the same rules, so
+# any delivery order of the same ops ends in the same board:
+#
+#   add     {op, stroke: {id, clock, points, ...}}
+#   append  {op, id, offset, points}      offset = points already there
+#   remove  {op, id, clock}
+#
+# Board order is (clock, client id, seq); strokes without CRDT metadata
+# (legacy clients) sort first. A remove wins over an add with a lower or
+# equal clock, so a stroke removed before its add arrives stays removed;
+# a later add (redo) with a higher clock brings it back. Appends come
+# from the stroke's owner only and are placed by offset, so a repeated
+# or overlapping chunk is not applied twice.
+# --------------------------------------------------------------------
+TOMBSTONE_LIMIT = 10000     # ▶ removals remembered for late adds
+
+
+def parse_id(stroke_id):
+    """(client id, seq) of a CRDT stroke id, None for any other id"""
+    if not isinstance(stroke_id, str):
+        return None
+    client, sep, seq = stroke_id.rpartition(':')
+    if not sep or not client or not seq.isdigit():
+        return None
+    return client, int(seq)
+
+
+def is_clock(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def order_key(stroke):
+    if isinstance(stroke, dict):
+        parsed = parse_id(stroke.get('id'))
+        clock = stroke.get('clock')
+        if parsed is not None and is_clock(clock):
+            return (clock,) + parsed
+    return (0, '', 0)
+
+
+def point_count(points):
+    if points is None:
+        return 0
+    return len(points) // 8 if is_packed(points) else len(points)
+
+
+def insert_position(paths, stroke):
+    """Index that keeps paths in CRDT order; new strokes land near the end"""
+    key = order_key(stroke)
+    i = len(paths)
+    while i and order_key(paths[i - 1]) > key:
+        i -= 1
+    return i
+
+
+def trim_append(stroke, offset, points):
+    """The part of an append chunk the stroke still lacks, None if none
+
+    A chunk starting past the stroke's end would leave a gap; it is
+    refused too, and the owner resends from the offset it is told.
+    """
+    have = point_count(stroke.get('points'))
+    count = point_count(points)
+    if offset > have or offset + count <= have:
+        return None
+    skip = have - offset
+    if not skip:
+        return points
+    return points[skip * 8:] if is_packed(points) else points[skip:]
+
+
+class Tombstones:
+    """stroke id -> clock of its latest removal, oldest forgotten first
+
+    Iterates as (stroke id, clock) entries, oldest first, and is rebuilt
+    from them with extend(), so a store can keep it item by item like a
+    list; an entry is replaced, never changed, when its clock moves.
+    """
+
+    def __init__(self, limit=TOMBSTONE_LIMIT):
+        self.limit = limit
+        self.entries = OrderedDict()    # ▶ stroke id -> (stroke id, clock)
+
+    def __setstate__(self, state):
+        clocks = state.pop('clocks', None)
+        if clocks is not None:          # ▶ pickled as id -> clock
+            state['entries'] = OrderedDict((k, (k, c))
+                                           for k, c in clocks.items())
+        self.__dict__.update(state)
+
+    def bury(self, stroke_id, clock):
+        entry = self.entries.get(stroke_id)
+        if entry is None or clock > entry[1]:
+            self.entries.pop(stroke_id, None)
+            self.entries[stroke_id] = (stroke_id, clock)
+            self._trim()
+
+    def buries(self, stroke):
+        """True when a remove at least as recent as this add was seen"""
+        entry = self.entries.get(stroke.get('id'))
+        return entry is not None and entry[1] >= stroke.get('clock', 0)
+
+    def revive(self, stroke):
+        """Forget a removal that a stroke put back on the board outdates"""
+        if self.buries(stroke):
+            del self.entries[stroke['id']]
+
+    def extend(self, entries):
+        for entry in entries:
+            self.entries.pop(entry[0], None)
+            self.entries[entry[0]] = entry
+        self._trim()
+
+    def empty(self):
+        return Tombstones(self.limit)
+
+    def _trim(self):
+        while len(self.entries) > self.limit:
+            self.entries.popitem(last=False)
+
+    def __iter__(self):
+        return iter(list(self.entries.values()))
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class Board:
+    """A replica: ordered strokes, an id index and tombstones
+
+    Subclasses redirect splice() / extend() to keep their own bookkeeping
+    (the server records undo steps and the spatial grid there).
+    """
+
+    def __init__(self, paths=None, index=None, tombstones=None):
+        self.paths = [] if paths is None else paths
+        self.index = {} if index is None else index
+        self.tombstones = Tombstones() if tombstones is None else tombstones
+
+    def splice(self, start, stop, inserted):
+        for stroke in self.paths[start:stop]:
+            if self.index.get(stroke.get('id')) is stroke:
+                del self.index[stroke['id']]
+        self.paths[start:stop] = inserted
+        self.index.update((stroke['id'], stroke) for stroke in inserted)
+
+    def extend(self, stroke, points):
+        extend_points(stroke, points)
+
+    def _position(self, stroke):
+        return next(i for i, p in enumerate(self.paths) if p is stroke)
+
+    def apply(self, op):
+        """Apply one op; True when the board changed
+
+        A malformed op raises before anything is changed.
+        """
+        kind = op.get('op')
+        if kind == 'add':
+            stroke = op['stroke']
+            if order_key(stroke) == (0, '', 0):
+                raise ValueError('add needs an "<client>:<seq>" id and a clock')
+            current = self.index.get(stroke['id'])
+            if current is not None and current.get('clock', 0) >= stroke['clock']:
+                return False    # ▶ already here (a repeat, or older)
+            if self.tombstones.buries(stroke):
+                return False
+            if current is not None:
+                i = self._position(current)
+                self.splice(i, i + 1, [])
+            i = insert_position(self.paths, stroke)
+            self.splice(i, i, [stroke])
+            return True
+        if kind == 'append':
+            stroke = self.index.get(op['id'])
+            if stroke is None:
+                return False
+            points = trim_append(stroke, op['offset'], op['points'])
+            if points is None:
+                return False
+            self.extend(stroke, points)
+            return True
+        if kind == 'remove':
+            if not is_clock(op['clock']):
+                raise ValueError('remove needs an integer clock')
+            self.tombstones.bury(op['id'], op['clock'])
+            stroke = self.index.get(op['id'])
+            if stroke is None or not self.tombstones.buries(stroke):
+                return False
+            i = self._position(stroke)
+            self.splice(i, i + 1, [])
+            return True
+        raise ValueError('unknown op %r' % kind)
@@ -0,0 +1,43 @@
+import pickle
+import zlib
+
+# --------------------------------------------------------------------
+# Compressed cold data
+#
+# A Frozen holds a value as zlib-compressed pickle bytes. Idle sessions
+# and old history entries are kept this way in memory and thawed on
+# their next use; len() still answers without thawing, so code that only
+# counts (undo depths, splice sizes) never pays for it.
+# --------------------------------------------------------------------
+COMPRESS_LEVEL = 6
+
+
+class Frozen:
+    __slots__ = ('blob', 'count')
+
+    def __init__(self, value=None, raw=None, level=COMPRESS_LEVEL):
+        if raw is None:
+            raw = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self.blob = zlib.compress(raw, level)
+        self.count = len(value) if isinstance(value, (list, tuple)) else 0
+
+    def __len__(self):
+        return self.count
+
+    def raw(self):
+        """The pickle bytes (what a snapshot stores)"""
+        return zlib.decompress(self.blob)
+
+    def thaw(self):
+        return pickle.loads(self.raw())
+
+    def __getstate__(self):
+        return self.blob, self.count
+
+    def __setstate__(self, state):
+        self.blob, self.count = state
+
+
+def thaw(value):
+    """The live value, whether or not it was frozen"""
+    return value.thaw() if isinstance(value, Frozen) else value
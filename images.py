@@ -0,0 +1,268 @@
+import base64
+import hashlib
+import io
+import mimetypes
+import multiprocessing
+import os
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:             # ▶ optional: uploads are then stored as sent
+    Image = None
+
+# --------------------------------------------------------------------
+# Content-addressed background image cache
+#
+# Images are stored once per sha256 under <directory>/<hash>.<ext>, so a
+# worksheet reused across sessions costs one file. The least recently
+# used files are deleted once the directory grows past max_bytes.
+#
+# max_bytes is a soft bound. Each worker only counts the files it wrote
+# or looked up, and it never deletes a file that `in_use()` names (the
+# boards open on this worker) or that was written or looked up, by any
+# worker, in the last `keep_recent` seconds; a lookup touches the file.
+# A board left idle for longer can lose its background, so size the cap
+# for the worksheets you expect to keep.
+#
+# hard_bytes (default twice max_bytes) is not: past it the oldest files
+# go even if recent, so a burst of fresh uploads can't fill the disk.
+# Only the boards open here are still spared.
+# --------------------------------------------------------------------
+KEEP_RECENT = 24 * 3600
+IMAGE_TYPES = {
+    'image/png': '.png',
+    'image/jpeg': '.jpg',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'image/svg+xml': '.svg',
+}
+
+_DATA_URL = re.compile(r'^data:([\w/+.-]+)?((?:;[\w=.-]+)*);base64,', re.I)
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+def decode_data_url(value):
+    """(bytes, mimetype) from a base64 data URL, or None if it isn't one"""
+    match = _DATA_URL.match(value or '')
+    if not match:
+        return None
+    try:
+        data = base64.b64decode(value[match.end():], validate=False)
+    except ValueError:
+        return None
+    return data, (match.group(1) or 'application/octet-stream').lower()
+
+
+class ImageCache:
+    def __init__(self, directory, max_bytes, in_use=None,
+                 keep_recent=KEEP_RECENT, hard_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hard_bytes = 2 * max_bytes if hard_bytes is None else hard_bytes
+        self.in_use = in_use or set
+        self.keep_recent = keep_recent
+        self.entries = OrderedDict()    # ▶ digest -> (filename, size), LRU first
+        self.total = 0
+        os.makedirs(directory, exist_ok=True)
+
+        files = [e for e in os.scandir(directory) if e.is_file()
+                 and _DIGEST.match(os.path.splitext(e.name)[0])]
+        for entry in sorted(files, key=lambda e: e.stat().st_mtime):
+            self._remember(os.path.splitext(entry.name)[0], entry.name,
+                           entry.stat().st_size)
+
+    def __contains__(self, digest):
+        return self.lookup(digest) is not None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _remember(self, digest, filename, size):
+        self.entries[digest] = (filename, size)
+        self.total += size
+
+    def put(self, data, mimetype):
+        """Store image bytes and return their content hash"""
+        digest = hashlib.sha256(data).hexdigest()
+        if self.lookup(digest) is not None:
+            return digest
+
+        filename = digest + IMAGE_TYPES.get(mimetype, '')
+        path = os.path.join(self.directory, filename)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, path)           # ▶ readers never see half a file
+        self._remember(digest, filename, len(data))
+        self._evict(keep=digest)
+        return digest
+
+    def lookup(self, digest):
+        """(path, mimetype) for a stored image, or None"""
+        if not _DIGEST.match(digest or ''):
+            return None
+        entry = self.entries.get(digest)
+        if entry is not None and not self._touch(entry[0]):
+            del self.entries[digest]            # ▶ evicted by another worker
+            self.total -= entry[1]
+            entry = None
+        if entry is None:
+            entry = self._find_on_disk(digest)  # ▶ written by another worker
+            if entry is None:
+                return None
+        self.entries.move_to_end(digest)
+        filename = entry[0]
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        return os.path.join(self.directory, filename), mimetype
+
+    def _touch(self, filename):
+        """Mark a file as just used; False if it is gone"""
+        try:
+            os.utime(os.path.join(self.directory, filename))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _find_on_disk(self, digest):
+        for ext in IMAGE_TYPES.values():
+            filename = digest + ext
+            if self._touch(filename):
+                size = os.path.getsize(os.path.join(self.directory, filename))
+                self._remember(digest, filename, size)
+                return self.entries[digest]
+        return None
+
+    def _evict(self, keep=None):
+        if self.total <= self.max_bytes:
+            return
+        spared = set(self.in_use())
+        spared.add(keep)
+        self._evict_to(self.max_bytes, spared, time.time() - self.keep_recent)
+        if self.total > self.hard_bytes:
+            self._evict_to(self.hard_bytes, spared, None)
+
+    def _evict_to(self, limit, spared, cutoff):
+        """Delete least recently used files until total <= limit
+
+        Files touched after `cutoff` are kept; None keeps none of them.
+        """
+        for digest, (filename, size) in list(self.entries.items()):
+            if self.total <= limit:
+                break
+            if digest in spared:
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                if cutoff is not None and os.path.getmtime(path) > cutoff:
+                    continue        # ▶ used lately, maybe by another worker
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            del self.entries[digest]
+            self.total -= size
+
+
+# --------------------------------------------------------------------
+# Upload normalization
+#
+# Raster uploads are decoded, scaled down to fit max_side x max_side and
+# re-encoded (WebP, else JPEG / PNG) in worker processes, so a phone
+# photo never holds up the event loop. A tiny preview comes back as a
+# data URL: clients paint it from the socket event straight away and
+# swap in the full image once /backgrounds/<hash> has loaded. SVG and
+# GIF (possibly animated) are kept exactly as sent.
+# --------------------------------------------------------------------
+NORMALIZED_TYPES = ('image/png', 'image/jpeg', 'image/webp')
+PREVIEW_QUALITY = 40
+
+
+def _encode(image, quality, alpha):
+    out = io.BytesIO()
+    if features.check('webp'):
+        image.save(out, 'WEBP', quality=quality, method=4)
+        mimetype = 'image/webp'
+    elif alpha:
+        image.save(out, 'PNG', optimize=True)
+        mimetype = 'image/png'
+    else:
+        image.save(out, 'JPEG', quality=quality, optimize=True,
+                   progressive=True)
+        mimetype = 'image/jpeg'
+    return out.getvalue(), mimetype
+
+
+def normalize(data, max_side, quality, preview_side):
+    """(data, mimetype, preview data URL) for an upload – runs in a worker
+
+    An image that already fits keeps its bytes unless re-encoding makes
+    it smaller. Raises ValueError for bytes Pillow can't decode.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        source_type = Image.MIME.get(image.format)
+        image.draft('RGB', (max_side, max_side))   # ▶ JPEG: decode pre-scaled
+        image = ImageOps.exif_transpose(image)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as exc:
+        raise ValueError('undecodable image: %s' % exc)
+
+    alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    image = image.convert('RGBA' if alpha else 'RGB')
+    fits = max(image.size) <= max_side
+    image.thumbnail((max_side, max_side))
+    body, mimetype = _encode(image, quality, alpha)
+    if fits and len(body) >= len(data) and source_type in NORMALIZED_TYPES:
+        body, mimetype = data, source_type
+
+    image.thumbnail((preview_side, preview_side))
+    preview, preview_type = _encode(image, PREVIEW_QUALITY, alpha)
+    return body, mimetype, 'data:%s;base64,%s' % (
+        preview_type, base64.b64encode(preview).decode('ascii'))
+
+
+class ImagePipeline:
+    """Runs normalize() in a pool of `workers` processes
+
+    wait(fn, *args) runs blocking work so only the calling green thread
+    waits (see persistence.run_blocking); workers=0 normalizes inline
+    that way. collect(future) gives a pool result back the same way
+    (persistence.wait_for; by default wait(future.result)). Without
+    Pillow, process() passes uploads through.
+    """
+
+    def __init__(self, workers, wait, max_side, quality, preview_side,
+                 collect=None):
+        self.workers = workers
+        self.wait = wait
+        self.collect = collect or (lambda future: wait(future.result))
+        self.options = (max_side, quality, preview_side)
+        self.pool = None
+
+    def process(self, data, mimetype):
+        """(data, mimetype, preview data URL or None); ValueError if broken"""
+        if Image is None or mimetype not in NORMALIZED_TYPES:
+            return data, mimetype, None
+        if not self.workers:
+            return self.wait(normalize, data, *self.options)
+        future = self._pool().submit(normalize, data, *self.options)
+        try:
+            return self.collect(future)
+        except BrokenProcessPool:
+            self.pool = None            # ▶ a worker died (e.g. out of memory)
+            raise ValueError('image worker crashed')
+
+    def _pool(self):
+        if self.pool is None:
+            # ▶ spawn: forking a process that runs an event loop is unsafe
+            self.pool = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
@@ -0,0 +1,150 @@
+import re
+import time
+
+# --------------------------------------------------------------------
+# Inbound limits
+#
+# TokenBucket / RateLimiter throttle events per socket and per room, with
+# one (rate per second, burst) rule per event name and '*' for the rest.
+# MessageGuard sits in front of Socket.IO's packet decoder and drops any
+# message over its event's byte cap before a byte of it is parsed.
+# --------------------------------------------------------------------
+def parse_rules(text, convert=float):
+    """'update_paths=10/20,*=50/100' -> {'update_paths': (10.0, 20.0), ...}
+
+    Values without a '/' (size caps) come back as a single number.
+    """
+    rules = {}
+    for item in (text or '').split(','):
+        name, _, value = item.strip().partition('=')
+        if not name or not value:
+            continue
+        parts = [convert(v) for v in value.split('/')]
+        rules[name] = tuple(parts) if len(parts) > 1 else parts[0]
+    return rules
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def take(self, now, cost=1):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+
+class RateLimiter:
+    """Buckets per (key, event); rules: {event: (rate, burst)}, '*' default"""
+
+    def __init__(self, rules, clock=time.monotonic):
+        self.rules = rules
+        self.clock = clock
+        self.buckets = {}           # ▶ key -> {event -> TokenBucket}
+
+    def allow(self, key, event):
+        rule = self.rules.get(event, self.rules.get('*'))
+        if rule is None:
+            return True
+        now = self.clock()
+        buckets = self.buckets.setdefault(key, {})
+        bucket = buckets.get(event)
+        if bucket is None:
+            bucket = buckets[event] = TokenBucket(rule[0], rule[1], now)
+        return bucket.take(now)
+
+    def forget(self, key):
+        self.buckets.pop(key, None)
+
+    def prune(self):
+        """Drop keys whose buckets have all refilled – nothing to remember"""
+        now = self.clock()
+        for key, buckets in list(self.buckets.items()):
+            if all(b.tokens + (now - b.stamp) * b.rate >= b.burst
+                   for b in buckets.values()):
+                del self.buckets[key]
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+# type, optional attachment count, namespace, ack id, then the event name
+_EVENT_HEAD = re.compile(r'^([25])(?:(\d+)-)?(?:/[^,]*,)?\d*\["((?:[^"\\]|\\.)*)"')
+
+
+class MessageGuard:
+    """Wraps Engine.IO's 'message' handler with per-event size caps
+
+    caps: {event: max bytes, '*': default}. A text packet is checked
+    against its event's cap, found with a regex on its first bytes; a
+    binary event's attachments count against the same cap. Rejected
+    messages never reach the decoder. on_reject(eio_sid, event, size,
+    fatal) hears of each one; `fatal` means Socket.IO was already
+    half-way through the packet, so the socket has to be closed.
+    """
+
+    def __init__(self, caps, on_reject):
+        self.caps = caps
+        self.largest = max(caps.values()) if caps else None
+        self.default = caps.get('*', self.largest)
+        self.on_reject = on_reject
+        self.pending = {}           # ▶ eio_sid -> [event, bytes left, attachments left, refused]
+
+    def cap(self, event):
+        return self.caps.get(event, self.default)
+
+    def wrap(self, handler):
+        def guarded(eio_sid, data):
+            if self.check(eio_sid, data):
+                return handler(eio_sid, data)
+        return guarded
+
+    def check(self, eio_sid, data):
+        """True to let the message through"""
+        pending = self.pending.get(eio_sid)
+        if pending is not None and not isinstance(data, str):
+            return self._attachment(eio_sid, pending, len(data))
+        if not isinstance(data, str):
+            # ▶ msgpack frames: no cheap peek at the event name
+            return self._fits(eio_sid, None, self.largest, len(data))
+
+        match = _EVENT_HEAD.match(data)
+        event = match.group(3) if match else None
+        cap = self.cap(event)
+        fits = self._fits(eio_sid, event, cap, len(data))
+        attachments = int(match.group(2) or 0) if match else 0
+        if attachments:
+            budget = None if cap is None else cap - len(data)
+            self.pending[eio_sid] = [event, budget, attachments, not fits]
+        return fits
+
+    def _fits(self, eio_sid, event, cap, size, fatal=False):
+        if cap is None or size <= cap:
+            return True
+        self.on_reject(eio_sid, event, size, fatal)
+        return False
+
+    def _attachment(self, eio_sid, pending, size):
+        event, budget, left, refused = pending
+        pending[2] = left - 1
+        if pending[2] <= 0:
+            del self.pending[eio_sid]
+        if refused:
+            return False            # ▶ its header never got through
+        if budget is not None:
+            pending[1] = budget - size
+            if pending[1] < 0:
+                self.pending.pop(eio_sid, None)
+                return self._fits(eio_sid, event, 0, size, fatal=True)
+        return True
+
+    def forget(self, eio_sid):
+        self.pending.pop(eio_sid, None)
@@ -0,0 +1,435 @@
+"""Load test for the whiteboard Socket.IO server
+
+    python loadtest.py --rooms 10 --clients 8 --duration 30 --output run.json
+    python loadtest.py ... --baseline run.json      # compare with an older run
+
+Starts server.py on a free local port (or targets --url), connects
+rooms x clients python-socketio clients and has each one fire a weighted
+mix of board operations at --rate per second. Reports throughput,
+p50/p95/p99 latency per event, join latency, server memory per session
+and server CPU per operation; --output saves all of it as JSON.
+
+Broadcast latency is measured from the sender's emit to a peer receiving
+the event, so every room needs at least two clients; a background is
+POSTed to /backgrounds first (timed as background_upload) and its
+broadcast timed from the update_background emit. Server memory and
+CPU come from /proc and are only reported for a server started here.
+The server's own rate limits apply: raise SOCKET_RATE_LIMITS,
+ROOM_RATE_LIMITS and UPLOAD_RATE_LIMIT in the environment for runs above
+them.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+
+import requests
+import socketio
+
+DEFAULT_MIX = 'update_paths=4,add_stroke=3,append_points=6,undo_request=1,' \
+              'update_background=0.1,join=0.2'
+PERCENTILES = (50, 95, 99)
+
+# --------------------------------------------------------------------
+# Measurements
+# --------------------------------------------------------------------
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = {}              # ▶ op id -> perf_counter() at emit
+        self.latency = {}           # ▶ event -> [seconds]
+        self.ops = {}               # ▶ op -> count emitted
+        self.received = 0
+        self.errors = 0
+
+    def start(self, op, op_id=None):
+        with self.lock:
+            self.ops[op] = self.ops.get(op, 0) + 1
+            if op_id is not None:
+                self.sent[op_id] = time.perf_counter()
+
+    def arrived(self, event, op_id):
+        now = time.perf_counter()
+        with self.lock:
+            self.received += 1
+            sent = self.sent.get(op_id)
+            if sent is not None:
+                self.latency.setdefault(event, []).append(now - sent)
+
+    def observe(self, event, seconds):
+        with self.lock:
+            self.latency.setdefault(event, []).append(seconds)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(values):
+    summary = {'count': len(values)}
+    for pct in PERCENTILES:
+        value = percentile(values, pct)
+        summary['p%d_ms' % pct] = None if value is None else round(value * 1000, 3)
+    return summary
+
+# --------------------------------------------------------------------
+# Server process (/proc accounting, Linux only)
+# --------------------------------------------------------------------
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, env):
+    # ▶ without eventlet / gevent this is Werkzeug's dev server, which
+    #   socketio.run refuses to start unless told it is fine
+    code = ('import server; server.socketio.run(server.app, '
+            'host="127.0.0.1", port=%d, log_output=False, '
+            'allow_unsafe_werkzeug=True)' % port)
+    proc = subprocess.Popen([sys.executable, '-c', code], env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.DEVNULL)
+    url = 'http://127.0.0.1:%d' % port
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit('server exited with code %s' % proc.returncode)
+        try:
+            requests.get(url + '/', timeout=1)
+            return proc, url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit('server did not start within 30s')
+
+
+def process_usage(pid):
+    """(rss bytes, cpu seconds) of a process, or (None, None)"""
+    try:
+        with open('/proc/%d/status' % pid) as fh:
+            rss = next(int(line.split()[1]) * 1024 for line in fh
+                       if line.startswith('VmRSS:'))
+        with open('/proc/%d/stat' % pid) as fh:
+            fields = fh.read().rsplit(')', 1)[1].split()
+        ticks = os.sysconf('SC_CLK_TCK')
+        return rss, (int(fields[11]) + int(fields[12])) / ticks
+    except (OSError, StopIteration, ValueError):
+        return None, None
+
+# --------------------------------------------------------------------
+# Simulated clients
+# --------------------------------------------------------------------
+def points_id(stroke_id, points):
+    """Appends carry no id of their own: stroke id + first x identifies one"""
+    if isinstance(points, (bytes, bytearray)):
+        x = struct.unpack_from('<f', points)[0] if len(points) >= 4 else 0
+    else:
+        x = points[0]['x'] if points else 0
+    return '%s/%.2f' % (stroke_id, x)
+
+
+def op_id_of(event, payload):
+    """Which emitted op a broadcast event belongs to, if any"""
+    if event == 'stroke_added':
+        return payload['stroke'].get('id')
+    if event == 'points_appended':
+        return points_id(payload['id'], payload['points'])
+    if event == 'paths_update' and payload.get('paths'):
+        return payload['paths'][-1].get('id')
+    if event == 'background_update':
+        return payload.get('background_hash')
+    return None
+
+
+def noise_png(size):
+    """A real RGB PNG of random pixels, about `size` bytes, never repeated"""
+    side = max(1, int((size / 3) ** 0.5))
+    rows = b''.join(b'\0' + os.urandom(side * 3) for _ in range(side))
+
+    def chunk(kind, body):
+        crc = zlib.crc32(kind + body) & 0xffffffff
+        return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', crc)
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', side, side, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows, 1))
+            + chunk(b'IEND', b''))
+
+
+class Client:
+    def __init__(self, url, room, args, stats):
+        self.url = url
+        self.room = room
+        self.args = args
+        self.stats = stats
+        self.paths = []
+        self.own_strokes = []
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('*', self.on_event)
+
+    def query(self):
+        return '%s/?session_code=%s&encoding=%s' % (self.url, self.room,
+                                                    self.args.encoding)
+
+    def connect(self):
+        joined = threading.Event()
+
+        def on_session_data(data):
+            self.paths = data['paths']
+            joined.set()
+
+        self.sio.on('session_data', on_session_data)
+        start = time.perf_counter()
+        self.sio.connect(self.query(), transports=['websocket'])
+        if not joined.wait(10):
+            raise RuntimeError('no session_data for %s' % self.room)
+        self.stats.observe('join', time.perf_counter() - start)
+
+    def on_event(self, event, data=None):
+        if event == 'batch':
+            for name, payload in data['events']:
+                self.on_event(name, payload)
+            return
+        if event == 'paths_update':
+            self.paths = data['paths']
+        elif event == 'stroke_added':
+            self.paths.append(data['stroke'])
+        if isinstance(data, dict):
+            self.stats.arrived(event, op_id_of(event, data))
+
+    def stroke(self, op_id):
+        points = [{'x': random.uniform(0, 1000), 'y': random.uniform(0, 800)}
+                  for _ in range(self.args.points)]
+        return {'id': op_id, 'points': points, 'color': '#000', 'width': 2}
+
+    # ▶ one method per op in the mix
+    def update_paths(self):
+        op_id = uuid.uuid4().hex
+        paths = (self.paths + [self.stroke(op_id)])[-self.args.max_strokes:]
+        self.paths = paths
+        self.stats.start('update_paths', op_id)
+        self.sio.emit('update_paths', {'session_code': self.room,
+                                       'paths': paths})
+
+    def add_stroke(self):
+        op_id = uuid.uuid4().hex
+        self.own_strokes = (self.own_strokes + [op_id])[-8:]
+        self.stats.start('add_stroke', op_id)
+        self.sio.emit('add_stroke', {'session_code': self.room,
+                                     'stroke': self.stroke(op_id)})
+
+    def append_points(self):
+        if not self.own_strokes:
+            return self.add_stroke()
+        points = [{'x': random.uniform(0, 1000), 'y': random.uniform(0, 800)}
+                  for _ in range(4)]
+        stroke_id = self.own_strokes[-1]
+        self.stats.start('append_points', points_id(stroke_id, points))
+        self.sio.emit('append_points', {'session_code': self.room,
+                                        'id': stroke_id, 'points': points})
+
+    def undo_request(self):
+        start = time.perf_counter()
+        self.stats.start('undo_request')
+        self.sio.emit('undo_request', {'session_code': self.room},
+                      callback=lambda *_: self.stats.observe(
+                          'undo_ack', time.perf_counter() - start))
+
+    def update_background(self):
+        # ▶ the server re-encodes uploads, so the hash peers see is the
+        #   one POST /backgrounds returns, not a hash of what was sent
+        start = time.perf_counter()
+        reply = requests.post(self.url + '/backgrounds',
+                              data=noise_png(self.args.background_bytes),
+                              headers={'Content-Type': 'image/png'}, timeout=30)
+        reply.raise_for_status()        # ▶ counted as an error by run()
+        self.stats.observe('background_upload', time.perf_counter() - start)
+        stored = reply.json()
+        self.stats.start('update_background', stored['hash'])
+        self.sio.emit('update_background', {
+            'session_code': self.room, 'background_hash': stored['hash'],
+            'background_preview': stored['preview']})
+
+    def join(self):
+        self.stats.start('join')
+        extra = Client(self.url, self.room, self.args, self.stats)
+        try:
+            extra.connect()
+        finally:
+            extra.sio.disconnect()
+
+    def run(self, ops, weights, until):
+        interval = 1.0 / self.args.rate
+        next_at = time.perf_counter() + random.uniform(0, interval)
+        while time.perf_counter() < until:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_at += interval
+            try:
+                getattr(self, random.choices(ops, weights)[0])()
+            except Exception:
+                with self.stats.lock:
+                    self.stats.errors += 1
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if not hasattr(Client, name.strip()):
+            raise SystemExit('unknown op in --mix: %s' % name)
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+# --------------------------------------------------------------------
+# Run
+# --------------------------------------------------------------------
+def run(args):
+    proc = None
+    url = args.url
+    if not url:
+        env = dict(os.environ)
+        env.setdefault('BACKGROUND_DIR', tempfile.mkdtemp(prefix='loadtest-bg-'))
+        proc, url = start_server(free_port(), env)
+    try:
+        return measure(args, url, proc)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(10)
+
+
+def measure(args, url, proc):
+    stats = Stats()
+    mix = parse_mix(args.mix)
+    rss_base, cpu_base = process_usage(proc.pid) if proc else (None, None)
+
+    clients = [Client(url, 'load-%d' % room, args, stats)
+               for room in range(args.rooms) for _ in range(args.clients)]
+    for client in clients:
+        client.connect()
+    stats.latency.pop('join', None)     # ▶ cold joins are not the steady state
+    rss_joined, cpu_joined = process_usage(proc.pid) if proc else (None, None)
+
+    until = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=c.run, daemon=True,
+                                args=(list(mix), list(mix.values()), until))
+               for c in clients]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    time.sleep(args.drain)              # ▶ let in-flight broadcasts land
+    rss_end, cpu_end = process_usage(proc.pid) if proc else (None, None)
+
+    for client in clients:
+        try:
+            client.sio.disconnect()
+        except Exception:
+            pass
+
+    sent = sum(stats.ops.values())
+    result = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('output', 'baseline')},
+        'elapsed_s': round(elapsed, 3),
+        'ops_sent': stats.ops,
+        'ops_per_s': round(sent / elapsed, 1),
+        'events_received_per_s': round(stats.received / elapsed, 1),
+        'errors': stats.errors,
+        'latency': {event: summarize(values)
+                    for event, values in sorted(stats.latency.items())},
+        'server': None,
+    }
+    if rss_base is not None and rss_end is not None:
+        result['server'] = {
+            'rss_base_bytes': rss_base,
+            'rss_end_bytes': rss_end,
+            'rss_per_session_bytes': (rss_end - rss_base) // max(args.rooms, 1),
+            'rss_per_client_joined_bytes':
+                (rss_joined - rss_base) // max(len(clients), 1),
+            'cpu_s': round(cpu_end - cpu_joined, 3),
+            'cpu_ms_per_op': round((cpu_end - cpu_joined) * 1000 / max(sent, 1), 4),
+        }
+    return result
+
+
+def print_report(result, baseline=None):
+    print('%(ops_per_s)s ops/s sent, %(events_received_per_s)s events/s '
+          'received, %(errors)s errors in %(elapsed_s)ss' % result)
+    for event, summary in result['latency'].items():
+        line = '  %-20s n=%-7d p50 %8s ms  p95 %8s ms  p99 %8s ms' % (
+            event, summary['count'], summary['p50_ms'], summary['p95_ms'],
+            summary['p99_ms'])
+        old = (baseline or {}).get('latency', {}).get(event)
+        if old and old.get('p95_ms') and summary['p95_ms'] is not None:
+            line += '  (p95 %+.1f%% vs baseline)' % (
+                (summary['p95_ms'] / old['p95_ms'] - 1) * 100)
+        print(line)
+    server = result['server']
+    if server:
+        print('  server: %.1f KiB/session, %.1f KiB/client, %s ms CPU/op' % (
+            server['rss_per_session_bytes'] / 1024.0,
+            server['rss_per_client_joined_bytes'] / 1024.0,
+            server['cpu_ms_per_op']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', help='target a running server instead')
+    parser.add_argument('--rooms', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=5,
+                        help='clients per room (>= 2 to measure broadcasts)')
+    parser.add_argument('--duration', type=float, default=15, help='seconds')
+    parser.add_argument('--rate', type=float, default=5,
+                        help='operations per second per client')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='weighted ops, e.g. "%s"' % DEFAULT_MIX)
+    parser.add_argument('--points', type=int, default=40,
+                        help='points per new stroke')
+    parser.add_argument('--max-strokes', type=int, default=200,
+                        help='board size update_paths keeps to')
+    parser.add_argument('--background-bytes', type=int, default=20000,
+                        help='approximate size of each uploaded PNG')
+    parser.add_argument('--encoding', default='json', choices=('json', 'packed'))
+    parser.add_argument('--drain', type=float, default=1.0,
+                        help='seconds to wait for in-flight events')
+    parser.add_argument('--output', help='write the results as JSON here')
+    parser.add_argument('--baseline', help='JSON of an earlier run to compare')
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(result, fh, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
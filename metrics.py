@@ -0,0 +1,137 @@
+import bisect
+import time
+from functools import wraps
+
+# --------------------------------------------------------------------
+# Prometheus text-format metrics
+#
+# Just enough of the exposition format for a /metrics route, without a
+# client library: counters and histograms updated in place on the hot
+# path (a dict lookup and an add), gauges computed only when scraped.
+# Eventlet green threads never preempt mid-update, so no locking.
+# --------------------------------------------------------------------
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5,
+                   1, 2.5)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ('%s="%s"' % (name, str(value).replace('\\', r'\\')
+                          .replace('"', r'\"').replace('\n', r'\n'))
+             for name, value in zip(names, values))
+    return '{%s}' % ','.join(pairs)
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.values = {}
+
+    def inc(self, amount=1, *labels):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield self.name, _labels(self.label_names, labels), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}            # ▶ labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[i] += 1          # ▶ cumulated when rendered
+        series[-2] += value
+        series[-1] += 1
+
+    def time(self, *labels):
+        """Decorator recording how long each call takes"""
+        def decorate(fn):
+            @wraps(fn)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                result = fn(*args, **kwargs)
+                self.observe(time.perf_counter() - start, *labels)
+                return result
+            return timed
+        return decorate
+
+    def samples(self):
+        names = self.label_names + ('le',)
+        for labels, series in sorted(self.series.items()):
+            total = 0
+            for bound, count in zip(self.buckets, series):
+                total += count
+                yield (self.name + '_bucket',
+                       _labels(names, labels + (_number(bound),)), total)
+            yield (self.name + '_bucket',
+                   _labels(names, labels + ('+Inf',)), series[-1])
+            yield self.name + '_sum', _labels(self.label_names, labels), series[-2]
+            yield self.name + '_count', _labels(self.label_names, labels), series[-1]
+
+
+class Gauge:
+    """Value computed at scrape time: fn() -> number or {labels: number}
+
+    kind='counter' exposes a running total kept elsewhere.
+    """
+
+    def __init__(self, name, help, fn, labels=(), kind='gauge'):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            yield self.name, '', value
+            return
+        for labels, v in sorted(value.items()):
+            if not isinstance(labels, tuple):
+                labels = (labels,)
+            yield self.name, _labels(self.label_names, labels), v
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, fn, labels=(), kind='gauge'):
+        return self._add(Gauge(name, help, fn, labels, kind))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('%s%s %s' % (name, labels, _number(value)))
+        return '\n'.join(lines) + '\n'
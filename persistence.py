@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import threading
+import time
+
+# --------------------------------------------------------------------
+# Blocking work off the event loop
+# --------------------------------------------------------------------
+def run_blocking(async_mode, fn, *args):
+    """Run fn in a real OS thread; the calling green thread just waits"""
+    if async_mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args)
+    if async_mode == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args)
+    return fn(*args)    # ▶ threading mode: already off any shared loop
+
+
+def wait_for(async_mode, future):
+    """Result of a concurrent.futures future, waited for by the calling
+    green thread itself rather than by a pool thread parked on it"""
+    if async_mode == 'eventlet':
+        from eventlet.event import Event
+        done = Event()
+        future.add_done_callback(lambda _: done.send())
+        done.wait()
+        return future.result()
+    return run_blocking(async_mode, future.result)
+
+
+def thread_lock(async_mode):
+    """A lock that excludes real OS threads even after monkey patching
+
+    Under eventlet / gevent threading.Lock is green: the pool threads
+    run_blocking hands work to would not exclude each other with it.
+    """
+    if async_mode == 'eventlet':
+        from eventlet import patcher
+        return patcher.original('threading').Lock()
+    if async_mode == 'gevent':
+        from gevent import monkey
+        return monkey.get_original('threading', 'Lock')()
+    return threading.Lock()
+
+
+# --------------------------------------------------------------------
+# SQLite session snapshots
+#
+# One row per session holding its pickled state. Each row carries the
+# sequence number of the pickle it came from, so an older write that
+# finishes late can never clobber a newer one.
+# --------------------------------------------------------------------
+class SnapshotStore:
+    def __init__(self, path, async_mode=None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.lock = thread_lock(async_mode)     # ▶ taken in pool threads
+        self.db = sqlite3.connect(path, check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                        ' code TEXT PRIMARY KEY,'
+                        ' seq INTEGER NOT NULL,'
+                        ' saved_at REAL NOT NULL,'
+                        ' data BLOB NOT NULL)')
+        self.seq = self.db.execute(
+            'SELECT COALESCE(MAX(seq), 0) FROM sessions').fetchone()[0]
+
+    def next_seq(self):
+        """Sequence number for a pickle taken now (call on the loop)"""
+        self.seq += 1
+        return self.seq
+
+    def load(self, session_code):
+        with self.lock:
+            row = self.db.execute('SELECT data FROM sessions WHERE code = ?',
+                                  (session_code,)).fetchone()
+        return row[0] if row else None
+
+    def save_many(self, rows):
+        """rows: iterable of (session_code, seq, pickled bytes)"""
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN')
+            try:
+                self.db.executemany(
+                    'INSERT INTO sessions (code, seq, saved_at, data)'
+                    ' VALUES (?, ?, ?, ?)'
+                    ' ON CONFLICT(code) DO UPDATE SET'
+                    '  seq = excluded.seq, saved_at = excluded.saved_at,'
+                    '  data = excluded.data'
+                    ' WHERE excluded.seq > sessions.seq',
+                    [(code, seq, now, data) for code, seq, data in rows])
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def delete(self, session_code):
+        with self.lock:
+            self.db.execute('DELETE FROM sessions WHERE code = ?',
+                            (session_code,))
+
+    def codes(self):
+        with self.lock:
+            return [row[0] for row in
+                    self.db.execute('SELECT code FROM sessions')]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
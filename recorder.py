@@ -0,0 +1,230 @@
+import base64
+import fcntl
+import json
+import logging
+import os
+import time
+from urllib.parse import quote
+
+from codec import JSON, detach_stroke, encode_payload, encode_strokes
+
+# --------------------------------------------------------------------
+# Session recordings
+#
+# One append-only NDJSON log per session under <directory>/<code>.ndjson:
+#
+#   {"t": <unix time>, "v": <version>, "e": <event>, "p": <payload>}
+#   {"t": ..., "v": ..., "k": <session_data as a JSON client sees it>}
+#
+# Op lines are the board operations exactly as the op log keeps them; a
+# keyframe ("k") line holds the whole render state after version v and
+# is written when a board is first seen, whenever board_id changes and
+# every `keyframe_every` ops. <code>.idx lists each keyframe's time,
+# version and byte offset, so a replay can start at any point by seeking
+# to the last keyframe before it instead of reading from the top.
+#
+# record() / keyframe() only queue what the op log already detached;
+# flush() encodes and writes the queue through run_blocking, batched per
+# session, under an flock so replicas can share the directory. Call it
+# from one task only (the server's timer task): two flushes in flight
+# could land their batches out of order.
+#
+# Entries are encoded one by one, so a value JSON can't take costs only
+# its own line (counted in `dropped`). A session that lost a line, or
+# its keyframe, is keyed again on its next op; its log stays replayable
+# from there.
+# --------------------------------------------------------------------
+KEYFRAME_EVERY = 500            # ▶ ops between keyframes
+READ_CHUNK = 64 * 1024
+
+log = logging.getLogger(__name__)
+
+
+def _jsonable(value):
+    """Stand-in for what a client sent as a binary attachment"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    raise TypeError('%s is not JSON serializable' % type(value).__name__)
+
+
+def _line(entry):
+    return json.dumps(entry, separators=(',', ':'),
+                      default=_jsonable).encode('utf-8') + b'\n'
+
+
+class Recorder:
+    def __init__(self, directory, run_blocking=None,
+                 keyframe_every=KEYFRAME_EVERY):
+        self.directory = directory
+        self.run_blocking = run_blocking or (lambda fn, *args: fn(*args))
+        self.keyframe_every = keyframe_every
+        self.pending = []           # ▶ (code, t, version, event, payload)
+        self.keyed = {}             # ▶ code -> (board_id, version) of last keyframe
+        self.dropped = 0            # ▶ entries that could not be encoded
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_code, ext):
+        name = quote(session_code, safe='')
+        if len(name) > 200:
+            return None             # ▶ not a code anyone types
+        return os.path.join(self.directory, name + ext)
+
+    def needs_keyframe(self, session_code, board_id, version):
+        last = self.keyed.get(session_code)
+        return (last is None or last[0] != board_id
+                or version - last[1] >= self.keyframe_every)
+
+    def record(self, session_code, version, event, payload):
+        """Queue one applied op; payload must no longer share the board"""
+        self.pending.append((session_code, time.time(), version, event, payload))
+
+    def keyframe(self, session_code, board_id, version, state):
+        """Queue a render state; its strokes are detached here, on the loop
+
+        The session counts as keyed from now on; a flush that fails to
+        write the keyframe takes that back.
+        """
+        state = dict(state, paths=[detach_stroke(p) for p in state['paths']])
+        self.keyed[session_code] = (board_id, version)
+        self.pending.append((session_code, time.time(), version, None, state))
+
+    def forget(self, session_code):
+        """A released session starts with a keyframe if it comes back"""
+        self.keyed.pop(session_code, None)
+
+    def flush(self):
+        """Write everything queued; returns how many entries it took"""
+        if not self.pending:
+            return 0
+        batch, self.pending = self.pending, []
+        failed = {entry[0] for entry in batch}
+        try:
+            failed = self.run_blocking(self._write, batch)
+        finally:
+            for session_code in failed:
+                self.keyed.pop(session_code, None)
+        return len(batch)
+
+    def _write(self, batch):
+        """Write a batch; returns the codes of sessions that lost lines"""
+        sessions, failed = {}, set()
+        for entry in batch:
+            sessions.setdefault(entry[0], []).append(entry[1:])
+        for session_code, entries in sessions.items():
+            path = self._path(session_code, '.ndjson')
+            if path is None:
+                continue
+            lines, keyframes = self._encode(entries)
+            if len(lines) < len(entries):
+                failed.add(session_code)
+            if not lines:
+                continue
+            try:
+                self._append(session_code, path, lines, keyframes)
+            except OSError:
+                log.exception('recording %r failed', session_code)
+                failed.add(session_code)
+        return failed
+
+    def _encode(self, entries):
+        """(lines, keyframes) of the entries JSON can take
+
+        Once a keyframe fails, the ops after it would replay onto nothing;
+        they are left out until the next keyframe.
+        """
+        lines, keyframes, keyed = [], [], True
+        for t, version, event, payload in entries:
+            try:
+                if event is None:
+                    line = _line({'t': t, 'v': version,
+                                  'k': dict(payload, paths=encode_strokes(
+                                      payload['paths'], JSON))})
+                elif keyed:
+                    line = _line({'t': t, 'v': version, 'e': event,
+                                  'p': encode_payload(payload, JSON)})
+                else:
+                    continue
+            except (TypeError, ValueError):
+                self.dropped += 1
+                if event is None:
+                    keyed = False
+                continue
+            if event is None:
+                keyed = True
+                keyframes.append((len(lines), t, version))
+            lines.append(line)
+        return lines, keyframes
+
+    def _append(self, session_code, path, lines, keyframes):
+        with open(path, 'ab') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)     # ▶ released on close
+            offset = fh.seek(0, os.SEEK_END)
+            fh.write(b''.join(lines))
+            if not keyframes:
+                return
+            # ▶ still under the lock, so .idx offsets stay in log order
+            starts = [offset]
+            for line in lines:
+                starts.append(starts[-1] + len(line))
+            with open(self._path(session_code, '.idx'), 'ab') as idx:
+                idx.write(b''.join(
+                    _line({'t': t, 'v': version, 'o': starts[i]})
+                    for i, t, version in keyframes))
+
+    def close(self):
+        self.flush()
+
+    # ----------------------------------------------------------------
+    # Reading – everything streams; nothing loads a whole log
+    # ----------------------------------------------------------------
+    def exists(self, session_code):
+        path = self._path(session_code, '.ndjson')
+        return path is not None and os.path.exists(path)
+
+    def keyframes(self, session_code):
+        """[{t, v, o}, ...] oldest first"""
+        path = self._path(session_code, '.idx')
+        if path is None or not os.path.exists(path):
+            return []
+        with open(path, 'rb') as fh:
+            return [json.loads(line) for line in fh if line.endswith(b'\n')]
+
+    def _seek(self, session_code, start):
+        """Offset of the last keyframe at or before `start`"""
+        offset = 0
+        path = self._path(session_code, '.idx')
+        if start is None or path is None or not os.path.exists(path):
+            return offset
+        with open(path, 'rb') as fh:
+            for line in fh:
+                if not line.endswith(b'\n'):
+                    break           # ▶ still being written
+                entry = json.loads(line)
+                if entry['t'] > start:
+                    break
+                offset = entry['o']
+        return offset
+
+    def replay(self, session_code, start=None, stop=None):
+        """NDJSON lines (bytes) from the keyframe before `start` up to `stop`
+
+        Lines between the keyframe and `start` are included: a player
+        applies them without pausing to reach the state at `start`.
+        """
+        offset = self._seek(session_code, start)
+        with open(self._path(session_code, '.ndjson'), 'rb') as fh:
+            fh.seek(offset)
+            rest = b''
+            while True:
+                chunk = fh.read(READ_CHUNK)
+                if not chunk:
+                    return          # ▶ a trailing partial line is dropped
+                lines = (rest + chunk).split(b'\n')
+                rest = lines.pop()
+                if stop is not None:
+                    for i, line in enumerate(lines):
+                        if json.loads(line)['t'] > stop:
+                            yield b''.join(l + b'\n' for l in lines[:i])
+                            return
+                if lines:
+                    yield b''.join(line + b'\n' for line in lines)
@@ -1,172 +1,1684 @@
-from flask import Flask, request
+import atexit
+import hashlib
+import hmac
+import math
+import os
+import re
+import time
+import uuid
+from functools import partial, wraps
+from itertools import islice
+from flask import Flask, Response, abort, request, send_file, url_for
 from flask_socketio import SocketIO, emit, join_room, leave_room
-from threading import Timer
+from werkzeug.middleware.proxy_fix import ProxyFix
+from collections import deque
+
+from broadcast import Backpressure, gated_manager
+from crdt import Board, Tombstones, is_clock, order_key, point_count
+from codec import (ENCODINGS, JSON, detach_payload, encode_payload,
+                   encode_strokes, extend_points, ingest_stroke, is_packed)
+from frozen import Frozen, thaw
+from images import IMAGE_TYPES, ImageCache, ImagePipeline, decode_data_url
+from limits import MessageGuard, RateLimiter, parse_rules
+from metrics import Registry
+from persistence import run_blocking, wait_for
+from recorder import Recorder
+from simplify import simplify_points, simplify_stroke
+from spatial import (GridIndex, points_bounds, stroke_bounds, stroke_hits,
+                     stroke_pad)
+from store import create_store
+from timers import TimerWheel
+
+# ▶ Set REDIS_URL to run several workers: sessions are shared through
+#   Redis and room broadcasts fan out through its pub/sub queue.
+REDIS_URL = os.environ.get('REDIS_URL') or None
+# ▶ 'msgpack' switches every frame to binary (socket.io-msgpack-parser)
+SOCKETIO_SERIALIZER = os.environ.get('SOCKETIO_SERIALIZER', 'default')
+
+# ▶ Inbound limits, per event name ('*' = any other event):
+#   (rate per second / burst) per socket and per room, and a byte cap
+#   checked before the message is decoded. A socket that keeps hitting
+#   its own limits (STRIKE_LIMIT, same format) is disconnected; a full
+#   room bucket only throttles, since the whole room shares it.
+#   update_paths fires for every pen move on the full-board path.
+SOCKET_RATE_LIMITS = parse_rules(os.environ.get(
+    'SOCKET_RATE_LIMITS',
+    'update_paths=60/120,add_stroke=30/60,append_points=120/240,'
+    'update_background=0.5/3,erase_region=5/10,query_region=10/20,'
+    'get_history=5/10,add_code=5/20,get_all_codes=5/10,*=60/120'))
+ROOM_RATE_LIMITS = parse_rules(os.environ.get(
+    'ROOM_RATE_LIMITS',
+    'update_paths=300/600,update_background=1/5,*=1000/2000'))
+EVENT_SIZE_LIMITS = parse_rules(os.environ.get(
+    'EVENT_SIZE_LIMITS',
+    'update_paths=4000000,update_background=12000000,add_stroke=262144,'
+    'append_points=65536,*=16384'), int)
+STRIKE_LIMIT = parse_rules('*=' + os.environ.get('STRIKE_LIMIT', '1/20'))
 
 app = Flask(__name__)
+# ▶ proxies in front of the app (Caddy: 1); their X-Forwarded-For names
+#   the client that per-address limits apply to
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
 app.config['SECRET_KEY'] = 'f8470y009Pi1Nw7LFW36Q9P702rCEr'
-socketio = SocketIO(app, cors_allowed_origins="*")
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024     # ▶ background uploads
+manager = gated_manager(REDIS_URL)      # ▶ Redis pub/sub with REDIS_URL
+socketio = SocketIO(app, cors_allowed_origins="*", client_manager=manager,
+                    serializer=SOCKETIO_SERIALIZER,
+                    max_http_buffer_size=max(EVENT_SIZE_LIMITS.values()))
 
 # --------------------------------------------------------------------
-# In-memory session store
+# Instrumentation – handlers registered with @on_event get a latency
+# histogram; every emit is counted in _broadcast, and the bytes each one
+# queues on this worker's sockets by the manager. Served on /metrics.
 # --------------------------------------------------------------------
-sessions = {}
-lock_timers = {}
-HISTORY_LIMIT = 100          # ▶ maximum snapshots per stack (tweak or remove)
+metrics = Registry()
+handler_seconds = metrics.histogram(
+    'whiteboard_handler_seconds', 'Socket.IO handler latency', ('event',))
+emitted_bytes = metrics.counter(
+    'whiteboard_emitted_bytes_total', 'Bytes queued to local sockets',
+    ('event',))
+emitted_events = metrics.counter(
+    'whiteboard_emitted_events_total', 'Emits (one per room send)', ('event',))
+
+# ▶ messages a socket may have waiting before it stops getting room events
+#   and is resynced with a snapshot once it has caught up
+MAX_SOCKET_BACKLOG = int(os.environ.get('MAX_SOCKET_BACKLOG', 256))
+backpressure = Backpressure(socketio.server, MAX_SOCKET_BACKLOG)
+manager.gate = backpressure
+manager.on_send = lambda event, size: emitted_bytes.inc(size, event)
+resyncs = metrics.counter(
+    'whiteboard_resyncs_total', 'Snapshots sent to sockets that caught up')
+_sockets = {}                   # ▶ sid -> (session_code, encoding)
+
+rejected = metrics.counter(
+    'whiteboard_rejected_events_total', 'Inbound events refused',
+    ('event', 'reason'))
+offenders = metrics.counter(
+    'whiteboard_offenders_disconnected_total',
+    'Sockets disconnected for repeatedly exceeding limits')
+socket_limits = RateLimiter(SOCKET_RATE_LIMITS)
+room_limits = RateLimiter(ROOM_RATE_LIMITS)
+strikes = RateLimiter(STRIKE_LIMIT)
+
+def _refuse(sid, event, reason, fatal=False, strike=True):
+    """Tell the socket, and disconnect it once it runs out of strikes
+
+    strike=False only throttles: the limit it hit is not the socket's own.
+    """
+    rejected.inc(1, event or '?', reason)
+    if sid is None:
+        return
+    if fatal or (strike and not strikes.allow(sid, '*')):
+        offenders.inc()
+        socketio.server.disconnect(sid)
+        return
+    _broadcast('rate_limited', {'event': event, 'reason': reason}, sid)
+
+def _oversized(eio_sid, event, size, fatal):
+    _refuse(socketio.server.manager.sid_from_eio_sid(eio_sid, '/'),
+            event, 'size', fatal)
+
+guard = MessageGuard(EVENT_SIZE_LIMITS, _oversized)
+socketio.server.eio.handlers['message'] = guard.wrap(
+    socketio.server.eio.handlers['message'])
+
+def _over_limit(event):
+    """None when the event may run, else the reason it may not"""
+    if not socket_limits.allow(request.sid, event):
+        return 'rate'
+    # ▶ the room the socket joined, not the payload's session_code: a
+    #   made-up code would open a bucket nothing ever forgets
+    joined = _sockets.get(request.sid)
+    if joined is not None and not room_limits.allow(joined[0], event):
+        return 'room_rate'
+    return None
+
+def on_event(event):
+    """@socketio.on(event) plus rate limits and a latency sample per call"""
+    def register(handler):
+        timed = handler_seconds.time(event)(handler)
+        if event in ('connect', 'disconnect'):
+            return socketio.on(event)(timed)
+
+        @wraps(handler)
+        def limited(*args):
+            reason = _over_limit(event)
+            if reason is not None:
+                # ▶ one flooder drains the room bucket for everyone in
+                #   it; only the socket's own bucket counts as a strike
+                _refuse(request.sid, event, reason,
+                        strike=reason != 'room_rate')
+                return
+            return timed(*args)
+        return socketio.on(event)(limited)
+    return register
+
+# --------------------------------------------------------------------
+# Session store (in-memory, or Redis when REDIS_URL is set)
+#
+# In memory, SNAPSHOT_PATH makes sessions durable: changes are written
+# behind to SQLite every SNAPSHOT_INTERVAL seconds, and durable sessions
+# idle for SESSION_IDLE_TTL seconds are moved from RAM to disk.
+#
+# In Redis, the board's lists are stored item by item so a save writes
+# only what changed; a board nobody has saved for REDIS_SESSION_TTL
+# seconds expires.
+#
+# A session is released once its room has been empty for
+# SESSION_GRACE_PERIOD seconds, so reconnects find their board intact.
+# Any in-memory session untouched for SESSION_COLD_AFTER seconds is kept
+# compressed until its next use (0 turns that off).
+# --------------------------------------------------------------------
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', '')
+SNAPSHOT_INTERVAL = float(os.environ.get('SNAPSHOT_INTERVAL', 5))
+SESSION_IDLE_TTL = float(os.environ.get('SESSION_IDLE_TTL', 3600))
+SESSION_GRACE_PERIOD = float(os.environ.get('SESSION_GRACE_PERIOD', 600))
+SESSION_COLD_AFTER = float(os.environ.get('SESSION_COLD_AFTER', 600))
+REDIS_SESSION_TTL = int(os.environ.get('REDIS_SESSION_TTL', 7 * 24 * 3600))
+
+WORKER_ID = uuid.uuid4().hex  # ▶ this process, in `workers` and its heartbeat
+WORKER_TTL = 30              # ▶ seconds a silent worker's sockets still count
+
+def _prune_workers(sess):
+    """Drop the socket counts of workers whose heartbeat ran out, re-total
+
+    A worker that is killed or redeployed never sees its sockets
+    disconnect, so its share of `workers` would keep the room occupied
+    forever. Also run on sessions rehydrated from a snapshot: nobody is
+    connected to those through an earlier process.
+    """
+    sess.pop('boot', None)      # ▶ saved before counts were per worker
+    workers = sess.setdefault('workers', {})
+    live = store.alive(set(workers) - {WORKER_ID}) | {WORKER_ID}
+    for worker in list(workers):
+        if worker not in live or not any(workers[worker].values()):
+            del workers[worker]
+    totals = dict.fromkeys(ENCODINGS, 0)
+    for counts in workers.values():
+        for encoding, n in counts.items():
+            totals[encoding] += n
+    sess['encodings'] = totals
+
+def _rebuild_indexes(sess):
+    """Lookups the Redis store leaves out, rebuilt from the stored lists"""
+    sess['stroke_index'] = _index_strokes(sess['paths'])
+    sess['grid'] = sess['positions'] = None     # ▶ rebuilt on first use
+    sess['drawn'] = {}
+    if 'codes' in sess:
+        sess['code_index'] = {code: seq for seq, code
+                              in enumerate(sess['codes'], 1)}
+
+# ▶ stored item by item in Redis / recomputed after a load instead
+REDIS_PARTS = ('paths', 'undo_stack', 'redo_stack', 'op_log', 'codes',
+               'tombstones')
+REDIS_DERIVED = ('stroke_index', 'code_index', 'grid', 'positions', 'drawn')
+
+store = create_store(REDIS_URL, SNAPSHOT_PATH,
+                     partial(run_blocking, socketio.async_mode),
+                     on_load=_prune_workers, async_mode=socketio.async_mode,
+                     parts=REDIS_PARTS, derived=REDIS_DERIVED,
+                     rebuild=_rebuild_indexes, ttl=REDIS_SESSION_TTL)
+atexit.register(store.close)
+HISTORY_LIMIT = 100          # ▶ maximum operations per stack (tweak or remove)
+HISTORY_HOT = 8              # ▶ newest entries per stack kept uncompressed
+OP_LOG_LIMIT = 1000          # ▶ recent operations kept for reconnect catch-up
+# ▶ Defaults for new sessions; a teacher can change them per session with
+#   set_simplification. 0 / unset keeps points exactly as drawn.
+SIMPLIFY_TOLERANCE = float(os.environ.get('SIMPLIFY_TOLERANCE', 0))
+POINT_DECIMALS = (int(os.environ['POINT_DECIMALS'])
+                  if os.environ.get('POINT_DECIMALS') else None)
+
+def new_session():
+    return {
+        "background_hash": "",  # ▶ served from /backgrounds/<hash>
+        "background_preview": "",   # ▶ tiny data URL painted until it loads
+        "paths": [],
+        "stroke_index": {},     # ▶ stroke id -> stroke (server-side only)
+        "grid": GridIndex(),    # ▶ stroke id -> bounding box, by tile
+        "positions": None,      # ▶ stroke id -> board position, see _positions
+        "drawn": {},            # ▶ stroke id -> outline as sent, see _drawn
+        "undo_stack": deque(maxlen=HISTORY_LIMIT or None),   # ▶
+        "redo_stack": deque(maxlen=HISTORY_LIMIT or None),   # ▶
+        "is_student_locked": False,
+        "is_quiz": False,
+        "encodings": dict.fromkeys(ENCODINGS, 0),   # ▶ clients per encoding
+        "workers": {},          # ▶ worker id -> its share of `encodings`
+        "board_id": uuid.uuid4().hex,   # ▶ versions restart with the board
+        "version": 0,
+        "op_log": deque(maxlen=OP_LOG_LIMIT),   # ▶ (event, payload)
+        "clock": 0,             # ▶ highest Lamport clock seen in crdt_ops
+        "tombstones": Tombstones(),
+        "codes": [],            # ▶ submitted codes, oldest first
+        "code_index": {},       # ▶ code -> seq, for O(1) dedupe
+        "simplify_tolerance": SIMPLIFY_TOLERANCE,
+        "point_decimals": POINT_DECIMALS,
+        "last_active": time.time()
+    }
 
 # --------------------------------------------------------------------
 # Helper functions
 # --------------------------------------------------------------------
 def unlock_student(session_code):
-    if session_code in sessions:
-        sessions[session_code]['is_student_locked'] = False
-        socketio.emit('student_unlocked', {'is_student_locked': False},
-                      room=session_code)
+    with store.session(session_code) as sess:
+        if sess is None:
+            return
+        # ▶ another worker may have seen activity since we armed the timer
+        idle = time.time() - sess['last_active']
+        if idle < LOCK_TIMEOUT - TIMER_TICK:
+            lock_wheel.reset(session_code, LOCK_TIMEOUT - idle)
+            return
+        sess['is_student_locked'] = False
+        if store.durable:
+            idle_wheel.reset(session_code, SESSION_IDLE_TTL)
+        if SESSION_COLD_AFTER:
+            cold_wheel.reset(session_code, SESSION_COLD_AFTER)
+        _emit_state(session_code, sess, 'student_unlocked',
+                    {'is_student_locked': False})
+
+def _occupancy(sess):
+    """Sockets currently connected to the session (all live workers)"""
+    workers = sess.get('workers', {})
+    live = store.alive(set(workers) - {WORKER_ID}) | {WORKER_ID}
+    return sum(sum(counts.values()) for worker, counts in workers.items()
+               if worker in live)
+
+def _count(sess, encoding, delta):
+    """Add `delta` sockets of `encoding` on this worker"""
+    counts = sess.setdefault('workers', {}).setdefault(
+        WORKER_ID, dict.fromkeys(ENCODINGS, 0))
+    counts[encoding] = max(counts[encoding] + delta, 0)
+    _prune_workers(sess)
+
+_next_beat = 0
+
+def _heartbeat():
+    """Tell the other workers this one (and its sockets) is still there"""
+    global _next_beat
+    if time.monotonic() >= _next_beat:
+        _next_beat = time.monotonic() + WORKER_TTL / 3
+        store.beat(WORKER_ID, WORKER_TTL)
+
+def _index_strokes(paths):
+    """Map stroke id -> stroke for every path that carries an id"""
+    return {p['id']: p for p in paths if isinstance(p, dict) and 'id' in p}
+
+def _grid(sess):
+    grid = sess.get('grid')
+    if grid is None:            # ▶ session saved before the grid existed
+        grid = sess['grid'] = GridIndex()
+        for key, stroke in sess['stroke_index'].items():
+            grid.add(key, stroke_bounds(stroke))
+    return grid
+
+def _positions(sess):
+    """(stroke id -> board position, positions of strokes without an entry)
+
+    _splice keeps it in step while the board changes at its end or in
+    place; a splice that shifts strokes drops it and the next lookup
+    rebuilds it in one pass, as the splice itself just did.
+    """
+    cached = sess.get('positions')
+    if cached is None:
+        at, loose, stroke_index = {}, set(), sess['stroke_index']
+        for i, p in enumerate(sess['paths']):
+            if isinstance(p, dict) and stroke_index.get(p.get('id')) is p:
+                at[p['id']] = i
+            else:
+                loose.add(i)
+        cached = sess['positions'] = (at, loose)
+    return cached
+
+def _session_snapshot(sess, encoding):
+    """Render state sent on join – history stays server-side
+
+    Stack depths are enough to enable the undo / redo buttons; the entries
+    themselves are paged in with `get_history`.
+    """
+    return {
+        "paths": encode_strokes(sess['paths'], encoding),
+        "background_hash": sess['background_hash'],
+        "background_preview": sess.get('background_preview', ''),
+        "is_student_locked": sess['is_student_locked'],
+        "is_quiz": sess['is_quiz'],
+        "board_id": sess['board_id'],
+        "version": sess['version'],
+        "simplify_tolerance": sess.get('simplify_tolerance', 0),
+        "point_decimals": sess.get('point_decimals'),
+        "clock": sess.get('clock', 0),
+        "undo_depth": len(sess['undo_stack']),
+        "redo_depth": len(sess['redo_stack']),
+        "code_count": len(sess.get('codes', ())),
+    }
+
+def _client_encoding():
+    """Stroke encoding this socket asked for with ?encoding=..."""
+    encoding = request.args.get('encoding')
+    return encoding if encoding in ENCODINGS else JSON
+
+def _encoding_room(session_code, encoding):
+    return '%s/%s' % (session_code, encoding)
+
+def _bounded(value, default, low, high=None, kind=int):
+    """A client-sent number clamped to [low, high], default if it isn't one"""
+    try:
+        value = kind(value)
+    except (TypeError, ValueError, OverflowError):
+        return default
+    if isinstance(value, float) and not math.isfinite(value):
+        return default          # ▶ a huge int is fine: it just gets clamped
+    value = max(value, low)
+    return value if high is None else min(value, high)
+
+def _broadcast(event, payload, room, skip_sid=None):
+    """Every room emit goes through here: serialized once per call
+
+    The manager skips lagging sockets on each worker (broadcast.py).
+    """
+    socketio.server.emit(event, payload, to=room, skip_sid=skip_sid)
+    emitted_events.inc(1, event)
+
+def _send_board(session_code, encodings, event, payload, skip_sid=None):
+    """Room emit for payloads carrying strokes, once per encoding in use"""
+    for encoding, clients in encodings.items():
+        if clients:
+            _broadcast(event, encode_payload(payload, encoding),
+                       _encoding_room(session_code, encoding), skip_sid)
+
+# --------------------------------------------------------------------
+# Versions – every state change bumps sess['version'] and is kept in a
+# bounded op log, so a client reconnecting with ?since=<version> gets
+# just what it missed. Broadcast payloads carry their `version`; senders
+# get theirs back as the event's ack.
+#
+# With RECORD_DIR set, each logged op is also queued for the session's
+# recording on disk (recorder.py), written by the timer task and served
+# as an NDJSON replay from /recordings/<session_code>.
+# --------------------------------------------------------------------
+RECORD_DIR = os.environ.get('RECORD_DIR', '')
+recorder = (Recorder(RECORD_DIR, partial(run_blocking, socketio.async_mode))
+            if RECORD_DIR else None)
+if recorder is not None:
+    atexit.register(recorder.close)
+
+def _commit_op(session_code, sess, event, payload):
+    """Stamp payload with the next version and log it"""
+    sess['version'] += 1
+    payload['version'] = sess['version']
+    logged = detach_payload(payload)
+    sess['op_log'].append((event, logged))
+    if recorder is not None:
+        _record_op(session_code, sess, event, logged)
+    return sess['version']
+
+def _record_op(session_code, sess, event, logged):
+    recorder.record(session_code, sess['version'], event, logged)
+    if recorder.needs_keyframe(session_code, sess['board_id'], sess['version']):
+        recorder.keyframe(session_code, sess['board_id'], sess['version'],
+                          _session_snapshot(sess, JSON))
+
+def _ops_since(sess, since):
+    """Logged ops after `since`, or None once the log no longer reaches"""
+    missing = sess['version'] - since
+    if missing < 0 or missing > len(sess['op_log']):
+        return None
+    return list(islice(sess['op_log'], len(sess['op_log']) - missing, None))
 
-def reset_timer(session_code):
-    if session_code in lock_timers:
-        lock_timers[session_code].cancel()
-    lock_timers[session_code] = Timer(5400, unlock_student, [session_code])
-    lock_timers[session_code].start()
+def _emit_board(session_code, sess, event, payload, skip_sid=None,
+                logged=None):
+    """Board change for the room – sent now, or queued when batching
+
+    `logged` replaces (event, payload) in the op log when the broadcast
+    form is bulkier than the change itself.
+    """
+    version = _commit_op(session_code, sess, *(logged or (event, payload)))
+    payload['version'] = version
+    if not BATCH_INTERVAL:
+        _send_board(session_code, sess['encodings'], event, payload, skip_sid)
+    else:
+        _queue_board(session_code, sess['encodings'], event, payload,
+                     skip_sid, _client_encoding())
+    return {'version': version}
+
+def _emit_state(session_code, sess, event, payload, skip_sid=None):
+    """Lock / quiz / background change: versioned, sent right away"""
+    version = _commit_op(session_code, sess, event, payload)
+    _flush_room(session_code)
+    _broadcast(event, payload, session_code, skip_sid)
+    return {'version': version}
+
+# --------------------------------------------------------------------
+# Outbound batching
+#
+# With BATCH_INTERVAL_MS set, board events are queued per room and sent
+# as one `batch` frame {events: [[event, payload], ...]} per flush, in
+# order. Recipients that sent none of the queued events get one shared
+# frame; each sender gets the same frame minus its own events, which
+# keeps the skip_sid semantics of the direct emits. Pen movement on the
+# same stroke by the same sender is merged while it waits.
+# --------------------------------------------------------------------
+BATCH_INTERVAL = float(os.environ.get('BATCH_INTERVAL_MS', 0)) / 1000
+BATCH_MAX_EVENTS = int(os.environ.get('BATCH_MAX_EVENTS', 64))
+
+_outbox = {}                 # ▶ session_code -> {'encodings', 'events'}
+_flush_task = None
+
+def _coalesce(events, event, payload, sender):
+    """Fold the event into the last queued one when that loses nothing"""
+    if not events:
+        return False
+    last_event, last_payload, last_sender, _ = events[-1]
+    if last_sender != sender:
+        return False
+    if event == 'points_appended':
+        if last_event == 'points_appended' and last_payload['id'] == payload['id']:
+            extend_points(last_payload, payload['points'])
+            last_payload['version'] = payload['version']
+            return True
+        if last_event == 'stroke_added' and last_payload['stroke'].get('id') == payload['id']:
+            extend_points(last_payload['stroke'], payload['points'])
+            last_payload['version'] = payload['version']
+            return True
+    if event == last_event == 'paths_update':
+        events[-1][1] = payload     # ▶ a newer full board supersedes
+        return True
+    return False
+
+def _queue_board(session_code, encodings, event, payload, skip_sid, encoding):
+    box = _outbox.setdefault(session_code, {'events': []})
+    box['encodings'] = dict(encodings)
+    # ▶ queued strokes must not see later in-place appends to the board
+    payload = detach_payload(payload)
+    if not _coalesce(box['events'], event, payload, skip_sid):
+        box['events'].append([event, payload, skip_sid, encoding])
+    if len(box['events']) >= BATCH_MAX_EVENTS:
+        _flush_room(session_code)
+    _ensure_flush_task()
+
+def _batch_frame(events, encoding, skip=None):
+    return [[event, encode_payload(payload, encoding)]
+            for event, payload, sender, _ in events
+            if skip is None or sender != skip]
+
+def _flush_room(session_code):
+    """Send everything queued for the room; call before any direct emit"""
+    box = _outbox.pop(session_code, None)
+    if not box:
+        return
+    events, encodings = box['events'], box['encodings']
+    if len(events) == 1:
+        event, payload, skip_sid, _ = events[0]
+        _send_board(session_code, encodings, event, payload, skip_sid)
+        return
+
+    senders = {}
+    for _, _, sender, encoding in events:
+        if sender is not None:
+            senders[sender] = encoding
+    for encoding, clients in encodings.items():
+        if clients:
+            _broadcast('batch', {'events': _batch_frame(events, encoding)},
+                       _encoding_room(session_code, encoding),
+                       list(senders) or None)
+    for sender, encoding in senders.items():
+        frame = _batch_frame(events, encoding, skip=sender)
+        if frame:
+            _broadcast('batch', {'events': frame}, sender)
+
+def _run_flusher():
+    while True:
+        socketio.sleep(BATCH_INTERVAL)
+        for session_code in list(_outbox):
+            try:
+                _flush_room(session_code)
+            except Exception:
+                app.logger.exception('batch flush failed')
+
+def _ensure_flush_task():
+    global _flush_task
+    if _flush_task is None:
+        _flush_task = socketio.start_background_task(_run_flusher)
+
+def reset_timer(session_code, sess):
+    sess['last_active'] = time.time()
+    lock_wheel.reset(session_code, LOCK_TIMEOUT)
+    if store.durable:
+        idle_wheel.reset(session_code, SESSION_IDLE_TTL)
+    if SESSION_COLD_AFTER:
+        cold_wheel.reset(session_code, SESSION_COLD_AFTER)
+
+# --------------------------------------------------------------------
+# Timers – one wheel per concern, one background task for all of them
+# --------------------------------------------------------------------
+LOCK_TIMEOUT = 5400          # ▶ seconds of inactivity before students unlock
+TIMER_TICK = 1.0             # ▶ wheel resolution in seconds
+
+def _unlock_expired(session_codes):
+    for session_code in session_codes:
+        unlock_student(session_code)
+
+def _evict_idle(session_codes):
+    for session_code in session_codes:
+        sess = store.get(session_code)
+        if sess is not None and _occupancy(sess):
+            continue            # ▶ a quiet lesson is still a lesson
+        store.evict(session_code)
+
+def _compress_cold(session_codes):
+    for session_code in session_codes:
+        store.compress(session_code)
+
+def _release_empty(session_codes):
+    """Rooms that stayed empty through the grace period"""
+    for session_code in session_codes:
+        sess = store.get(session_code)
+        if sess is not None and _occupancy(sess):
+            continue            # ▶ someone came back on another worker
+        lock_wheel.cancel(session_code)
+        idle_wheel.cancel(session_code)
+        cold_wheel.cancel(session_code)
+        _outbox.pop(session_code, None)
+        _open_backgrounds.pop(session_code, None)
+        room_limits.forget(session_code)
+        if recorder is not None:
+            recorder.forget(session_code)
+        if store.durable:
+            store.evict(session_code)
+        else:
+            store.delete(session_code)
+
+lock_wheel = TimerWheel(_unlock_expired, tick=TIMER_TICK)
+idle_wheel = TimerWheel(_evict_idle, tick=TIMER_TICK)
+empty_wheel = TimerWheel(_release_empty, tick=TIMER_TICK)
+cold_wheel = TimerWheel(_compress_cold, tick=TIMER_TICK)
+_timer_task = None
+
+def _run_timers():
+    next_snapshot = time.monotonic() + SNAPSHOT_INTERVAL
+    while True:
+        socketio.sleep(TIMER_TICK)
+        try:
+            _heartbeat()
+        except Exception:
+            app.logger.exception('heartbeat failed')
+        for wheel in (lock_wheel, idle_wheel, empty_wheel, cold_wheel):
+            try:
+                wheel.advance()
+            except Exception:
+                app.logger.exception('timer callback failed')
+        try:
+            _resync_recovered()
+        except Exception:
+            app.logger.exception('resync failed')
+        if recorder is not None:
+            try:
+                recorder.flush()
+            except Exception:
+                app.logger.exception('recording flush failed')
+        if time.monotonic() >= next_snapshot:
+            next_snapshot = time.monotonic() + SNAPSHOT_INTERVAL
+            try:
+                store.flush()
+            except Exception:
+                app.logger.exception('snapshot flush failed')
+            upload_limits.prune()
+
+def _resync_recovered():
+    """Fresh snapshot for each socket that fell behind and has caught up"""
+    for sid in backpressure.recovered():
+        if sid not in _sockets:
+            continue
+        session_code, encoding = _sockets[sid]
+        _flush_room(session_code)   # ▶ nothing older may follow the snapshot
+        with store.session(session_code) as sess:
+            if sess is None:
+                continue
+            snapshot = _session_snapshot(sess, encoding)
+            snapshot['resync'] = True
+            _broadcast('session_data', snapshot, sid)
+            resyncs.inc()
+
+def _ensure_timer_task():
+    """Start the shared timer task on first use (after the worker forked)"""
+    global _timer_task
+    if _timer_task is None:
+        _timer_task = socketio.start_background_task(_run_timers)
 
 # --------------------------------------------------------------------
 # Socket.IO lifecycle
 # --------------------------------------------------------------------
-@socketio.on('connect')
+@on_event('connect')
 def on_connect():
+    """?since=<version>&board_id=<id> resumes instead of a full snapshot;
+    ?viewport=x0,y0,x1,y1 sends the strokes in view first"""
     session_code = request.args.get('session_code')
+    since = request.args.get('since', type=int)
+    viewport = _parse_rect(request.args.get('viewport'))
+    encoding = _client_encoding()
+    _flush_room(session_code)   # ▶ queued events predate our snapshot
     join_room(session_code)
+    join_room(_encoding_room(session_code, encoding))
+
+    _ensure_timer_task()
+    _heartbeat()
+    _sockets[request.sid] = (session_code, encoding)
+    empty_wheel.cancel(session_code)
+    with store.session(session_code, default=new_session) as sess:
+        _count(sess, encoding, 1)
+        reset_timer(session_code, sess)
+        _open_backgrounds[session_code] = sess['background_hash']
+
+        ops = None
+        # ▶ without its board_id the client's board may be one released
+        #   since: the same versions would then mean other ops
+        if since is not None and request.args.get('board_id') == sess['board_id']:
+            ops = _ops_since(sess, since)
+        if ops is None:
+            _send_session(sess, encoding, viewport)
+        else:
+            _broadcast('catch_up', {'version': sess['version'],
+                                    'events': [[event, encode_payload(payload, encoding)]
+                                               for event, payload in ops]},
+                       request.sid)
 
-    if session_code not in sessions:
-        sessions[session_code] = {
-            "background_image": "",
-            "paths": [],
-            "undo_stack": [],   # ▶
-            "redo_stack": [],   # ▶
-            "is_student_locked": False,
-            "is_quiz": False
-        }
-    reset_timer(session_code)
-    emit('session_data', sessions[session_code], to=request.sid)
-
-@socketio.on('disconnect')
+@on_event('disconnect')
 def on_disconnect():
+    # ▶ dropped halfway through a binary event: its attachments never come
+    guard.forget(socketio.server.manager.eio_sid_from_sid(request.sid, '/'))
     session_code = request.args.get('session_code')
     if not session_code:
         return
+    encoding = _client_encoding()
+    _sockets.pop(request.sid, None)
+    backpressure.forget(request.sid)
+    socket_limits.forget(request.sid)
+    strikes.forget(request.sid)
     leave_room(session_code)
-    if session_code in lock_timers:
-        lock_timers[session_code].cancel()
-        del lock_timers[session_code]
-    sessions.pop(session_code, None)
+    leave_room(_encoding_room(session_code, encoding))
+    with store.session(session_code) as sess:
+        if sess is None:
+            return
+        _count(sess, encoding, -1)
+        if not _occupancy(sess):
+            # ▶ keep the board through reconnects; released if nobody returns
+            empty_wheel.reset(session_code, SESSION_GRACE_PERIOD)
 
 # --------------------------------------------------------------------
 # Lock / quiz status (unchanged)
 # --------------------------------------------------------------------
-@socketio.on('set_student_lock')
+@on_event('set_student_lock')
 def set_student_lock(data):
     session_code = data['session_code']
     is_locked = data['is_locked']
-    if session_code in sessions:
-        sessions[session_code]['is_student_locked'] = is_locked
-        emit('student_lock_status', {'is_student_locked': is_locked},
-             room=session_code)
-        reset_timer(session_code)
+    with store.session(session_code) as sess:
+        if sess is None:
+            return
+        sess['is_student_locked'] = is_locked
+        reset_timer(session_code, sess)
+        return _emit_state(session_code, sess, 'student_lock_status',
+                           {'is_student_locked': is_locked})
 
-@socketio.on('set_quiz_status')
+@on_event('set_quiz_status')
 def set_quiz_status(data):
     session_code = data['session_code']
     is_quiz = data['is_quiz']
-    if session_code in sessions:
-        sessions[session_code]['is_quiz'] = is_quiz
-        emit('quiz_status_updated', {'is_quiz': is_quiz}, room=session_code)
-        reset_timer(session_code)
+    with store.session(session_code) as sess:
+        if sess is None:
+            return
+        sess['is_quiz'] = is_quiz
+        reset_timer(session_code, sess)
+        return _emit_state(session_code, sess, 'quiz_status_updated',
+                           {'is_quiz': is_quiz})
 
-@socketio.on('get_quiz_status')
+@on_event('set_simplification')
+def set_simplification(data):
+    """{session_code, tolerance: board units (0 = off), decimals: int|None}"""
+    session_code = data['session_code']
+    tolerance = _bounded(data.get('tolerance'), 0.0, 0.0, kind=float)
+    decimals = data.get('decimals')
+    decimals = None if decimals is None else _bounded(decimals, None, 0, 6)
+    with store.session(session_code) as sess:
+        if sess is None:
+            return
+        sess['simplify_tolerance'] = tolerance
+        sess['point_decimals'] = decimals
+        reset_timer(session_code, sess)
+        return _emit_state(session_code, sess, 'simplification_updated',
+                           {'simplify_tolerance': tolerance,
+                            'point_decimals': decimals})
+
+@on_event('get_quiz_status')
 def get_quiz_status(data):
     session_code = data['session_code']
-    if session_code in sessions:
-        emit('quiz_status', {'is_quiz': sessions[session_code]['is_quiz']},
-             room=session_code)
+    sess = store.get(session_code)
+    if sess is not None:
+        _flush_room(session_code)
+        _broadcast('quiz_status', {'is_quiz': sess['is_quiz']}, session_code)
 
 # --------------------------------------------------------------------
 # Background image
+#
+# Images travel over HTTP (POST /backgrounds, GET /backgrounds/<hash>);
+# socket events only carry the content hash and a tiny preview. Uploads
+# are downscaled and recompressed in BACKGROUND_WORKERS processes first.
 # --------------------------------------------------------------------
-@socketio.on('update_background')
+BACKGROUND_DIR = os.environ.get('BACKGROUND_DIR', 'data/backgrounds')
+BACKGROUND_CACHE_BYTES = int(os.environ.get('BACKGROUND_CACHE_BYTES',
+                                            512 * 1024 * 1024))
+# ▶ past this even recently used files go (default 2 x the soft cap)
+BACKGROUND_CACHE_HARD_BYTES = int(os.environ.get('BACKGROUND_CACHE_HARD_BYTES',
+                                                 2 * BACKGROUND_CACHE_BYTES))
+# ▶ POST /backgrounds per client address: rate per second / burst
+UPLOAD_RATE_LIMIT = parse_rules(
+    'upload=' + os.environ.get('UPLOAD_RATE_LIMIT', '0.1/10'))
+BACKGROUND_MAX_AGE = 365 * 24 * 3600    # ▶ content-addressed, never changes
+BACKGROUND_MAX_SIDE = int(os.environ.get('BACKGROUND_MAX_SIDE', 2560))
+BACKGROUND_QUALITY = int(os.environ.get('BACKGROUND_QUALITY', 80))
+BACKGROUND_PREVIEW_SIDE = int(os.environ.get('BACKGROUND_PREVIEW_SIDE', 48))
+BACKGROUND_WORKERS = int(os.environ.get('BACKGROUND_WORKERS',
+                                        min(2, os.cpu_count() or 1)))
+PREVIEW_MAX_CHARS = 16384    # ▶ client-sent previews larger than this are dropped
+
+_open_backgrounds = {}      # ▶ session code -> hash, boards open here
+images = ImageCache(BACKGROUND_DIR, BACKGROUND_CACHE_BYTES,
+                    in_use=_open_backgrounds.values,
+                    hard_bytes=BACKGROUND_CACHE_HARD_BYTES)
+upload_limits = RateLimiter(UPLOAD_RATE_LIMIT)
+pipeline = ImagePipeline(BACKGROUND_WORKERS,
+                         partial(run_blocking, socketio.async_mode),
+                         BACKGROUND_MAX_SIDE, BACKGROUND_QUALITY,
+                         BACKGROUND_PREVIEW_SIDE,
+                         partial(wait_for, socketio.async_mode))
+atexit.register(pipeline.close)
+
+def _store_image(data, mimetype):
+    """(hash, preview data URL) of a normalized upload; None if undecodable"""
+    try:
+        data, mimetype, preview = pipeline.process(data, mimetype)
+    except ValueError:
+        return None
+    return images.put(data, mimetype), preview or ''
+
+def _client_preview(value):
+    """A preview the client got back from POST /backgrounds, if plausible"""
+    if not isinstance(value, str) or len(value) > PREVIEW_MAX_CHARS:
+        return ''
+    match = re.match(r'data:([\w/+.-]+);base64,', value)
+    return value if match and match.group(1) in IMAGE_TYPES else ''
+
+@on_event('update_background')
 def handle_background_update(data):
     session_code = data['session_code']
-    new_bg = data['background_image']
-    sessions[session_code]['background_image'] = new_bg
-    reset_timer(session_code)
-    emit('background_update', {'background_image': new_bg},
-         room=session_code, skip_sid=request.sid)
+    digest = data.get('background_hash')
+    if digest is None:
+        # ▶ older clients still send the image itself as a data URL
+        decoded = decode_data_url(data.get('background_image'))
+        stored = None
+        if decoded is not None and decoded[1] in IMAGE_TYPES:
+            stored = _store_image(*decoded)
+        if stored is None:
+            emit('background_error', {'error': 'unsupported image'},
+                 to=request.sid)
+            return
+        digest, preview = stored
+    elif digest not in images:
+        emit('background_error', {'error': 'unknown image'}, to=request.sid)
+        return
+    else:
+        preview = _client_preview(data.get('background_preview'))
+
+    with store.session(session_code) as sess:
+        if sess is None:
+            return
+        sess['background_hash'] = digest
+        sess['background_preview'] = preview
+        reset_timer(session_code, sess)
+        _open_backgrounds[session_code] = digest
+        return _emit_state(session_code, sess, 'background_update',
+                           {'background_hash': digest,
+                            'background_preview': preview},
+                           skip_sid=request.sid)
 
-@socketio.on('clear_background')
+@on_event('clear_background')
 def clear_background(data):
     session_code = data['session_code']
-    sessions[session_code]['background_image'] = ""
-    reset_timer(session_code)
-    emit('background_cleared', {'background_image': ""}, room=session_code)
+    with store.session(session_code) as sess:
+        if sess is None:
+            return
+        sess['background_hash'] = ""
+        sess['background_preview'] = ""
+        reset_timer(session_code, sess)
+        _open_backgrounds.pop(session_code, None)
+        return _emit_state(session_code, sess, 'background_cleared',
+                           {'background_hash': ""})
+
+@app.route('/backgrounds', methods=['POST'])
+def upload_background():
+    """Raw image body or multipart field `image`; replies with its hash
+
+    The reply's `preview` goes back in update_background so the room can
+    paint it before the full image arrives. Uploads are rate limited per
+    client address (UPLOAD_RATE_LIMIT).
+    """
+    if not upload_limits.allow(request.remote_addr, 'upload'):
+        rejected.inc(1, 'upload_background', 'rate')
+        return {'error': 'too many uploads'}, 429, {'Retry-After': '10'}
+    upload = request.files.get('image')
+    if upload is not None:
+        body, mimetype = upload.read(), upload.mimetype
+    else:
+        body, mimetype = request.get_data(), request.mimetype
+    if not body:
+        return {'error': 'empty upload'}, 400
+    if mimetype not in IMAGE_TYPES:
+        return {'error': 'unsupported image type'}, 415
+
+    stored = _store_image(body, mimetype)
+    if stored is None:
+        return {'error': 'undecodable image'}, 415
+    digest, preview = stored
+    return {'hash': digest, 'preview': preview,
+            'url': url_for('get_background', digest=digest)}, 201
+
+@app.route('/backgrounds/<digest>')
+def get_background(digest):
+    found = images.lookup(digest)
+    if found is None:
+        abort(404)
+    path, mimetype = found
+    response = send_file(path, mimetype=mimetype, etag=digest,
+                         max_age=BACKGROUND_MAX_AGE, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    # ▶ anyone can upload: never let a stored file run as a page on this
+    #   origin (an SVG can carry script). <img> / canvas ignore both.
+    response.headers['Content-Security-Policy'] = "sandbox; default-src 'none'"
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    if mimetype == 'image/svg+xml':
+        response.headers['Content-Disposition'] = 'attachment'
+    return response
+
+@app.after_request
+def allow_cross_origin(response):
+    """The whiteboard front-end lives on another origin"""
+    if request.path.startswith(('/backgrounds', '/recordings')):
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST'
+    return response
 
 # --------------------------------------------------------------------
 # Path handling – now with history support!
+#
+# Every board change is a splice: paths[index:index + len(removed)] is
+# replaced by `inserted`. The undo stack keeps those operations rather
+# than board snapshots, so history costs as much as the edits themselves.
 # --------------------------------------------------------------------
-def _push_history(stack, snapshot):
-    """Utility to cap stack length and push a snapshot"""
-    stack.append(snapshot)
-    if HISTORY_LIMIT and len(stack) > HISTORY_LIMIT:
-        stack.pop(0)
+def _splice(sess, index, stop, inserted):
+    """Replace paths[index:stop] with inserted, keep the id index in step"""
+    paths = sess['paths']
+    removed = paths[index:stop]
+    tail = index + len(removed) == len(paths)
+    paths[index:stop] = inserted
+    _bury(sess, removed, inserted)
+    stroke_index, grid = sess['stroke_index'], _grid(sess)
+    for p in removed:
+        if isinstance(p, dict) and stroke_index.get(p.get('id')) is p:
+            del stroke_index[p['id']]
+            grid.discard(p['id'])
+    added = _index_strokes(inserted)
+    stroke_index.update(added)
+    for key, stroke in added.items():
+        grid.add(key, stroke_bounds(stroke))
+
+    positions = sess.get('positions')
+    if positions is None:
+        return removed
+    if not tail and len(removed) != len(inserted):
+        sess['positions'] = None    # ▶ later strokes moved
+        return removed
+    at, loose = positions
+    for i, p in enumerate(removed, index):
+        loose.discard(i)
+        if isinstance(p, dict) and at.get(p.get('id')) == i:
+            del at[p['id']]
+    for i, p in enumerate(inserted, index):
+        if isinstance(p, dict) and stroke_index.get(p.get('id')) is p:
+            if p['id'] in at:
+                loose.add(at[p['id']])  # ▶ an older stroke with that id
+            at[p['id']] = i
+        else:
+            loose.add(i)
+    return removed
+
+def _tombstones(sess):
+    if sess.get('tombstones') is None:     # ▶ saved before the CRDT
+        sess['tombstones'] = Tombstones()
+    return sess['tombstones']
+
+def _bury(sess, removed, inserted):
+    """Tombstones for CRDT strokes a splice took off the board
+
+    Whatever removed them – clear, erase, remove_stroke, undo – a late or
+    repeated crdt_ops add of the same stroke must not bring it back. A
+    stroke put back by a splice (undo of those) drops its tombstone.
+    """
+    kept = {p.get('id') for p in inserted if isinstance(p, dict)}
+    tombstones = None
+    for p in removed:
+        if order_key(p) != (0, '', 0) and p['id'] not in kept:
+            tombstones = tombstones or _tombstones(sess)
+            tombstones.bury(p['id'], p['clock'])
+    for p in inserted:
+        if order_key(p) != (0, '', 0):
+            tombstones = tombstones or _tombstones(sess)
+            tombstones.revive(p)
 
-@socketio.on('update_paths')
+def _record(sess, index, removed, inserted):
+    """Push an operation onto the undo log; a fresh change breaks redo"""
+    sess['undo_stack'].append((index, removed, inserted))
+    sess['redo_stack'].clear()
+    _cool(sess['undo_stack'], 1)
+
+def _cool(stack, side):
+    """Compress the off-board strokes of the entry leaving the hot end
+
+    side 1 = `removed` (undo stack), 2 = `inserted` (redo stack): the part
+    an undo / redo would put back. The other part is on the board and
+    stays live, since later appends change it in place.
+    """
+    if len(stack) <= HISTORY_HOT:
+        return
+    i = len(stack) - HISTORY_HOT - 1
+    entry = stack[i]
+    strokes = entry[side]
+    if isinstance(strokes, Frozen) or not strokes:
+        return
+    live = {id(p) for p in entry[3 - side]}
+    if any(id(p) in live for p in strokes):
+        return              # ▶ shares strokes with the board (region erase)
+    entry = list(entry)
+    entry[side] = Frozen(strokes)
+    stack[i] = tuple(entry)
+
+def _diff_paths(old, new):
+    """Smallest window old[start:old_end] -> new[start:new_end] that differs"""
+    start, limit = 0, min(len(old), len(new))
+    while start < limit and old[start] == new[start]:
+        start += 1
+    old_end, new_end = len(old), len(new)
+    while (old_end > start and new_end > start
+           and old[old_end - 1] == new[new_end - 1]):
+        old_end -= 1
+        new_end -= 1
+    return start, old_end, new_end
+
+def _simplifies(sess):
+    return bool(sess.get('simplify_tolerance')) or \
+        sess.get('point_decimals') is not None
+
+def _outline(points):
+    """(count, first, last) of the points a client sent"""
+    count = point_count(points)
+    if not count:
+        return 0, None, None
+    if is_packed(points):
+        return count, bytes(points[:8]), bytes(points[-8:])
+    return count, points[0], points[-1]
+
+def _drawn(sess):
+    """stroke id -> _outline of a simplified stroke as its client drew it
+
+    Lets update_paths spot strokes it stored already without simplifying
+    them again. Entries of strokes gone from the board are dropped now
+    and then; a Redis load starts it empty.
+    """
+    drawn, stroke_index = sess.get('drawn'), sess['stroke_index']
+    if drawn is None or len(drawn) > 2 * len(stroke_index) + 64:
+        drawn = sess['drawn'] = {k: v for k, v in (drawn or {}).items()
+                                 if k in stroke_index}
+    return drawn
+
+def _ingest(sess, stroke):
+    """Storage form of an incoming stroke, simplified per the session"""
+    stroke = ingest_stroke(stroke)
+    if _simplifies(sess):
+        if isinstance(stroke, dict) and 'id' in stroke:
+            _drawn(sess)[stroke['id']] = _outline(stroke.get('points'))
+        stroke = simplify_stroke(stroke, sess.get('simplify_tolerance', 0),
+                                 sess.get('point_decimals'))
+    return stroke
+
+def _stored(sess, stroke):
+    """The stored stroke an update_paths sends again unchanged, or None"""
+    if not isinstance(stroke, dict):
+        return None
+    stored = sess['stroke_index'].get(stroke.get('id'))
+    if stored is None or len(stored) != len(stroke):
+        return None
+    if _drawn(sess).get(stroke['id']) != _outline(stroke.get('points')):
+        return None
+    if any(stored.get(k) != v for k, v in stroke.items() if k != 'points'):
+        return None
+    return stored
+
+def _delta(index, remove, insert):
+    """Wire format of a splice, as sent with undo / redo"""
+    return {'index': index, 'remove': remove, 'insert': insert}
+
+@on_event('update_paths')
 def handle_paths_update(data):
     session_code = data['session_code']
     new_paths = data['paths']
+    with store.session(session_code) as sess:
+        if sess is None:
+            return
+
+        if _simplifies(sess):
+            # ▶ the sender holds raw strokes: strokes it drew before are
+            #   swapped for their stored, simplified form; only new or
+            #   changed ones are simplified before diffing
+            new_paths = [_stored(sess, p) or _ingest(sess, p)
+                         for p in new_paths]
 
-    # ▶ Save current state for undo *before* we overwrite it
-    current_paths = sessions[session_code]['paths']
-    _push_history(sessions[session_code]['undo_stack'], current_paths.copy())
-    sessions[session_code]['redo_stack'].clear()   # fresh change breaks redo chain
+        # ▶ Only the changed window is applied and remembered for undo
+        start, old_end, new_end = _diff_paths(sess['paths'], new_paths)
+        inserted = [ingest_stroke(p) for p in new_paths[start:new_end]]
+        if start != old_end or inserted:
+            removed = _splice(sess, start, old_end, inserted)
+            _record(sess, start, removed, inserted)
 
-    # ▶ Apply new paths
-    sessions[session_code]['paths'] = new_paths
-    reset_timer(session_code)
-    emit('paths_update', {'paths': new_paths},
-         room=session_code, skip_sid=request.sid)
+        reset_timer(session_code, sess)
+        return _emit_board(session_code, sess, 'paths_update',
+                           {'paths': new_paths}, skip_sid=request.sid,
+                           logged=('splice',
+                                   _delta(start, old_end - start, inserted)))
 
-@socketio.on('clear_paths')
+@on_event('clear_paths')
 def clear_paths(data):
     session_code = data['session_code']
-    current = sessions[session_code]['paths']
-    _push_history(sessions[session_code]['undo_stack'], current.copy())
-    sessions[session_code]['redo_stack'].clear()
+    with store.session(session_code) as sess:
+        if sess is None:
+            return
+        if sess['paths']:
+            removed = _splice(sess, 0, len(sess['paths']), [])
+            _record(sess, 0, removed, [])
+
+        reset_timer(session_code, sess)
+        return _emit_board(session_code, sess, 'paths_cleared', {'paths': []})
+
+# --------------------------------------------------------------------
+# Stroke deltas – only the change travels, not the whole board
+#
+#   add_stroke     {session_code, stroke: {id, points: [...], ...}}
+#                  an id already on the board is acked {duplicate: true}
+#   append_points  {session_code, id, points: [...]}
+#   remove_stroke  {session_code, id}
+#
+# `points` may be a list or, for ?encoding=packed clients, a float32
+# buffer (see codec.py). update_paths / clear_paths above stay as the
+# full-board fallback.
+# --------------------------------------------------------------------
+@on_event('add_stroke')
+def handle_add_stroke(data):
+    session_code = data['session_code']
+    with store.session(session_code) as sess:
+        if sess is None:
+            return
+
+        stroke = data['stroke']
+        known = sess['stroke_index']
+        if isinstance(stroke, dict) and stroke.get('id') in known:
+            # ▶ a resend, or a clash: the stroke on the board keeps its id
+            return {'version': sess['version'], 'duplicate': True}
+        stroke = _ingest(sess, stroke)
+        end = len(sess['paths'])
+        _splice(sess, end, end, [stroke])
+        _record(sess, end, [], [stroke])
+        reset_timer(session_code, sess)
+        return _emit_board(session_code, sess, 'stroke_added',
+                           {'stroke': stroke}, skip_sid=request.sid)
+
+@on_event('append_points')
+def handle_append_points(data):
+    session_code = data['session_code']
+    stroke_id = data['id']
+    points = data['points']
+    with store.session(session_code) as sess:
+        stroke = sess['stroke_index'].get(stroke_id) if sess else None
+        if stroke is None:
+            return  # stroke was removed / cleared meanwhile
+
+        if _simplifies(sess):
+            known, added = _drawn(sess).get(stroke_id), _outline(points)
+            if known is not None and added[0]:
+                _drawn(sess)[stroke_id] = (known[0] + added[0],
+                                           known[1] or added[1], added[2])
+            # ▶ each chunk on its own: its endpoints stay, so the segment
+            #   joining it to the stroke so far is drawn as before
+            points = simplify_points(points, sess.get('simplify_tolerance', 0),
+                                     sess.get('point_decimals'))
+
+        # ▶ continuing a stroke is not a new undo step – the add_stroke
+        #   entry holds the same object, so undo/redo take the whole stroke
+        extend_points(stroke, points)
+        _grid(sess).extend(stroke_id, points_bounds(points, stroke_pad(stroke)))
+        reset_timer(session_code, sess)
+        return _emit_board(session_code, sess, 'points_appended',
+                           {'id': stroke_id, 'points': points},
+                           skip_sid=request.sid)
+
+@on_event('remove_stroke')
+def handle_remove_stroke(data):
+    session_code = data['session_code']
+    stroke_id = data['id']
+    with store.session(session_code) as sess:
+        stroke = sess['stroke_index'].get(stroke_id) if sess else None
+        if stroke is None:
+            return
+
+        index = _positions(sess)[0][stroke_id]
+        removed = _splice(sess, index, index + 1, [])
+        _record(sess, index, removed, [])
+        reset_timer(session_code, sess)
+        return _emit_board(session_code, sess, 'stroke_removed',
+                           {'id': stroke_id}, skip_sid=request.sid)
+
+# --------------------------------------------------------------------
+# Regions – backed by the per-session grid (spatial.py)
+#
+#   query_region {session_code, rect: [x0, y0, x1, y1]}
+#     -> region_strokes {rect, version, indices, strokes} to the requester
+#   erase_region {session_code, rect}
+#     -> region_erased {rect, indices} to the room, one undo step
+#
+# `indices` are board positions, ascending. Only strokes with an id are
+# in the grid; the rare ones without are always treated as candidates.
+# --------------------------------------------------------------------
+BOARD_CHUNK = 500           # ▶ strokes per board_rest frame
+
+def _parse_rect(value):
+    """(x0, y0, x1, y1) from [..] or "x0,y0,x1,y1", None if malformed"""
+    if isinstance(value, str):
+        value = value.split(',')
+    try:
+        x0, y0, x1, y1 = (float(v) for v in value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if not all(math.isfinite(v) for v in (x0, y0, x1, y1)):
+        return None             # ▶ the grid can't span inf / nan
+    return (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+
+def _region_positions(sess, rect):
+    """Board positions of strokes whose bounding box meets rect"""
+    at, loose = _positions(sess)
+    # ▶ only the hits are sorted into board order; the geometry is the grid's
+    return sorted([at[key] for key in _grid(sess).query(rect)] + list(loose))
+
+def _send_session(sess, encoding, viewport=None):
+    """session_data to the requester, visible strokes first with a viewport"""
+    snapshot = _session_snapshot(sess, encoding)
+    if viewport is None:
+        _broadcast('session_data', snapshot, request.sid)
+        return
+
+    paths = sess['paths']
+    visible = _region_positions(sess, viewport)
+    shown = set(visible)
+    rest = [i for i in range(len(paths)) if i not in shown]
+    snapshot.update(paths=encode_strokes([paths[i] for i in visible], encoding),
+                    indices=visible, stroke_count=len(paths),
+                    viewport=list(viewport))
+    _broadcast('session_data', snapshot, request.sid)
+    # ▶ queued now, under the session lock, so the rest matches the
+    #   snapshot's version and arrives before any later change
+    for start in range(0, len(rest), BOARD_CHUNK):
+        chunk = rest[start:start + BOARD_CHUNK]
+        _broadcast('board_rest', {
+            'version': sess['version'], 'indices': chunk,
+            'strokes': encode_strokes([paths[i] for i in chunk], encoding),
+            'done': start + BOARD_CHUNK >= len(rest)}, request.sid)
+
+@on_event('query_region')
+def query_region(data):
+    session_code = data['session_code']
+    rect = _parse_rect(data.get('rect'))
+    sess = store.get(session_code)
+    if sess is None or rect is None:
+        return
+    positions = _region_positions(sess, rect)
+    _flush_room(session_code)   # ▶ the reply's version must follow what's queued
+    _broadcast('region_strokes', {
+        'rect': list(rect), 'version': sess['version'], 'indices': positions,
+        'strokes': encode_strokes([sess['paths'][i] for i in positions],
+                                  _client_encoding())}, request.sid)
+
+@on_event('erase_region')
+def erase_region(data):
+    session_code = data['session_code']
+    rect = _parse_rect(data.get('rect'))
+    if rect is None:
+        return
+    with store.session(session_code) as sess:
+        if sess is None:
+            return
+        paths = sess['paths']
+        positions = [i for i in _region_positions(sess, rect)
+                     if stroke_hits(paths[i], rect)]
+        if not positions:
+            return
+
+        # ▶ one splice over the window holding every hit, survivors put
+        #   back, so the whole erase is a single undo step
+        start, stop, hit = positions[0], positions[-1] + 1, set(positions)
+        survivors = [p for i, p in enumerate(paths[start:stop], start)
+                     if i not in hit]
+        removed = _splice(sess, start, stop, survivors)
+        _record(sess, start, removed, survivors)
+        reset_timer(session_code, sess)
+        return _emit_board(session_code, sess, 'region_erased',
+                           {'rect': list(rect), 'indices': positions})
+
+# --------------------------------------------------------------------
+# Concurrent editing – stroke-level CRDT ops (crdt.py)
+#
+#   crdt_ops {session_code, ops: [{op: 'add'|'append'|'remove', ...}]}
+#     -> crdt_op {op, ...} to the room, once per op that changed the board
+#     ack {version, clock, resend: {stroke id: offset}}
+#
+# Clients apply their own ops locally at once and everyone else's as they
+# arrive; crdt.Board's rules make every replica converge whatever the
+# interleaving. Adds and removes are undo steps like any other splice;
+# any splice that takes a CRDT stroke off the board buries it (_bury).
+# Strokes from CRDT ops are stored as drawn – simplification would shift
+# the offsets appends are placed by.
+# --------------------------------------------------------------------
+class _SessionBoard(Board):
+    """crdt.Board over a live session: splices go through _splice
+
+    With record=False (undo / redo) the splices are not new undo steps.
+    """
+
+    def __init__(self, sess, record=True):
+        super().__init__(sess['paths'], sess['stroke_index'],
+                         _tombstones(sess))
+        self.sess = sess
+        self.record = record
+
+    def splice(self, start, stop, inserted):
+        removed = _splice(self.sess, start, stop, inserted)
+        if self.record:
+            _record(self.sess, start, removed, inserted)
+
+    def _position(self, stroke):
+        return _positions(self.sess)[0][stroke['id']]
+
+    def extend(self, stroke, points):
+        super().extend(stroke, points)
+        _grid(self.sess).extend(stroke['id'],
+                                points_bounds(points, stroke_pad(stroke)))
+
+@on_event('crdt_ops')
+def handle_crdt_ops(data):
+    session_code = data['session_code']
+    with store.session(session_code) as sess:
+        if sess is None:
+            return
+        board, version, resend = _SessionBoard(sess), None, {}
+        for op in data.get('ops') or ():
+            if not isinstance(op, dict):
+                continue
+            try:
+                if op.get('op') == 'add':
+                    op['stroke'] = ingest_stroke(op['stroke'])
+                changed = board.apply(op)
+            except (AttributeError, KeyError, TypeError, ValueError):
+                continue        # ▶ malformed op – skip it, keep the rest
+            stroke = op.get('stroke')
+            clock = op.get('clock', stroke.get('clock')
+                           if isinstance(stroke, dict) else None)
+            if is_clock(clock):
+                sess['clock'] = max(sess.get('clock', 0), clock)
+            if changed:
+                version = _emit_board(session_code, sess, 'crdt_op', op,
+                                      skip_sid=request.sid)
+            elif op.get('op') == 'append' and op['id'] in sess['stroke_index']:
+                resend[op['id']] = point_count(
+                    sess['stroke_index'][op['id']].get('points'))
 
-    sessions[session_code]['paths'] = []
-    reset_timer(session_code)
-    emit('paths_cleared', {'paths': []}, room=session_code)
+        reset_timer(session_code, sess)
+        ack = dict(version or {'version': sess['version']},
+                   clock=sess.get('clock', 0))
+        if resend:
+            ack['resend'] = resend
+        return ack
 
 # --------------------------------------------------------------------
 # NEW: undo / redo
+#
+# Both reply with the inverse splice only:
+#   {index, remove: <count>, insert: [strokes]}
+#
+# A step that only touches CRDT strokes is replayed as crdt_op removes and
+# adds under a fresh clock instead: a position is only right on replicas
+# with the same order, and a removal must leave a tombstone so a late or
+# repeated add can't bring the stroke back. The ack carries the clock.
 # --------------------------------------------------------------------
-@socketio.on('undo_request')
+def _crdt_step(strokes):
+    """True when every stroke in the step is a CRDT stroke"""
+    return bool(strokes) and all(order_key(p) != (0, '', 0) for p in strokes)
+
+def _crdt_replay(session_code, sess, off, on):
+    """Take `off` off the board and put `on` back as CRDT ops
+
+    Strokes on both sides (the survivors of a region erase) stay put.
+    Returns the strokes taken off, the ones put back and the ack.
+    """
+    both = {p['id'] for p in off} & {p['id'] for p in on}
+    clock = sess['clock'] = sess.get('clock', 0) + 1
+    board, version = _SessionBoard(sess, record=False), None
+    taken, put = [], []
+    for p in off:
+        stroke = sess['stroke_index'].get(p['id'])
+        op = {'op': 'remove', 'id': p['id'], 'clock': clock}
+        if p['id'] not in both and board.apply(op):
+            taken.append(stroke)
+            version = _emit_board(session_code, sess, 'crdt_op', op)
+    for p in on:
+        stroke = dict(p, clock=clock)
+        op = {'op': 'add', 'stroke': stroke}
+        if p['id'] not in both and board.apply(op):
+            put.append(stroke)
+            version = _emit_board(session_code, sess, 'crdt_op', op)
+    return taken, put, dict(version or {'version': sess['version']},
+                            clock=clock)
+
+def _swap(sess, index, off, on):
+    """Undo / redo of a splice: take `off` off the board, put `on` back
+
+    Strokes are found by id, not by the recorded index: a CRDT re-add
+    (undo / redo above) lands at the end of the board, and a Redis load
+    leaves the entry copies of the live strokes. Strokes the entry holds
+    on both sides (survivors of a region erase) go back as they are live
+    now, and a CRDT stroke whose id is on the board again is not put back
+    a second time. Only id-less strokes still go by position.
+
+    Returns (index, strokes taken off, strokes put back, splices), the
+    splices as (index, remove count, insert) in the order applied.
+    """
+    paths, at = sess['paths'], _positions(sess)[0]
+    if all(isinstance(p, dict) and 'id' in p for p in off):
+        # ▶ strokes gone meanwhile (a CRDT remove) are not looked for
+        found = sorted(at[p['id']] for p in off if p['id'] in at)
+    else:
+        index = min(index, len(paths))
+        found = list(range(index, min(index + len(off), len(paths))))
+    if found:
+        index = found[0]
+
+    live = {p['id']: p for p in (paths[i] for i in found)
+            if isinstance(p, dict) and 'id' in p}
+    shared = {id(p) for p in off}
+    put = []
+    for p in on:
+        if id(p) in shared:
+            p = live.get(p.get('id'), p)
+        elif order_key(p) != (0, '', 0) and p['id'] in sess['stroke_index'] \
+                and p['id'] not in live:
+            continue            # ▶ a newer copy is on the board
+        put.append(p)
+
+    if found == list(range(index, index + len(found))):
+        return index, _splice(sess, index, index + len(found), put), put, \
+            [(index, len(found), put)]
+    taken, splices = [], []
+    for i in reversed(found):       # ▶ scattered: one by one, last first
+        taken[:0] = _splice(sess, i, i + 1, [])
+        splices.append((i, 1, []))
+    _splice(sess, index, index, put)
+    return index, taken, put, splices + [(index, 0, put)]
+
+@on_event('undo_request')
 def handle_undo(data):
     session_code = data['session_code']
-    sess = sessions.get(session_code)
-    if not sess or not sess['undo_stack']:
-        return  # nothing to undo
-
-   
+    with store.session(session_code) as sess:
+        if not sess or not sess['undo_stack']:
+            return  # nothing to undo
 
-    emit('undo', {'paths': sess['paths']}, room=session_code)
+        index, removed, inserted = sess['undo_stack'].pop()
+        removed = thaw(removed)
+        if _crdt_step(list(removed) + list(inserted)):
+            taken, put, ack = _crdt_replay(session_code, sess, inserted,
+                                           removed)
+            sess['redo_stack'].append((index, put, taken))
+            _cool(sess['redo_stack'], 2)
+            return ack
+        # ▶ the strokes taken off the board are the live ones, whatever
+        #   was appended to them since
+        index, taken, put, splices = _swap(sess, index, inserted, removed)
+        sess['redo_stack'].append((index, put, taken))
+        _cool(sess['redo_stack'], 2)
+        for splice in splices:
+            ack = _emit_board(session_code, sess, 'undo', _delta(*splice))
+        return ack
 
-@socketio.on('redo_request')
+@on_event('redo_request')
 def handle_redo(data):
     session_code = data['session_code']
-    sess = sessions.get(session_code)
-    if not sess or not sess['redo_stack']:
-        return  # nothing to redo
+    with store.session(session_code) as sess:
+        if not sess or not sess['redo_stack']:
+            return  # nothing to redo
+
+        index, removed, inserted = sess['redo_stack'].pop()
+        inserted = thaw(inserted)
+        if _crdt_step(list(removed) + list(inserted)):
+            taken, put, ack = _crdt_replay(session_code, sess, removed,
+                                           inserted)
+            sess['undo_stack'].append((index, taken, put))
+            _cool(sess['undo_stack'], 1)
+            return ack
+        index, taken, put, splices = _swap(sess, index, removed, inserted)
+        sess['undo_stack'].append((index, taken, put))
+        _cool(sess['undo_stack'], 1)
+        for splice in splices:
+            ack = _emit_board(session_code, sess, 'redo', _delta(*splice))
+        return ack
+
+# --------------------------------------------------------------------
+# History pages – on demand, to the requester only
+#
+#   get_history {session_code, stack: 'undo'|'redo', offset, limit}
+#   -> history  {stack, offset, total, entries: [{index, removed, inserted}]}
+#
+# Entries run newest first: offset 0 is what the next undo / redo applies.
+# --------------------------------------------------------------------
+HISTORY_PAGE_MAX = 50
+
+@on_event('get_history')
+def get_history(data):
+    session_code = data['session_code']
+    stack = data.get('stack', 'undo')
+    if stack not in ('undo', 'redo'):
+        return
+    offset = _bounded(data.get('offset'), 0, 0)
+    limit = _bounded(data.get('limit'), 20, 1, HISTORY_PAGE_MAX)
+    encoding = _client_encoding()
+
+    sess = store.get(session_code)
+    if sess is None:
+        return
+    entries = sess[stack + '_stack']
+    start = max(len(entries) - offset - limit, 0)
+    stop = max(len(entries) - offset, 0)
+    page = [{'index': index,
+             'removed': encode_strokes(thaw(removed), encoding),
+             'inserted': encode_strokes(thaw(inserted), encoding)}
+            for index, removed, inserted in
+            reversed(list(islice(entries, start, stop)))]
+    _broadcast('history', {'stack': stack, 'offset': offset,
+                           'total': len(entries), 'entries': page},
+               request.sid)
+
+# --------------------------------------------------------------------
+# Code registry – add_code dedupes, get_all_codes pages to the requester
+#
+#   add_code      {session_code, code}     -> code_added {new_code, seq}
+#   get_all_codes {session_code, since, limit}
+#   -> all_codes  {codes, since, next, total}
+#
+# A code's seq is its position + 1, so a client that has seen up to seq N
+# asks for `since: N` and gets only what is new; `next` is its next N.
+# --------------------------------------------------------------------
+CODE_LIMIT = int(os.environ.get('CODE_LIMIT', 5000))   # ▶ codes per session
+CODE_MAX_CHARS = 256
+CODE_PAGE_MAX = 200
+
+def _codes(sess):
+    if 'codes' not in sess:     # ▶ session saved before the registry existed
+        sess['codes'], sess['code_index'] = [], {}
+    return sess['codes'], sess['code_index']
+
+@on_event('add_code')
+def handle_add_code(data):
+    session_code = data['session_code']
+    code = data.get('code')
+    if not isinstance(code, (str, int)) or isinstance(code, bool) \
+            or len(str(code)) > CODE_MAX_CHARS:
+        emit('code_error', {'error': 'invalid code'}, to=request.sid)
+        return
+    with store.session(session_code) as sess:
+        if sess is None:
+            return
+        codes, code_index = _codes(sess)
+        if code in code_index:
+            return {'seq': code_index[code], 'duplicate': True}
+        if len(codes) >= CODE_LIMIT:
+            emit('code_error', {'error': 'code limit reached'}, to=request.sid)
+            return
+        codes.append(code)
+        seq = code_index[code] = len(codes)
+        reset_timer(session_code, sess)
+        ack = _emit_state(session_code, sess, 'code_added',
+                          {'new_code': code, 'seq': seq})
+        ack['seq'] = seq
+        return ack
+
+@on_event('get_all_codes')
+def handle_get_all_codes(data):
+    session_code = data['session_code']
+    since = _bounded(data.get('since'), 0, 0)
+    limit = _bounded(data.get('limit'), CODE_PAGE_MAX, 1, CODE_PAGE_MAX)
+
+    sess = store.get(session_code)
+    if sess is None:
+        return
+    codes = sess.get('codes', ())
+    page = codes[since:since + limit]
+    _broadcast('all_codes', {'codes': page, 'since': since,
+                             'next': since + len(page), 'total': len(codes)},
+               request.sid)
+
+# --------------------------------------------------------------------
+# Recordings – streamed, never read whole
+#
+#   GET /recordings/<session_code>?from=<unix time>&to=<unix time>
+#   -> application/x-ndjson: the last keyframe at or before `from`, then
+#      every op after it (up to `to`); see recorder.py for the lines.
+#      Ops reach the file on the next timer tick (TIMER_TICK s).
+#   GET /recordings/<session_code>/keyframes -> {keyframes: [{t, v, o}]}
+# --------------------------------------------------------------------
+@app.route('/recordings/<session_code>')
+def replay_recording(session_code):
+    if recorder is None or not recorder.exists(session_code):
+        abort(404)
+    lines = recorder.replay(session_code, request.args.get('from', type=float),
+                            request.args.get('to', type=float))
+    return Response(lines, mimetype='application/x-ndjson')
+
+@app.route('/recordings/<session_code>/keyframes')
+def recording_keyframes(session_code):
+    if recorder is None or not recorder.exists(session_code):
+        abort(404)
+    return {'keyframes': recorder.keyframes(session_code)}
+
+# --------------------------------------------------------------------
+# /metrics – gauges are computed per scrape, never on the hot path.
+# Socket and memory figures cover this worker only; scrape each replica.
+#
+# A session code is all it takes to join a board, so per-session series
+# are labelled with a keyed digest of the code instead (session_label);
+# the Caddyfile keeps /metrics off the public site as well.
+# --------------------------------------------------------------------
+def session_label(session_code):
+    """Metrics label of a session: stable, but no use for joining it"""
+    return hmac.new(app.config['SECRET_KEY'].encode(),
+                    session_code.encode(), hashlib.sha256).hexdigest()[:16]
+
+def _sockets_per_room():
+    counts = {}
+    for room, sids in socketio.server.manager.rooms.get('/', {}).items():
+        code, _, encoding = (room or '').rpartition('/')
+        if code and encoding in ENCODINGS:
+            label = session_label(code)
+            counts[label] = counts.get(label, 0) + len(sids)
+    return counts
+
+SIZE_SAMPLES = 2               # ▶ sessions re-measured per scrape
+
+def _session_bytes():
+    """Serialized size of each session held in this process's memory
+
+    Sizes come from the last snapshot or compression; each scrape only
+    serializes a couple of sessions itself – unmeasured ones first, then
+    whichever was measured longest ago.
+    """
+    sizes = getattr(store, 'sizes', None)
+    if sizes is None:
+        return {}
+    stale = [code for code in store.sessions if code not in sizes]
+    stale += list(islice(sizes, SIZE_SAMPLES))
+    for code in stale[:SIZE_SAMPLES]:
+        store.measure(code)
+    return {session_label(code): size for code, size in list(sizes.items())}
 
+metrics.gauge('whiteboard_sessions', 'Sessions in the store', lambda: len(store))
+metrics.gauge('whiteboard_room_sockets', 'Sockets connected per room',
+              _sockets_per_room, ('session',))
+metrics.gauge('whiteboard_timers', 'Armed timers per wheel',
+              lambda: {'lock': len(lock_wheel), 'idle': len(idle_wheel),
+                       'empty': len(empty_wheel), 'cold': len(cold_wheel)},
+              ('wheel',))
+metrics.gauge('whiteboard_compressed_sessions',
+              'In-memory sessions currently kept compressed',
+              lambda: store.frozen() if hasattr(store, 'frozen') else 0)
+metrics.gauge('whiteboard_batched_events', 'Events waiting for a batch flush',
+              lambda: sum(len(box['events']) for box in _outbox.values()))
+metrics.gauge('whiteboard_session_bytes', 'Estimated memory per session',
+              _session_bytes, ('session',))
 
+metrics.gauge('whiteboard_slow_sockets',
+              'Sockets skipped until their send queue drains',
+              lambda: len(backpressure.lagging))
+metrics.gauge('whiteboard_socket_backlog_max',
+              'Most messages queued on one socket on this worker',
+              lambda: max((backpressure.backlog(eio_sid) for eio_sid
+                           in list(socketio.server.eio.sockets)), default=0))
+metrics.gauge('whiteboard_slow_socket_stalls_total',
+              'Times a socket hit MAX_SOCKET_BACKLOG',
+              lambda: backpressure.stalls, kind='counter')
+metrics.gauge('whiteboard_dropped_sends_total',
+              'Sends skipped for lagging sockets',
+              lambda: backpressure.dropped, kind='counter')
+metrics.gauge('whiteboard_recording_dropped_total',
+              'Recorded ops JSON could not encode',
+              lambda: recorder.dropped if recorder is not None else 0,
+              kind='counter')
 
-    emit('redo', {'paths': sess['paths']}, room=session_code)
+@app.route('/metrics')
+def serve_metrics():
+    return Response(metrics.render(),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 # --------------------------------------------------------------------
 # Misc
@@ -0,0 +1,142 @@
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:             # ▶ optional: pure Python handles any length
+    numpy = None
+
+# --------------------------------------------------------------------
+# Stroke simplification
+#
+# Ramer–Douglas–Peucker drops every point that lies within `tolerance`
+# (board units) of the polyline through the points kept, so the drawn
+# line moves by at most that much. `decimals` rounds coordinates first,
+# which both shortens their JSON and lets RDP drop exact repeats.
+# Endpoints are always kept.
+# --------------------------------------------------------------------
+NUMPY_MIN_POINTS = 64           # ▶ below this the array setup costs more
+
+
+def _segment_dist2(px, py, ax, ay, bx, by):
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    if length2:
+        t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length2))
+        ax, ay = ax + t * dx, ay + t * dy
+    return (px - ax) ** 2 + (py - ay) ** 2
+
+
+def _rdp_mask(xs, ys, tolerance):
+    keep = [False] * len(xs)
+    keep[0] = keep[-1] = True
+    limit = tolerance * tolerance
+    stack = [(0, len(xs) - 1)]
+    while stack:
+        first, last = stack.pop()
+        worst, worst_dist = None, limit
+        ax, ay, bx, by = xs[first], ys[first], xs[last], ys[last]
+        for i in range(first + 1, last):
+            dist = _segment_dist2(xs[i], ys[i], ax, ay, bx, by)
+            if dist > worst_dist:
+                worst, worst_dist = i, dist
+        if worst is not None:
+            keep[worst] = True
+            stack.append((first, worst))
+            stack.append((worst, last))
+    return keep
+
+
+def _rdp_mask_numpy(xs, ys, tolerance):
+    xs = numpy.asarray(xs, dtype=float)
+    ys = numpy.asarray(ys, dtype=float)
+    keep = numpy.zeros(len(xs), dtype=bool)
+    keep[0] = keep[-1] = True
+    limit = tolerance * tolerance
+    stack = [(0, len(xs) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        px, py = xs[first + 1:last], ys[first + 1:last]
+        ax, ay = xs[first], ys[first]
+        dx, dy = xs[last] - ax, ys[last] - ay
+        length2 = dx * dx + dy * dy
+        if length2:
+            t = numpy.clip(((px - ax) * dx + (py - ay) * dy) / length2, 0, 1)
+            dist = (px - ax - t * dx) ** 2 + (py - ay - t * dy) ** 2
+        else:
+            dist = (px - ax) ** 2 + (py - ay) ** 2
+        i = int(dist.argmax())
+        if dist[i] > limit:
+            worst = first + 1 + i
+            keep[worst] = True
+            stack.append((first, worst))
+            stack.append((worst, last))
+    return keep.tolist()
+
+
+def rdp_mask(xs, ys, tolerance):
+    """Which of the points (xs[i], ys[i]) RDP keeps"""
+    if len(xs) < 3:
+        return [True] * len(xs)
+    if numpy is not None and len(xs) >= NUMPY_MIN_POINTS:
+        return _rdp_mask_numpy(xs, ys, tolerance)
+    return _rdp_mask(xs, ys, tolerance)
+
+
+def _round(value, decimals):
+    return round(value) if decimals == 0 else round(value, decimals)
+
+
+def _simplify_list(points, tolerance, decimals):
+    if decimals is not None:
+        points = [dict(p, x=_round(p['x'], decimals), y=_round(p['y'], decimals))
+                  if isinstance(p, dict) else
+                  [_round(p[0], decimals), _round(p[1], decimals)] + list(p[2:])
+                  for p in points]
+    if tolerance:
+        xs = [p['x'] if isinstance(p, dict) else p[0] for p in points]
+        ys = [p['y'] if isinstance(p, dict) else p[1] for p in points]
+        points = [p for p, kept in zip(points, rdp_mask(xs, ys, tolerance))
+                  if kept]
+    return points
+
+
+def _simplify_packed(buf, tolerance):
+    """float32 x, y pairs; rounding would not shrink them, so RDP only"""
+    coords = array('f')
+    coords.frombytes(bytes(buf[:len(buf) - len(buf) % 8]))
+    if sys.byteorder == 'big':
+        coords.byteswap()
+    mask = rdp_mask(coords[0::2], coords[1::2], tolerance)
+    kept = array('f')
+    for i, keep in enumerate(mask):
+        if keep:
+            kept.append(coords[2 * i])
+            kept.append(coords[2 * i + 1])
+    if sys.byteorder == 'big':
+        kept.byteswap()
+    return bytearray(kept.tobytes())
+
+
+def simplify_points(points, tolerance=0, decimals=None):
+    """Points (list or packed buffer) simplified; the input is not changed"""
+    if isinstance(points, (bytes, bytearray)):
+        return _simplify_packed(points, tolerance) if tolerance else points
+    if not isinstance(points, list) or not (tolerance or decimals is not None):
+        return points
+    try:
+        return _simplify_list(points, tolerance, decimals)
+    except (KeyError, IndexError, TypeError):
+        return points           # ▶ not x/y points – leave them be
+
+
+def simplify_stroke(stroke, tolerance=0, decimals=None):
+    """Copy of a stroke with simplified points (the stroke itself if none)"""
+    if not isinstance(stroke, dict) or 'points' not in stroke:
+        return stroke
+    points = simplify_points(stroke['points'], tolerance, decimals)
+    if points is stroke['points']:
+        return stroke
+    return dict(stroke, points=points)
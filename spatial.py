@@ -0,0 +1,170 @@
+import sys
+from array import array
+
+# --------------------------------------------------------------------
+# Uniform grid over stroke bounding boxes
+#
+# Each stroke id is filed under every GRID_CELL x GRID_CELL cell its
+# bounding box touches, so a region only looks at the strokes filed
+# near it. Strokes spanning more than MAX_CELLS cells go in one "large"
+# list that every query checks instead of being filed cell by cell.
+# --------------------------------------------------------------------
+GRID_CELL = 256.0
+MAX_CELLS = 256
+
+
+def _coords(points):
+    """Flat [x0, y0, x1, y1, ...] of list or packed points"""
+    if isinstance(points, (bytes, bytearray)):
+        coords = array('f')
+        coords.frombytes(bytes(points[:len(points) - len(points) % 8]))
+        if sys.byteorder == 'big':
+            coords.byteswap()
+        return coords
+    coords = []
+    for p in points or ():
+        if isinstance(p, dict):
+            coords.append(p['x'])
+            coords.append(p['y'])
+        else:
+            coords.append(p[0])
+            coords.append(p[1])
+    return coords
+
+
+def points_bounds(points, pad=0):
+    """(x0, y0, x1, y1) around the points, None without any"""
+    try:
+        coords = _coords(points)
+    except (KeyError, IndexError, TypeError):
+        return None
+    if not coords:
+        return None
+    xs, ys = coords[0::2], coords[1::2]
+    return (min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad)
+
+
+def stroke_pad(stroke):
+    width = stroke.get('width', stroke.get('size', 0))
+    return width / 2.0 if isinstance(width, (int, float)) else 0
+
+
+def stroke_bounds(stroke):
+    if not isinstance(stroke, dict):
+        return None
+    return points_bounds(stroke.get('points'), stroke_pad(stroke))
+
+
+def union(a, b):
+    if a is None or b is None:
+        return a or b
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _segment_hits(x0, y0, x1, y1, rect):
+    """Liang–Barsky: does the segment pass through rect?"""
+    t0, t1 = 0.0, 1.0
+    dx, dy = x1 - x0, y1 - y0
+    for p, q in ((-dx, x0 - rect[0]), (dx, rect[2] - x0),
+                 (-dy, y0 - rect[1]), (dy, rect[3] - y0)):
+        if p == 0:
+            if q < 0:
+                return False
+        else:
+            t = q / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+            if t0 > t1:
+                return False
+    return True
+
+
+def stroke_hits(stroke, rect):
+    """Exact test: does the drawn line (width included) touch rect?"""
+    if not isinstance(stroke, dict):
+        return False
+    pad = stroke_pad(stroke)
+    rect = (rect[0] - pad, rect[1] - pad, rect[2] + pad, rect[3] + pad)
+    try:
+        coords = _coords(stroke.get('points'))
+    except (KeyError, IndexError, TypeError):
+        return False
+    if len(coords) == 2:
+        return _segment_hits(coords[0], coords[1], coords[0], coords[1], rect)
+    return any(_segment_hits(coords[i], coords[i + 1],
+                             coords[i + 2], coords[i + 3], rect)
+               for i in range(0, len(coords) - 2, 2))
+
+
+class GridIndex:
+    def __init__(self, cell=GRID_CELL):
+        self.cell = cell
+        self.cells = {}             # ▶ (cx, cy) -> {stroke id}
+        self.bounds = {}            # ▶ stroke id -> bounding box
+        self.large = set()
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def __contains__(self, key):
+        return key in self.bounds
+
+    def _span(self, rect):
+        cell = self.cell
+        return (int(rect[0] // cell), int(rect[1] // cell),
+                int(rect[2] // cell), int(rect[3] // cell))
+
+    def _file(self, key, rect, add):
+        cx0, cy0, cx1, cy1 = self._span(rect)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > MAX_CELLS:
+            (self.large.add if add else self.large.discard)(key)
+            return
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                if add:
+                    self.cells.setdefault((cx, cy), set()).add(key)
+                else:
+                    bucket = self.cells.get((cx, cy))
+                    if bucket is not None:
+                        bucket.discard(key)
+                        if not bucket:
+                            del self.cells[(cx, cy)]
+
+    def add(self, key, rect):
+        self.discard(key)
+        if rect is not None:
+            self.bounds[key] = rect
+            self._file(key, rect, True)
+
+    def discard(self, key):
+        rect = self.bounds.pop(key, None)
+        if rect is not None:
+            self._file(key, rect, False)
+
+    def extend(self, key, rect):
+        """Grow a stroke's box, e.g. after appended points"""
+        merged = union(self.bounds.get(key), rect)
+        if merged != self.bounds.get(key):
+            self.add(key, merged)
+
+    def query(self, rect):
+        """Ids whose bounding box intersects rect"""
+        cx0, cy0, cx1, cy1 = self._span(rect)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.cells):
+            buckets = self.cells.values()   # ▶ huge region: walk what exists
+        else:
+            buckets = (self.cells.get((cx, cy), ())
+                       for cx in range(cx0, cx1 + 1)
+                       for cy in range(cy0, cy1 + 1))
+        found = set()
+        for bucket in buckets:
+            found.update(bucket)
+        found.update(self.large)
+        bounds = self.bounds
+        return {key for key in found if intersects(bounds[key], rect)}
@@ -0,0 +1,491 @@
+import os
+import pickle
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+
+from frozen import Frozen
+
+# --------------------------------------------------------------------
+# Session stores
+#
+# Handlers never touch a dict of sessions directly; they open one with
+#
+#     with store.session(code) as sess:
+#         ...
+#
+# which locks the session, hands out the live dict (or None) and writes
+# it back afterwards. The in-memory store is the single-worker default;
+# the Redis store shares sessions between workers / processes.
+# --------------------------------------------------------------------
+class SessionStore:
+    durable = False             # ▶ sessions survive eviction / restarts
+
+    def get(self, session_code):
+        raise NotImplementedError
+
+    def save(self, session_code, sess):
+        raise NotImplementedError
+
+    def delete(self, session_code):
+        raise NotImplementedError
+
+    def codes(self):
+        raise NotImplementedError
+
+    def lock(self, session_code):
+        return nullcontext()
+
+    def evict(self, session_code):
+        """Release a session from this process's memory (default: no-op)"""
+
+    def compress(self, session_code):
+        """Keep an idle session compressed until next used (default: no-op)"""
+
+    def flush(self):
+        """Persist pending changes; returns how many sessions were written"""
+        return 0
+
+    def beat(self, worker, ttl):
+        """Mark `worker` alive for `ttl` seconds (default: no-op)"""
+
+    def alive(self, workers):
+        """Those of `workers` (other processes) still beating; none share
+        an in-memory store"""
+        return set()
+
+    def close(self):
+        self.flush()
+
+    def __contains__(self, session_code):
+        return self.get(session_code) is not None
+
+    @contextmanager
+    def session(self, session_code, default=None):
+        """Locked read-modify-write; `default()` creates a missing session"""
+        with self.lock(session_code):
+            sess = self.get(session_code)
+            if sess is None and default is not None:
+                sess = default()
+            yield sess
+            if sess is not None:
+                self.save(session_code, sess)
+
+
+class MemorySessionStore(SessionStore):
+    """Sessions as live Python objects in this process
+
+    With a persistence.SnapshotStore attached, changed sessions are written
+    behind in batches by flush(), a session missing from memory is
+    rehydrated from disk on first use, and evict() moves a session out of
+    RAM instead of losing it. `run_blocking(fn, *args)` keeps the SQLite
+    I/O off the event loop; `on_load(sess)` fixes up rehydrated sessions.
+
+    compress() swaps an idle session for a frozen.Frozen copy in place;
+    get() thaws it again on next use.
+
+    `sizes` keeps each session's byte size from the last time it was
+    serialized (snapshot or compression), least recently measured first;
+    measure() serializes one on purpose.
+    """
+
+    def __init__(self, snapshots=None, run_blocking=None, on_load=None):
+        self.sessions = {}
+        self.snapshots = snapshots
+        self.run_blocking = run_blocking or (lambda fn, *args: fn(*args))
+        self.on_load = on_load
+        self.dirty = set()
+        self.durable = snapshots is not None
+        self.sizes = OrderedDict()
+
+    def get(self, session_code):
+        sess = self.sessions.get(session_code)
+        if isinstance(sess, Frozen):
+            sess = self.sessions[session_code] = sess.thaw()
+        if sess is None and self.snapshots is not None:
+            raw = self.run_blocking(self.snapshots.load, session_code)
+            if raw is not None and session_code not in self.sessions:
+                sess = pickle.loads(raw)
+                if self.on_load is not None:
+                    self.on_load(sess)
+                self.sessions[session_code] = sess
+            else:
+                # ▶ a concurrent get may have loaded it while we waited
+                sess = self.sessions.get(session_code)
+        return sess
+
+    def save(self, session_code, sess):
+        self.sessions[session_code] = sess
+        if self.snapshots is not None:
+            self.dirty.add(session_code)
+
+    def delete(self, session_code):
+        self.sessions.pop(session_code, None)
+        self.sizes.pop(session_code, None)
+        self.dirty.discard(session_code)
+        if self.snapshots is not None:
+            self.run_blocking(self.snapshots.delete, session_code)
+
+    def _dumps(self, sess):
+        if isinstance(sess, Frozen):
+            return sess.raw()
+        return pickle.dumps(sess, pickle.HIGHEST_PROTOCOL)
+
+    def _measured(self, session_code, size):
+        self.sizes.pop(session_code, None)
+        self.sizes[session_code] = size
+
+    def measure(self, session_code):
+        sess = self.sessions.get(session_code)
+        if sess is None:
+            self.sizes.pop(session_code, None)
+        elif isinstance(sess, Frozen):
+            self._measured(session_code, len(sess.blob))
+        else:
+            self._measured(session_code, len(self._dumps(sess)))
+
+    def _pickle(self, codes):
+        rows = []
+        for code in codes:
+            sess = self.sessions.get(code)
+            if sess is None:
+                continue
+            raw = self._dumps(sess)
+            if not isinstance(sess, Frozen):
+                self._measured(code, len(raw))
+            rows.append((code, self.snapshots.next_seq(), raw))
+        return rows
+
+    def flush(self):
+        if self.snapshots is None or not self.dirty:
+            return 0
+        codes, self.dirty = self.dirty, set()
+        rows = self._pickle(codes)      # ▶ consistent: taken on the loop
+        try:
+            self.run_blocking(self.snapshots.save_many, rows)
+        except Exception:
+            self.dirty |= codes
+            raise
+        return len(rows)
+
+    def evict(self, session_code):
+        if session_code not in self.sessions:
+            return
+        if session_code in self.dirty:
+            self.dirty.discard(session_code)
+            self.run_blocking(self.snapshots.save_many,
+                              self._pickle([session_code]))
+            if session_code in self.dirty:
+                return                  # ▶ touched again while writing
+        self.sessions.pop(session_code, None)
+        self.sizes.pop(session_code, None)
+
+    def compress(self, session_code):
+        sess = self.sessions.get(session_code)
+        if sess is not None and not isinstance(sess, Frozen):
+            frozen = self.sessions[session_code] = Frozen(sess)
+            self._measured(session_code, len(frozen.blob))
+
+    def frozen(self):
+        """How many sessions are currently compressed"""
+        return sum(isinstance(s, Frozen) for s in self.sessions.values())
+
+    def close(self):
+        if self.snapshots is None:
+            return
+        # ▶ at exit the loop is going away – write synchronously
+        self.snapshots.save_many(self._pickle(self.dirty))
+        self.dirty.clear()
+        self.snapshots.close()
+
+    def codes(self):
+        return list(self.sessions)
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+def _print(item, pins):
+    """Identity of a stored item, down to the points of the strokes in it
+
+    Points are extended in place, so a stroke – or an undo entry holding
+    one – whose points grew since it was written counts as a new item.
+    Every points object looked at goes into `pins`, which is kept with
+    the prints so no id in them can be reused by another object.
+    """
+    if isinstance(item, dict):
+        points = item.get('points')
+        if points is None:
+            return id(item)
+        pins.append(points)
+        return id(item), id(points), len(points)
+    if isinstance(item, (list, tuple)):
+        return (id(item),) + tuple(_print(sub, pins) for sub in item
+                                   if isinstance(sub, (dict, list, tuple)))
+    return id(item)
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _shell(items):
+    """Empty container of the same kind (a deque keeps its maxlen)"""
+    if isinstance(items, deque):
+        return deque(maxlen=items.maxlen)
+    if hasattr(items, 'empty'):
+        return items.empty()        # ▶ list-like containers of their own
+    return []
+
+
+def _part(slots, items):
+    """What a worker remembers of one stored list: slots, prints, and
+    the items and points those prints need alive"""
+    pins = []
+    prints = [_print(item, pins) for item in items]
+    return list(slots), prints, list(items), pins
+
+
+class _Cached:
+    __slots__ = ('rev', 'sess', 'next_slot', 'parts')
+
+    def __init__(self, rev, sess, next_slot, parts):
+        self.rev = rev
+        self.sess = sess
+        self.next_slot = next_slot
+        self.parts = parts          # ▶ part -> _part(...)
+
+
+class RedisSessionStore(SessionStore):
+    """Sessions in Redis, guarded by a per-session Redis lock
+
+    The small fields of a session are one pickle (`meta`); each list in
+    `parts` (strokes, undo / redo entries, the op log, ...) is a Redis
+    hash of one pickle per item, keyed by a slot number, with the slot
+    order kept in meta. A save writes meta plus only the items that were
+    added or changed since the session was read, and deletes the ones
+    that went away, so an append_points costs one stroke, one op and
+    meta rather than the whole board. A part may also be a container of
+    its own that iterates its items and takes them back with extend();
+    its empty() gives the shell kept in meta. Fields in `derived` aren't
+    stored; `rebuild(sess)` recomputes them after a load.
+
+    Each worker keeps the sessions it used last (up to `cache_size`) as
+    live objects together with the revision they match; a get() whose
+    revision is still current skips the read entirely, and a stale one
+    only fetches the items it doesn't hold. Saves refresh `ttl` on every
+    key, so abandoned boards expire. Each worker keeps a heartbeat key
+    alive with beat(); alive() tells which workers still have one.
+
+    Works with anything speaking the redis-py API (a real server via
+    redis.Redis.from_url, or fakeredis.FakeRedis in tests). Only point it
+    at a private Redis – the values are pickles.
+    """
+
+    durable = True
+
+    def __init__(self, client, prefix='whiteboard:session:',
+                 lock_prefix='whiteboard:lock:', lock_timeout=10, ttl=None,
+                 parts=(), derived=(), rebuild=None, cache_size=256):
+        self.client = client
+        self.prefix = prefix
+        self.part_prefix = prefix.rstrip(':').rpartition(':')[0] + ':part:'
+        self.worker_prefix = prefix.rstrip(':').rpartition(':')[0] + ':worker:'
+        self.lock_prefix = lock_prefix
+        self.lock_timeout = lock_timeout
+        self.ttl = ttl              # ▶ optional expiry for abandoned boards
+        self.parts = tuple(parts)
+        self.derived = tuple(derived)
+        self.rebuild = rebuild
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # ▶ code -> _Cached, least recent first
+
+    def _key(self, session_code):
+        return self.prefix + session_code
+
+    def _part_key(self, session_code, part):
+        return '%s%s:%s' % (self.part_prefix, part, session_code)
+
+    def _keys(self, session_code):
+        return [self._key(session_code)] + [self._part_key(session_code, part)
+                                            for part in self.parts]
+
+    def get(self, session_code):
+        key = self._key(session_code)
+        try:
+            rev = self.client.hget(key, 'rev')
+        except Exception:
+            if self.client.type(key) not in (b'string', 'string'):
+                raise
+            # ▶ pickled whole by an earlier version; the next save converts it
+            self.cache.pop(session_code, None)
+            return pickle.loads(self.client.get(key))
+        cached = self.cache.get(session_code)
+        if rev is None:
+            self.cache.pop(session_code, None)
+            return None
+        if cached is not None and cached.rev == _text(rev):
+            self.cache.move_to_end(session_code)
+            return cached.sess
+        return self._load(session_code, cached)
+
+    def _load(self, session_code, cached, attempts=5):
+        for _ in range(attempts):
+            rev, raw = self.client.hmget(self._key(session_code), 'rev', 'meta')
+            if raw is None:
+                self.cache.pop(session_code, None)
+                return None
+            sess = pickle.loads(raw)
+            order, next_slot = sess.pop('_slots'), sess.pop('_next')
+            parts = self._fetch(session_code, sess, order, cached)
+            if parts is not None:
+                break
+            # ▶ a save landed between the two reads – start over
+        else:
+            raise RuntimeError('session %r kept changing under a read'
+                               % session_code)
+        if self.rebuild is not None:
+            self.rebuild(sess)
+        self._remember(session_code,
+                       _Cached(_text(rev), sess, next_slot, parts))
+        return sess
+
+    def _fetch(self, session_code, sess, order, cached):
+        """Fill sess's parts from items held in `cached` or read from Redis"""
+        parts = {}
+        for part, slots in order.items():
+            known = {}
+            if cached is not None and part in cached.parts:
+                old_slots, _, old_items, _ = cached.parts[part]
+                known = dict(zip(old_slots, old_items))
+            missing = [slot for slot in slots if slot not in known]
+            if missing:
+                raws = self.client.hmget(self._part_key(session_code, part),
+                                         missing)
+                if any(raw is None for raw in raws):
+                    return None
+                known.update((slot, pickle.loads(raw))
+                             for slot, raw in zip(missing, raws))
+            items = [known[slot] for slot in slots]
+            sess[part].extend(items)
+            parts[part] = _part(slots, items)
+        return parts
+
+    def _remember(self, session_code, cached):
+        self.cache[session_code] = cached
+        self.cache.move_to_end(session_code)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def save(self, session_code, sess):
+        cached = self.cache.get(session_code)
+        if cached is not None and cached.sess is not sess:
+            cached = None           # ▶ not what we handed out: write it all
+        next_slot = cached.next_slot if cached is not None else 0
+        skip = set(self.parts) | set(self.derived)
+        meta = {k: v for k, v in sess.items() if k not in skip}
+        order, parts = {}, {}
+        pipe = self.client.pipeline(transaction=True)
+
+        for part in self.parts:
+            items = sess.get(part)
+            if items is None:
+                continue
+            key = self._part_key(session_code, part)
+            old = cached.parts.get(part) if cached is not None else None
+            if old is None:
+                pipe.delete(key)
+                by_print = {}
+            else:
+                by_print = dict(zip(old[1], old[0]))
+            slots, prints, pins, writes = [], [], [], {}
+            for item in items:
+                fp = _print(item, pins)
+                slot = by_print.pop(fp, None)
+                if slot is None:
+                    slot, next_slot = next_slot, next_slot + 1
+                    writes[slot] = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+                slots.append(slot)
+                prints.append(fp)
+            if by_print:
+                pipe.hdel(key, *by_print.values())
+            if writes:
+                pipe.hset(key, mapping=writes)
+            meta[part] = _shell(items)
+            order[part] = slots
+            parts[part] = slots, prints, list(items), pins
+
+        meta['_slots'], meta['_next'] = order, next_slot
+        key = self._key(session_code)
+        if cached is None:
+            pipe.delete(key)
+        # ▶ a random revision, not a counter: a board deleted and created
+        #   again must never match a copy some worker still holds
+        rev = os.urandom(8).hex()
+        pipe.hset(key, mapping={
+            'meta': pickle.dumps(meta, pickle.HIGHEST_PROTOCOL), 'rev': rev})
+        if self.ttl:
+            for k in self._keys(session_code):
+                pipe.expire(k, self.ttl)
+        pipe.execute()
+        self._remember(session_code, _Cached(rev, sess, next_slot, parts))
+
+    @contextmanager
+    def session(self, session_code, default=None):
+        try:
+            with super().session(session_code, default) as sess:
+                yield sess
+        except BaseException:
+            self.cache.pop(session_code, None)  # ▶ may hold half an update
+            raise
+
+    def delete(self, session_code):
+        self.cache.pop(session_code, None)
+        self.client.delete(*self._keys(session_code))
+
+    def evict(self, session_code):
+        """Drop the local copy; Redis keeps the board until `ttl` runs out"""
+        self.cache.pop(session_code, None)
+        if self.ttl:
+            for key in self._keys(session_code):
+                self.client.expire(key, self.ttl)
+
+    def codes(self):
+        start = len(self.prefix)
+        keys = self.client.scan_iter(match=self.prefix + '*')
+        return [(key.decode() if isinstance(key, bytes) else key)[start:]
+                for key in keys]
+
+    def beat(self, worker, ttl):
+        self.client.set(self.worker_prefix + worker, 1, ex=ttl)
+
+    def alive(self, workers):
+        workers = list(workers)
+        if not workers:
+            return set()
+        beats = self.client.mget([self.worker_prefix + w for w in workers])
+        return {w for w, beat in zip(workers, beats) if beat is not None}
+
+    def lock(self, session_code):
+        return self.client.lock(self.lock_prefix + session_code,
+                                timeout=self.lock_timeout)
+
+    def __len__(self):
+        return len(self.codes())
+
+
+def create_store(redis_url=None, snapshot_path=None, run_blocking=None,
+                 on_load=None, async_mode=None, **redis_options):
+    """Redis-backed store when a URL is configured, in-memory otherwise
+
+    `async_mode` picks the kind of lock snapshots take in run_blocking's
+    threads. redis_options (parts, derived, rebuild, ttl, ...) go to
+    RedisSessionStore.
+    """
+    if not redis_url:
+        snapshots = None
+        if snapshot_path:
+            from persistence import SnapshotStore
+            snapshots = SnapshotStore(snapshot_path, async_mode)
+        return MemorySessionStore(snapshots, run_blocking, on_load)
+    import redis
+    return RedisSessionStore(redis.Redis.from_url(redis_url), **redis_options)
@@ -0,0 +1,52 @@
+import os
+import re
+import sys
+
+import pytest
+
+# the modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# --------------------------------------------------------------------
+# Shared fixtures for tests that drive server.py through Flask-SocketIO
+# test clients. `server` is imported lazily: the pure module tests run
+# without Flask installed.
+# --------------------------------------------------------------------
+
+
+@pytest.fixture
+def code(request):
+    """A session code of the test's own"""
+    return 'test-' + re.sub(r'[^\w-]', '-', request.node.name)
+
+
+@pytest.fixture
+def connect(code):
+    """connect(query='') -> test client joined to `code`
+
+    Every client is disconnected afterwards, and the session, with
+    anything still queued for it, is dropped.
+    """
+    import server
+    clients = []
+
+    def open_client(query=''):
+        client = server.socketio.test_client(
+            server.app, query_string='session_code=%s%s' % (code, query))
+        clients.append(client)
+        return client
+
+    yield open_client
+    for client in clients:
+        if client.is_connected():
+            client.disconnect()
+    server._outbox.pop(code, None)
+    server.store.delete(code)
+
+
+@pytest.fixture
+def unlimited(monkeypatch):
+    """No inbound rate limits, for tests that send in bursts"""
+    import server
+    monkeypatch.setattr(server, 'socket_limits', server.RateLimiter({}))
+    monkeypatch.setattr(server, 'room_limits', server.RateLimiter({}))
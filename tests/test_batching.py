@@ -0,0 +1,80 @@
+import pytest
+
+import server
+from codec import pack_points
+
+# --------------------------------------------------------------------
+# Outbound batching: one `batch` frame per flush, in order; senders get
+# the frame minus their own events, pen moves on one stroke are merged,
+# and each encoding gets its own points.
+# --------------------------------------------------------------------
+
+
+@pytest.fixture
+def room(connect, code, monkeypatch):
+    monkeypatch.setattr(server, 'BATCH_INTERVAL', 1.0)
+    monkeypatch.setattr(server, '_flush_task', object())   # ▶ flushed by hand
+    clients = {name: connect('&encoding=' + encoding)
+               for name, encoding in (('alice', 'json'), ('bob', 'packed'),
+                                      ('carol', 'json'))}
+    for client in clients.values():
+        client.get_received()
+    return clients, code
+
+
+def _frames(client):
+    received = client.get_received()
+    assert all(p['name'] == 'batch' for p in received)
+    return [[(event, payload) for event, payload in p['args'][0]['events']]
+            for p in received]
+
+
+def _summary(frame):
+    return [(event, payload.get('stroke', payload).get('id'),
+             payload.get('stroke', payload).get('points'))
+            for event, payload in frame]
+
+
+def test_flush_keeps_order_and_skips_each_senders_own(room):
+    clients, code = room
+    alice, bob, carol = clients['alice'], clients['bob'], clients['carol']
+    alice.emit('add_stroke', {'session_code': code, 'stroke': {
+        'id': 'a1', 'points': [[0, 0]]}})
+    alice.emit('append_points', {'session_code': code, 'id': 'a1',
+                                 'points': [[1, 1]]})
+    bob.emit('add_stroke', {'session_code': code, 'stroke': {
+        'id': 'b1', 'points': [[50, 50], [60, 60]]}})
+    # ▶ no skip_sid: everyone, the eraser included, gets this one
+    carol.emit('erase_region', {'session_code': code,
+                                'rect': [40, 40, 70, 70]})
+    alice.emit('append_points', {'session_code': code, 'id': 'a1',
+                                 'points': [[2, 2]]})
+    assert len(server._outbox[code]['events']) == 4
+    for client in clients.values():
+        assert client.get_received() == []
+
+    server._flush_room(code)
+    added_a1 = ('stroke_added', 'a1', [[0, 0], [1, 1]])
+    added_b1 = ('stroke_added', 'b1', [[50, 50], [60, 60]])
+    erased = ('region_erased', None, None)
+    appended = ('points_appended', 'a1', [[2, 2]])
+
+    assert [_summary(f) for f in _frames(carol)] == \
+        [[added_a1, added_b1, erased, appended]]
+    assert [_summary(f) for f in _frames(alice)] == [[added_b1, erased]]
+    packed = [_summary(f) for f in _frames(bob)]
+    assert packed == [[
+        ('stroke_added', 'a1', bytes(pack_points([[0, 0], [1, 1]]))),
+        erased,
+        ('points_appended', 'a1', bytes(pack_points([[2, 2]])))]]
+    assert server._outbox.get(code) is None
+
+
+def test_direct_emit_flushes_queued_events_first(room):
+    clients, code = room
+    alice, carol = clients['alice'], clients['carol']
+    alice.emit('add_stroke', {'session_code': code, 'stroke': {
+        'id': 'a1', 'points': [[0, 0]]}})
+    alice.emit('set_quiz_status', {'session_code': code, 'is_quiz': True})
+    assert [p['name'] for p in carol.get_received()] == \
+        ['stroke_added', 'quiz_status_updated']
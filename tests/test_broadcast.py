@@ -0,0 +1,98 @@
+import queue
+from types import SimpleNamespace
+
+import socketio
+from engineio import packet as eio_packet
+from socketio import packet as sio_packet
+
+from broadcast import Backpressure, GatedManager, gated_manager
+
+# --------------------------------------------------------------------
+# Backpressure counts Socket.IO messages, whatever their attachments
+# --------------------------------------------------------------------
+
+
+def _server(packet_class, queued):
+    q = queue.Queue()
+    for pkt in queued:
+        q.put(pkt)
+    return SimpleNamespace(packet_class=packet_class,
+                           eio=SimpleNamespace(sockets={
+                               'e1': SimpleNamespace(queue=q)}))
+
+
+def _message(attachments):
+    head = eio_packet.Packet(eio_packet.MESSAGE, '5%d-["session_data",{}]'
+                             % attachments)
+    return [head] + [eio_packet.Packet(eio_packet.MESSAGE, b'\0' * 8)
+                     for _ in range(attachments)]
+
+
+def test_attachments_ride_with_their_message():
+    sio = _server(sio_packet.Packet, _message(300) + _message(0))
+    gate = Backpressure(sio, max_backlog=4)
+    assert gate.backlog('e1') == 2
+    assert gate.admit('s1', 'e1')
+    assert gate.backlog('gone') == 0
+
+
+def test_msgpack_packets_are_each_a_message():
+    # ▶ as socketio.msgpack_packet.MsgPackPacket
+    sio = _server(SimpleNamespace(uses_binary_events=False),
+                  [eio_packet.Packet(eio_packet.MESSAGE, b'\x93')] * 3)
+    gate = Backpressure(sio, max_backlog=3)
+    assert gate.backlog('e1') == 3
+    assert not gate.admit('s1', 'e1')
+    assert list(gate.lagging) == ['s1']
+
+
+# --------------------------------------------------------------------
+# GatedManager: local delivery skips refused sockets and counts bytes,
+# also for messages another worker published to the Redis queue
+# --------------------------------------------------------------------
+class _Refuse:
+    def __init__(self, *sids):
+        self.sids = set(sids)
+
+    def admit(self, sid, eio_sid):
+        return sid not in self.sids
+
+
+def _room(manager):
+    server = socketio.Server(client_manager=manager)
+    sent, counted = [], []
+    server._send_eio_packet = lambda eio_sid, pkt: sent.append(eio_sid)
+    sids = [manager.connect(eio_sid, '/') for eio_sid in ('e1', 'e2', 'e3')]
+    for sid in sids:
+        manager.enter_room(sid, '/', 'room')
+    manager.on_send = lambda event, size: counted.append((event, size))
+    return server, sids, sent, counted
+
+
+def test_gated_manager_skips_refused_sockets():
+    manager = GatedManager()
+    server, sids, sent, counted = _room(manager)
+    manager.gate = _Refuse(sids[1])
+    server.emit('paths_update', {'paths': []}, to='room', skip_sid=sids[0])
+    assert sent == ['e3']
+    assert counted == [('paths_update', len('42["paths_update",{"paths":[]}]'))]
+
+
+def test_gated_manager_binary_payload_counts_attachments():
+    manager = GatedManager()
+    server, sids, sent, counted = _room(manager)
+    server.emit('stroke_added', {'points': b'\0' * 16}, to='room')
+    assert sent == ['e1', 'e1', 'e2', 'e2', 'e3', 'e3']
+    head = len('451-["stroke_added",{"points":{"_placeholder":true,"num":0}}]')
+    assert counted == [('stroke_added', 3 * (head + 16))]
+
+
+def test_queued_messages_are_gated_on_delivery():
+    manager = gated_manager('redis://localhost:1/0')
+    server, sids, sent, counted = _room(manager)
+    manager.gate = _Refuse(sids[2])
+    manager._handle_emit({'method': 'emit', 'event': 'batch',
+                          'data': [{'events': []}], 'namespace': '/',
+                          'room': 'room', 'skip_sid': None})
+    assert sent == ['e1', 'e2']
+    assert counted and counted[0][0] == 'batch'
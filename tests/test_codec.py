@@ -0,0 +1,100 @@
+import pytest
+
+import server
+from codec import (JSON, PACKED, encode_payload, extend_points, pack_points,
+                   unpack_points)
+
+# --------------------------------------------------------------------
+# Packed vs JSON points: the same board whichever encoding a client
+# speaks, converted only at the edge
+# --------------------------------------------------------------------
+POINTS = [{'x': 0.5, 'y': -2.25}, {'x': 1024.0, 'y': 3.0}]     # ▶ exact float32
+
+
+def test_pack_round_trip():
+    packed = pack_points(POINTS)
+    assert len(packed) == 16 and unpack_points(packed) == POINTS
+    assert pack_points([[0.5, -2.25], (1024, 3)]) == packed
+    assert unpack_points(packed + b'\0\0\0') == POINTS    # ▶ ragged tail
+
+
+@pytest.mark.parametrize('points', [[{'x': 1, 'y': 2, 'pressure': 0.5}],
+                                    [[1, 2, 3]], ['x']])
+def test_lossy_points_stay_json(points):
+    assert pack_points(points) is None
+    assert encode_payload({'points': points}, PACKED)['points'] is points
+
+
+def test_payloads_decode_to_the_same_points():
+    payload = {'stroke': {'id': 'a', 'points': pack_points(POINTS)},
+               'paths': [{'id': 'b', 'points': POINTS}], 'version': 3}
+    as_json = encode_payload(payload, JSON)
+    as_packed = encode_payload(payload, PACKED)
+    assert as_json['stroke']['points'] == POINTS
+    assert as_json['paths'][0]['points'] is POINTS
+    assert unpack_points(as_packed['paths'][0]['points']) == POINTS
+    assert isinstance(as_packed['stroke']['points'], bytes)
+    assert as_json['version'] == as_packed['version'] == 3
+
+
+@pytest.mark.parametrize('stored, added', [
+    (POINTS[:1], POINTS[1:]), (POINTS[:1], pack_points(POINTS[1:])),
+    (pack_points(POINTS[:1]), POINTS[1:]),
+    (pack_points(POINTS[:1]), pack_points(POINTS[1:])),
+])
+def test_extend_points_across_encodings(stored, added):
+    stroke = {'id': 'a', 'points': stored}
+    extend_points(stroke, added)
+    points = stroke['points']
+    assert (unpack_points(points) if isinstance(points, bytearray)
+            else points) == POINTS
+
+
+def test_pressure_turns_a_packed_stroke_back_into_json():
+    stroke = {'id': 'a', 'points': pack_points(POINTS)}
+    extend_points(stroke, [{'x': 1, 'y': 1, 'pressure': 0.2}])
+    assert stroke['points'] == POINTS + [{'x': 1, 'y': 1, 'pressure': 0.2}]
+
+
+@pytest.fixture
+def room(unlimited, connect, code):
+    clients = {encoding: connect('&encoding=' + encoding)
+               for encoding in (JSON, PACKED)}
+    for client in clients.values():
+        client.get_received()
+    return clients, code
+
+
+def _received(client):
+    return {p['name']: p['args'][0] for p in client.get_received()}
+
+
+def test_json_and_packed_clients_share_one_board(room, connect):
+    clients, code = room
+    json_client, packed_client = clients[JSON], clients[PACKED]
+    packed_client.emit('add_stroke', {'session_code': code, 'stroke': {
+        'id': 'p', 'points': bytes(pack_points(POINTS))}}, callback=True)
+    json_client.emit('add_stroke', {'session_code': code, 'stroke': {
+        'id': 'j', 'points': POINTS}}, callback=True)
+    packed_client.emit('append_points', {'session_code': code, 'id': 'p',
+                                         'points': bytes(pack_points(POINTS))},
+                       callback=True)
+
+    seen = _received(json_client)
+    assert seen['stroke_added']['stroke']['points'] == POINTS
+    assert seen['points_appended']['points'] == POINTS
+    seen = _received(packed_client)
+    assert seen['stroke_added']['stroke']['points'] == bytes(pack_points(POINTS))
+
+    # ▶ stored as sent: packed stays packed, never inflated to dicts
+    stored = {p['id']: p['points'] for p in server.store.get(code)['paths']}
+    assert stored['p'] == pack_points(POINTS + POINTS)
+    assert stored['j'] == POINTS
+
+    late_json = connect('&encoding=json')
+    late_packed = connect('&encoding=packed')
+    board = _received(late_json)['session_data']
+    packed_board = _received(late_packed)['session_data']
+    assert [p['points'] for p in board['paths']] == [POINTS + POINTS, POINTS]
+    assert [unpack_points(p['points']) for p in packed_board['paths']] == \
+        [POINTS + POINTS, POINTS]
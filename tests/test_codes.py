@@ -0,0 +1,88 @@
+import pytest
+
+import server
+
+# --------------------------------------------------------------------
+# Code registry: deduplicated on add, paged back to the asker only
+# --------------------------------------------------------------------
+
+
+@pytest.fixture
+def room(unlimited, connect, code):
+    alice, bob = connect(), connect()
+    add = lambda value: alice.emit('add_code', {'session_code': code,
+                                                'code': value}, callback=True)
+    return alice, bob, add, code
+
+
+def _page(client, code, **query):
+    client.get_received()
+    client.emit('get_all_codes', dict(query, session_code=code))
+    return [p['args'][0] for p in client.get_received()
+            if p['name'] == 'all_codes']
+
+
+def test_duplicates_keep_their_first_seq(room):
+    alice, bob, add, code = room
+    assert add('abc')['seq'] == 1
+    assert add(42)['seq'] == 2
+    assert add('abc') == {'seq': 1, 'duplicate': True}
+    assert add('42')['seq'] == 3        # ▶ a string is not the number
+    sess = server.store.get(code)
+    assert sess['codes'] == ['abc', 42, '42']
+    assert sess['code_index'] == {'abc': 1, 42: 2, '42': 3}
+    added = [p['args'][0] for p in bob.get_received()
+             if p['name'] == 'code_added']
+    assert [a['seq'] for a in added] == [1, 2, 3]
+
+
+@pytest.mark.parametrize('value', [None, True, 1.5, ['x'], 'x' * 257])
+def test_bad_codes_are_refused(room, value):
+    alice, bob, add, code = room
+    alice.get_received()
+    assert not add(value)
+    assert [p['name'] for p in alice.get_received()] == ['code_error']
+    assert server.store.get(code)['codes'] == []
+
+
+def test_limit_stops_new_codes(room, monkeypatch):
+    alice, bob, add, code = room
+    monkeypatch.setattr(server, 'CODE_LIMIT', 2)
+    add('a'), add('b'), add('c')
+    assert server.store.get(code)['codes'] == ['a', 'b']
+    assert add('a')['duplicate']
+
+
+def test_paging_with_since_and_limit(room):
+    alice, bob, add, code = room
+    for i in range(5):
+        add('c%d' % i)
+    page, = _page(bob, code, since=1, limit=2)
+    assert page == {'codes': ['c1', 'c2'], 'since': 1, 'next': 3, 'total': 5}
+    page, = _page(bob, code, since=page['next'])
+    assert page['codes'] == ['c3', 'c4'] and page['next'] == 5
+    assert _page(bob, code, since=5)[0]['codes'] == []
+    # ▶ answered to the asker only
+    assert all(p['name'] != 'all_codes' for p in alice.get_received())
+
+
+@pytest.mark.parametrize('since, limit, expected', [
+    ('nan', 'inf', (0, 200)), (-3, 0, (0, 1)), ('2', '1', (2, 1)),
+    (None, 10 ** 9, (0, 200)), ({}, [], (0, 200)), (1e400, 2.7, (0, 2)),
+])
+def test_bad_paging_input_is_bounded(room, since, limit, expected):
+    alice, bob, add, code = room
+    for i in range(5):
+        add('c%d' % i)
+    page, = _page(bob, code, since=since, limit=limit)
+    start, count = expected
+    assert page['since'] == start
+    assert page['codes'] == ['c%d' % i for i in range(5)][start:start + count]
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, 7), ('x', 7), ('nan', 7), (float('inf'), 7), (10 ** 400, 10),
+    (-5, 0), (3.9, 3), ('12', 10), (True, 1),
+])
+def test_bounded(value, expected):
+    assert server._bounded(value, 7, 0, 10) == expected
@@ -0,0 +1,133 @@
+import copy
+import random
+
+import pytest
+
+from crdt import Board, order_key
+
+# --------------------------------------------------------------------
+# Convergence under any delivery order
+#
+# A few clients draw, extend and remove strokes concurrently. Every
+# replica gets every op in its own random order, with duplicates; ops
+# that arrive too early (an append before its add) are simply delivered
+# again later, as the owner's resend would. All replicas must end with
+# the strokes the clients last saw alive, in board order.
+# --------------------------------------------------------------------
+CLIENTS = ('alice', 'bob', 'carol')
+
+
+def _history(rng, steps=60):
+    """Ops as the clients would emit them, in the order they were made,
+    and the strokes the board should end with"""
+    ops, live, removed, clock = [], {}, {}, 0
+    seqs = dict.fromkeys(CLIENTS, 0)
+    for _ in range(steps):
+        client = rng.choice(CLIENTS)
+        clock += 1
+        kind = rng.random()
+        owned = [s for s in live.values() if s['id'].startswith(client + ':')]
+        if kind < 0.4 or not live:
+            seqs[client] += 1
+            stroke = {'id': '%s:%d' % (client, seqs[client]), 'clock': clock,
+                      'points': _points(rng)}
+            live[stroke['id']] = stroke
+            ops.append({'op': 'add', 'stroke': copy.deepcopy(stroke)})
+        elif kind < 0.7 and owned:
+            stroke = rng.choice(owned)
+            points = _points(rng)
+            ops.append({'op': 'append', 'id': stroke['id'],
+                        'offset': len(stroke['points']), 'points': points})
+            stroke['points'] = stroke['points'] + points
+        elif kind < 0.9 or not removed:
+            stroke = live.pop(rng.choice(sorted(live)))
+            removed[stroke['id']] = stroke
+            ops.append({'op': 'remove', 'id': stroke['id'], 'clock': clock})
+        else:
+            # ▶ redo: a removed stroke added again with a newer clock
+            stroke = removed.pop(rng.choice(sorted(removed)))
+            stroke['clock'] = clock
+            live[stroke['id']] = stroke
+            ops.append({'op': 'add', 'stroke': copy.deepcopy(stroke)})
+    return ops, sorted(live.values(), key=order_key)
+
+
+def _points(rng):
+    return [[rng.randint(0, 99), rng.randint(0, 99)]
+            for _ in range(rng.randint(1, 4))]
+
+
+def _deliver(board, ops, rng=None, duplicates=0.2, rounds=50):
+    """Random order with duplicates, redelivered until nothing changes
+
+    Without rng the ops go in the order they were made, once per round.
+    """
+    for _ in range(rounds):
+        batch = list(ops)
+        if rng is not None:
+            batch += [op for op in ops if rng.random() < duplicates]
+            rng.shuffle(batch)
+        changed = False
+        for op in batch:
+            changed |= board.apply(copy.deepcopy(op))
+        if not changed:
+            return board
+    raise AssertionError('replica did not settle')
+
+
+def _state(board):
+    return [(s['id'], s['clock'], s['points']) for s in board.paths]
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_replicas_converge(seed):
+    rng = random.Random(seed)
+    ops, expected = _history(rng)
+    expected = [(s['id'], s['clock'], s['points']) for s in expected]
+    assert _state(_deliver(Board(), ops)) == expected
+    for _ in range(3):
+        replica = _deliver(Board(), ops, rng)
+        assert _state(replica) == expected
+        assert set(replica.index) == {s['id'] for s in replica.paths}
+
+
+def test_remove_before_add_stays_removed():
+    board = Board()
+    assert not board.apply({'op': 'remove', 'id': 'a:1', 'clock': 5})
+    assert not board.apply({'op': 'add', 'stroke': {'id': 'a:1', 'clock': 3,
+                                                    'points': [[0, 0]]}})
+    assert board.paths == []
+    # ▶ a later add (redo) brings it back
+    assert board.apply({'op': 'add', 'stroke': {'id': 'a:1', 'clock': 6,
+                                                'points': [[0, 0]]}})
+    assert [s['id'] for s in board.paths] == ['a:1']
+
+
+def test_overlapping_appends_apply_once():
+    board = Board()
+    board.apply({'op': 'add', 'stroke': {'id': 'a:1', 'clock': 1,
+                                         'points': [[0, 0]]}})
+    board.apply({'op': 'append', 'id': 'a:1', 'offset': 1,
+                 'points': [[1, 1], [2, 2]]})
+    assert not board.apply({'op': 'append', 'id': 'a:1', 'offset': 1,
+                            'points': [[1, 1]]})
+    assert board.apply({'op': 'append', 'id': 'a:1', 'offset': 2,
+                        'points': [[2, 2], [3, 3]]})
+    assert not board.apply({'op': 'append', 'id': 'a:1', 'offset': 9,
+                            'points': [[9, 9]]})
+    assert board.paths[0]['points'] == [[0, 0], [1, 1], [2, 2], [3, 3]]
+
+
+@pytest.mark.parametrize('clock', ['9', 9.0, None, True])
+def test_ops_without_an_integer_clock_change_nothing(clock):
+    board = Board()
+    board.apply({'op': 'add', 'stroke': {'id': 'a:1', 'clock': 1,
+                                         'points': [[0, 0]]}})
+    with pytest.raises(ValueError):
+        board.apply({'op': 'remove', 'id': 'a:1', 'clock': clock})
+    with pytest.raises(ValueError):
+        board.apply({'op': 'add', 'stroke': {'id': 'a:2', 'clock': clock,
+                                             'points': [[0, 0]]}})
+    assert len(board.tombstones) == 0
+    assert board.apply({'op': 'remove', 'id': 'a:1', 'clock': 2})
+    assert board.paths == []
@@ -0,0 +1,236 @@
+import copy
+import random
+
+import pytest
+
+import server
+from crdt import Board, order_key
+from spatial import stroke_bounds
+from test_crdt import _history
+
+# --------------------------------------------------------------------
+# crdt_ops against a live session: after any delivery order the stroke
+# index, the grid and the position map match the board, and undo / redo
+# walk it back and forth without losing any of them.
+# --------------------------------------------------------------------
+
+
+@pytest.fixture
+def session(connect, code):
+    return connect(), code
+
+
+def _assert_consistent(sess):
+    paths = sess['paths']
+    assert set(sess['stroke_index']) == {s['id'] for s in paths}
+    for stroke in paths:
+        assert sess['stroke_index'][stroke['id']] is stroke
+    grid = server._grid(sess)
+    assert set(grid.bounds) == set(sess['stroke_index'])
+    for stroke in paths:
+        assert grid.bounds[stroke['id']] == stroke_bounds(stroke)
+    assert server._positions(sess) == (
+        {s['id']: i for i, s in enumerate(paths)}, set())
+    assert server._region_positions(sess, (-1, -1, 100, 100)) == \
+        list(range(len(paths)))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_crdt_ops_keep_index_grid_and_undo(session, seed, unlimited):
+    client, code = session
+    rng = random.Random(seed)
+    ops, expected = _history(rng, steps=40)
+    batch = ops + [op for op in ops if rng.random() < 0.2]
+    rng.shuffle(batch)
+    for _ in range(5):          # ▶ early appends come back as resends
+        client.emit('crdt_ops', {'session_code': code,
+                                 'ops': copy.deepcopy(batch)}, callback=True)
+
+    sess = server.store.get(code)
+    assert [s['id'] for s in sess['paths']] == [s['id'] for s in expected]
+    _assert_consistent(sess)
+
+    board = copy.deepcopy(sess['paths'])
+    depth = len(sess['undo_stack'])
+    for _ in range(depth):
+        client.emit('undo_request', {'session_code': code}, callback=True)
+        _assert_consistent(server.store.get(code))
+    assert server.store.get(code)['paths'] == []
+    for _ in range(depth):
+        client.emit('redo_request', {'session_code': code}, callback=True)
+        _assert_consistent(server.store.get(code))
+    # ▶ redo puts strokes back under fresh clocks, so as the newest
+    sess = server.store.get(code)
+    assert _drawn(sess['paths']) == _drawn(board)
+    assert sess['paths'] == sorted(sess['paths'], key=order_key)
+
+
+def _drawn(paths):
+    return sorted((s['id'], s['points']) for s in paths)
+
+
+def test_undo_buries_a_crdt_add_against_redelivery(session):
+    client, code = session
+    add = {'op': 'add', 'stroke': {'id': 'al:1', 'clock': 1,
+                                   'points': [[0, 0], [5, 5]]}}
+    client.emit('crdt_ops', {'session_code': code,
+                             'ops': [copy.deepcopy(add)]}, callback=True)
+    ack = client.emit('undo_request', {'session_code': code}, callback=True)
+    assert ack['clock'] > 1
+    client.emit('crdt_ops', {'session_code': code,
+                             'ops': [copy.deepcopy(add)]}, callback=True)
+    assert server.store.get(code)['paths'] == []
+
+    client.emit('redo_request', {'session_code': code}, callback=True)
+    client.emit('crdt_ops', {'session_code': code,
+                             'ops': [copy.deepcopy(add)]}, callback=True)
+    sess = server.store.get(code)
+    assert [(s['id'], s['clock']) for s in sess['paths']] == \
+        [('al:1', ack['clock'] + 1)]
+    _assert_consistent(sess)
+
+    # ▶ a replica fed only the broadcast ops ends on the same board
+    replica = Board()
+    for packet in client.get_received():
+        if packet['name'] == 'crdt_op':
+            replica.apply(packet['args'][0])
+    assert _drawn(replica.paths) == _drawn(sess['paths'])
+
+
+def test_malformed_crdt_ops_are_skipped(session):
+    client, code = session
+    good = {'op': 'add', 'stroke': {'id': 'al:1', 'clock': 1,
+                                    'points': [[0, 0]]}}
+    bad = [{'op': 'add'}, {'op': 'add', 'stroke': None}, {'op': 'remove'},
+           {'op': 'append', 'id': ['x']}, {'op': 'remove', 'id': 'x',
+                                            'clock': 1, 'stroke': 'x'}, 'x']
+    client.emit('crdt_ops', {'session_code': code, 'ops': bad + [good]},
+                callback=True)
+    assert [s['id'] for s in server.store.get(code)['paths']] == ['al:1']
+
+
+def test_string_clock_remove_leaves_no_tombstone(session):
+    client, code = session
+    add = {'op': 'add', 'stroke': {'id': 'al:1', 'clock': 1,
+                                   'points': [[0, 0]]}}
+    client.emit('crdt_ops', {'session_code': code, 'ops': [
+        add, {'op': 'remove', 'id': 'al:1', 'clock': '9'}]}, callback=True)
+    sess = server.store.get(code)
+    assert list(sess['tombstones']) == []
+    client.emit('undo_request', {'session_code': code}, callback=True)
+    assert server.store.get(code)['paths'] == []
+
+
+@pytest.mark.parametrize('event, data', [
+    ('clear_paths', {}),
+    ('remove_stroke', {'id': 'al:1'}),
+    ('erase_region', {'rect': [-1, -1, 10, 10]}),
+    ('update_paths', {'paths': []}),
+])
+def test_removals_bury_crdt_strokes(session, event, data):
+    client, code = session
+    add = {'op': 'add', 'stroke': {'id': 'al:1', 'clock': 1,
+                                   'points': [[0, 0], [5, 5]]}}
+    client.emit('crdt_ops', {'session_code': code,
+                             'ops': [copy.deepcopy(add)]}, callback=True)
+    client.emit(event, dict(data, session_code=code))
+    client.emit('crdt_ops', {'session_code': code,
+                             'ops': [copy.deepcopy(add)]}, callback=True)
+    assert server.store.get(code)['paths'] == []
+
+    # ▶ undoing the removal still puts the stroke back
+    client.emit('undo_request', {'session_code': code}, callback=True)
+    sess = server.store.get(code)
+    assert [s['id'] for s in sess['paths']] == ['al:1']
+    _assert_consistent(sess)
+
+
+def test_splice_undo_drops_the_tombstone_it_outdates(session):
+    client, code = session
+    client.emit('add_stroke', {'session_code': code,
+                               'stroke': {'id': 'legacy', 'points': [[0, 0]]}})
+    client.emit('crdt_ops', {'session_code': code, 'ops': [
+        {'op': 'add', 'stroke': {'id': 'al:1', 'clock': 1,
+                                 'points': [[0, 0]]}}]}, callback=True)
+    client.emit('clear_paths', {'session_code': code})
+    assert [k for k, _ in server.store.get(code)['tombstones']] == ['al:1']
+    # ▶ a mixed step is undone as a plain splice
+    client.emit('undo_request', {'session_code': code}, callback=True)
+    sess = server.store.get(code)
+    assert [s['id'] for s in sess['paths']] == ['legacy', 'al:1']
+    assert list(sess['tombstones']) == []
+
+
+def _crdt_add(stroke_id, clock, x=0):
+    return {'op': 'add', 'stroke': {'id': stroke_id, 'clock': clock,
+                                    'points': [[x, x], [x + 1, x + 1]]}}
+
+
+def test_undo_finds_strokes_a_crdt_readd_moved(session):
+    client, code = session
+
+    def send(event, **data):
+        return client.emit(event, dict(data, session_code=code),
+                           callback=True)
+
+    send('add_stroke', stroke={'id': 's1', 'points': [[0, 0]]})
+    send('crdt_ops', ops=[_crdt_add('c:1', 1)])
+    send('add_stroke', stroke={'id': 's2', 'points': [[0, 0]]})
+    send('crdt_ops', ops=[_crdt_add('c:1', 5)])
+    for _ in range(3):
+        send('undo_request')
+    sess = server.store.get(code)
+    # ▶ the re-added c:1 went to the end; the third undo still takes s2
+    assert [s['id'] for s in sess['paths']] == ['s1', 'c:1']
+    _assert_consistent(sess)
+
+
+# ▶ seed 235 once undid a stale copy back next to a newer one
+@pytest.mark.parametrize('seed', [*range(40), 235])
+def test_mixed_legacy_and_crdt_history_stays_consistent(session, seed,
+                                                        unlimited):
+    client, code = session
+    rng = random.Random(seed)
+    clock, seq, boards = 0, 0, []
+
+    def send(event, **data):
+        return client.emit(event, dict(data, session_code=code),
+                           callback=True)
+
+    for step in range(60):
+        kind = rng.random()
+        ids = [s['id'] for s in server.store.get(code)['paths']]
+        if kind < 0.2:
+            send('add_stroke', stroke={'id': 'l%d' % step,
+                                       'points': [[step, step]]})
+        elif kind < 0.4:
+            clock += 1
+            if seq and rng.random() < 0.3:
+                # ▶ a newer version of a stroke drawn before
+                cid = 'c:%d' % rng.randint(1, seq)
+            else:
+                seq += 1
+                cid = 'c:%d' % seq
+            send('crdt_ops', ops=[_crdt_add(cid, clock, step)])
+        elif kind < 0.5 and ids:
+            clock += 1
+            send('crdt_ops', ops=[{'op': 'remove', 'id': rng.choice(ids),
+                                   'clock': clock}])
+        elif kind < 0.55:
+            send('clear_paths')
+        elif kind < 0.6 and boards:
+            # ▶ a legacy client that missed the latest changes
+            send('update_paths', paths=copy.deepcopy(rng.choice(boards)))
+        elif kind < 0.65:
+            x = rng.randrange(60)
+            send('erase_region', rect=[x, x, x + 8, x + 8])
+        elif kind < 0.85:
+            send('undo_request')
+        else:
+            send('redo_request')
+        clock = max(clock, server.store.get(code).get('clock', 0))
+        sess = server.store.get(code)
+        ids = [s['id'] for s in sess['paths']]
+        assert len(ids) == len(set(ids)), step
+        boards.append(copy.deepcopy(sess['paths']))
+        _assert_consistent(sess)
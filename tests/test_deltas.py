@@ -0,0 +1,91 @@
+import pytest
+
+import server
+
+# --------------------------------------------------------------------
+# Stroke deltas: each op changes the stored board, bumps the version
+# once and reaches everyone but its sender as just the change
+# --------------------------------------------------------------------
+
+
+@pytest.fixture
+def room(unlimited, connect, code):
+    alice, bob = connect(), connect()
+    alice.get_received(), bob.get_received()
+    send = lambda event, **data: alice.emit(
+        event, dict(data, session_code=code), callback=True)
+    return send, alice, bob, code
+
+
+def _events(client):
+    return [(p['name'], p['args'][0]) for p in client.get_received()]
+
+
+def _stroke(stroke_id, *xs):
+    return {'id': stroke_id, 'color': 'red',
+            'points': [{'x': x, 'y': 0} for x in xs]}
+
+
+def test_add_append_remove(room):
+    send, alice, bob, code = room
+    assert send('add_stroke', stroke=_stroke('a', 0, 1)) == {'version': 1}
+    assert send('append_points', id='a',
+                points=[{'x': 2, 'y': 0}]) == {'version': 2}
+    assert send('remove_stroke', id='a') == {'version': 3}
+    assert _events(alice) == []         # ▶ the sender drew it already
+    assert _events(bob) == [
+        ('stroke_added', {'stroke': _stroke('a', 0, 1), 'version': 1}),
+        ('points_appended', {'id': 'a', 'points': [{'x': 2, 'y': 0}],
+                             'version': 2}),
+        ('stroke_removed', {'id': 'a', 'version': 3})]
+    sess = server.store.get(code)
+    assert sess['paths'] == [] and sess['stroke_index'] == {}
+
+
+def test_appends_extend_the_stored_stroke(room):
+    send, alice, bob, code = room
+    send('add_stroke', stroke=_stroke('a', 0))
+    for x in range(1, 4):
+        send('append_points', id='a', points=[{'x': x, 'y': 0}])
+    stroke = server.store.get(code)['paths'][0]
+    assert stroke == _stroke('a', 0, 1, 2, 3)
+    assert server.store.get(code)['stroke_index']['a'] is stroke
+
+
+def test_duplicates_and_unknown_ids_change_nothing(room):
+    send, alice, bob, code = room
+    send('add_stroke', stroke=_stroke('a', 0))
+    bob.get_received()
+    assert send('add_stroke', stroke=_stroke('a', 5, 6)) == \
+        {'version': 1, 'duplicate': True}
+    assert not send('append_points', id='ghost', points=[{'x': 1, 'y': 1}])
+    assert not send('remove_stroke', id='ghost')
+    assert _events(bob) == []
+    sess = server.store.get(code)
+    assert sess['version'] == 1 and sess['paths'] == [_stroke('a', 0)]
+
+
+def test_update_paths_still_works_and_logs_only_the_change(room):
+    send, alice, bob, code = room
+    board = [_stroke('s%d' % i, i) for i in range(5)]
+    send('update_paths', paths=board)
+    board[2] = _stroke('s2', 9, 9)
+    send('update_paths', paths=board)
+    (_, first), (_, second) = _events(bob)
+    assert second['paths'] == board     # ▶ old clients get the whole board
+    event, delta = server.store.get(code)['op_log'][-1]
+    assert event == 'splice'
+    assert delta == {'index': 2, 'remove': 1, 'insert': [_stroke('s2', 9, 9)],
+                     'version': 2}
+
+
+def test_late_joiner_sees_the_board_the_deltas_built(room, connect):
+    send, alice, bob, code = room
+    send('add_stroke', stroke=_stroke('a', 0))
+    send('add_stroke', stroke=_stroke('b', 1))
+    send('append_points', id='a', points=[{'x': 7, 'y': 0}])
+    send('remove_stroke', id='b')
+    carol = connect()
+    snapshot, = [data for name, data in _events(carol) if name == 'session_data']
+    assert snapshot['paths'] == [_stroke('a', 0, 7)]
+    assert snapshot['version'] == 4
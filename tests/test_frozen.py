@@ -0,0 +1,91 @@
+import pytest
+
+import server
+from frozen import Frozen, thaw
+from store import create_store
+from timers import TimerWheel
+
+# --------------------------------------------------------------------
+# Cold sessions: compressed in place when idle, thawed by their next
+# event with history intact; old undo entries kept frozen meanwhile.
+# --------------------------------------------------------------------
+
+
+def _stroke(stroke_id, x):
+    return {'id': stroke_id,
+            'points': [{'x': x, 'y': x}, {'x': x + 1, 'y': x}]}
+
+
+def _ids(sess):
+    return [p['id'] for p in sess['paths']]
+
+
+def test_frozen_round_trip_counts_without_thawing():
+    value = [_stroke('a', 0), _stroke('b', 1)]
+    frozen = Frozen(value)
+    assert len(frozen) == 2 and frozen.thaw() == value
+    assert thaw(frozen) == value and thaw(value) is value
+    assert Frozen(raw=frozen.raw()).thaw() == value
+
+
+@pytest.fixture
+def board(unlimited, connect, code):
+    sio, watcher = connect(), connect()
+    send = lambda event, **data: sio.emit(
+        event, dict(data, session_code=code), callback=True)
+    for i in range(12):
+        send('add_stroke', stroke=_stroke('s%d' % i, i * 10))
+    for i in range(10):
+        send('remove_stroke', id='s%d' % i)
+    watcher.get_received()
+    return send, watcher, code
+
+
+def test_compressed_session_thaws_with_working_history(board):
+    send, watcher, code = board
+    stack = server.store.get(code)['undo_stack']
+    assert any(isinstance(entry[1], Frozen) for entry in stack)
+
+    server._compress_cold([code])
+    assert isinstance(server.store.sessions[code], Frozen)
+    assert server.store.frozen() == 1
+
+    for _ in range(10):         # ▶ down into the frozen entries
+        send('undo_request')
+    sess = server.store.sessions[code]
+    assert not isinstance(sess, Frozen)
+    assert _ids(sess) == ['s%d' % i for i in range(12)]
+    assert sess['stroke_index']['s0'] is sess['paths'][0]
+    for _ in range(4):
+        send('redo_request')
+    assert _ids(server.store.get(code)) == ['s%d' % i for i in range(4, 12)]
+    assert len([p for p in watcher.get_received()
+                if p['name'] in ('undo', 'redo')]) == 14
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    tick = lambda: now[0]
+    for name, callback in (('cold_wheel', server._compress_cold),
+                           ('idle_wheel', server._evict_idle)):
+        monkeypatch.setattr(server, name, TimerWheel(callback, clock=tick))
+    return now
+
+
+def test_idle_sessions_go_cold_then_leave_memory(tmp_path, monkeypatch, clock,
+                                                 unlimited, connect, code):
+    monkeypatch.setattr(server, 'store', create_store(
+        None, str(tmp_path / 'sessions.db'), on_load=server._prune_workers))
+    sio = connect()
+    sio.emit('add_stroke', {'session_code': code, 'stroke': _stroke('a', 0)},
+             callback=True)
+    sio.disconnect()
+
+    clock[0] += server.SESSION_COLD_AFTER + 1
+    server.cold_wheel.advance()
+    assert isinstance(server.store.sessions[code], Frozen)
+    clock[0] += server.SESSION_IDLE_TTL
+    server.idle_wheel.advance()
+    assert code not in server.store.sessions
+    assert _ids(server.store.get(code)) == ['a']    # ▶ back from the snapshot
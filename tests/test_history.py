@@ -0,0 +1,132 @@
+import copy
+
+import pytest
+
+import server
+
+# --------------------------------------------------------------------
+# Positional undo / redo: each step travels as a splice, and a second
+# client that only applies what it is sent must end on the server's board
+# --------------------------------------------------------------------
+
+
+class Replica:
+    """A client's board, built from the events it receives"""
+
+    def __init__(self, client):
+        self.client = client
+        self.paths = None
+
+    def sync(self):
+        for packet in self.client.get_received():
+            self.apply(packet['name'], packet['args'][0])
+        return [(p['id'], len(p['points'])) for p in self.paths]
+
+    def apply(self, event, data):
+        paths = self.paths
+        if event == 'session_data':
+            self.paths = copy.deepcopy(data['paths'])
+        elif event == 'stroke_added':
+            paths.append(copy.deepcopy(data['stroke']))
+        elif event == 'points_appended':
+            next(p for p in paths if p['id'] == data['id'])['points'] += \
+                data['points']
+        elif event == 'stroke_removed':
+            paths[:] = [p for p in paths if p['id'] != data['id']]
+        elif event == 'region_erased':
+            hit = set(data['indices'])
+            paths[:] = [p for i, p in enumerate(paths) if i not in hit]
+        elif event in ('paths_update', 'paths_cleared'):
+            paths[:] = copy.deepcopy(data['paths'])
+        elif event in ('undo', 'redo'):
+            index = data['index']
+            paths[index:index + data['remove']] = copy.deepcopy(data['insert'])
+
+
+def _stroke(stroke_id, x, n=2):
+    return {'id': stroke_id,
+            'points': [{'x': x + i, 'y': x} for i in range(n)]}
+
+
+@pytest.fixture
+def room(unlimited, connect, code):
+    sio, watcher = connect(), connect()
+    replica = Replica(watcher)
+    replica.sync()
+    send = lambda event, **data: sio.emit(
+        event, dict(data, session_code=code), callback=True)
+
+    def check(expected):
+        assert [(p['id'], len(p['points']))
+                for p in server.store.get(code)['paths']] == expected
+        assert replica.sync() == expected
+    return send, check
+
+
+def test_undo_redo_after_adds(room):
+    send, check = room
+    for i in range(3):
+        send('add_stroke', stroke=_stroke('s%d' % i, i * 10))
+    send('append_points', id='s2', points=[{'x': 9, 'y': 9}])
+    check([('s0', 2), ('s1', 2), ('s2', 3)])
+    send('undo_request')
+    check([('s0', 2), ('s1', 2)])
+    send('undo_request')
+    check([('s0', 2)])
+    send('redo_request')
+    check([('s0', 2), ('s1', 2)])
+    send('redo_request')
+    check([('s0', 2), ('s1', 2), ('s2', 3)])   # ▶ with its appended point
+    send('redo_request')                       # ▶ nothing left to redo
+    check([('s0', 2), ('s1', 2), ('s2', 3)])
+
+
+def test_undo_redo_after_a_region_erase(room):
+    send, check = room
+    for i, y in enumerate((0, 90, 0, 90)):
+        send('add_stroke', stroke=dict(_stroke('s%d' % i, i * 10),
+                                       points=[{'x': i * 10, 'y': y},
+                                               {'x': i * 10 + 1, 'y': y}]))
+    send('erase_region', rect=[-1, -1, 40, 5])
+    check([('s1', 2), ('s3', 2)])
+    send('append_points', id='s1', points=[{'x': 11, 'y': 91}])
+    send('undo_request')
+    # ▶ the survivor keeps its point appended after the erase
+    check([('s0', 2), ('s1', 3), ('s2', 2), ('s3', 2)])
+    send('redo_request')
+    check([('s1', 3), ('s3', 2)])
+    send('undo_request')
+    send('undo_request')                        # ▶ then the last add
+    check([('s0', 2), ('s1', 3), ('s2', 2)])
+
+
+def test_undo_redo_after_update_paths(room):
+    send, check = room
+    board = [_stroke('s%d' % i, i * 10) for i in range(4)]
+    send('update_paths', paths=board)
+    check([('s0', 2), ('s1', 2), ('s2', 2), ('s3', 2)])
+    # ▶ one stroke replaced, one dropped, one added in a single update
+    send('update_paths', paths=[board[0], _stroke('s1', 10, 5), board[3],
+                                _stroke('s4', 40)])
+    check([('s0', 2), ('s1', 5), ('s3', 2), ('s4', 2)])
+    send('undo_request')
+    check([('s0', 2), ('s1', 2), ('s2', 2), ('s3', 2)])
+    send('redo_request')
+    check([('s0', 2), ('s1', 5), ('s3', 2), ('s4', 2)])
+    send('clear_paths')
+    check([])
+    send('undo_request')
+    check([('s0', 2), ('s1', 5), ('s3', 2), ('s4', 2)])
+
+
+def test_new_edit_drops_the_redo_stack(room):
+    send, check = room
+    send('add_stroke', stroke=_stroke('a', 0))
+    send('add_stroke', stroke=_stroke('b', 10))
+    send('undo_request')
+    send('remove_stroke', id='a')
+    check([])
+    send('redo_request')
+    check([])
+    send('undo_request')
+    check([('a', 2)])
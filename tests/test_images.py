@@ -0,0 +1,131 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import images as images_module
+import server
+from images import ImageCache, ImagePipeline
+from limits import RateLimiter, parse_rules
+from persistence import run_blocking, wait_for
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg" width="1" height="1"/>'
+
+
+def _png(n):
+    """Distinct bytes standing in for an image; the cache never decodes"""
+    return b'\x89PNG' + n.to_bytes(4, 'big') + b'\0' * 92
+
+
+def test_recent_files_are_kept_up_to_the_hard_cap(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=300, hard_bytes=500)
+    digests = [cache.put(_png(i), 'image/png') for i in range(5)]
+    # ▶ all just written: over the soft cap, nothing goes
+    assert cache.total == 500 and len(os.listdir(tmp_path)) == 5
+    digests.append(cache.put(_png(5), 'image/png'))
+    # ▶ over the hard cap the oldest go, however recent
+    assert cache.total <= 500
+    assert digests[0] not in cache and digests[-1] in cache
+
+
+def test_hard_cap_still_spares_open_boards(tmp_path):
+    open_boards = set()
+    cache = ImageCache(str(tmp_path), max_bytes=100, hard_bytes=200,
+                       in_use=lambda: open_boards)
+    first = cache.put(_png(0), 'image/png')
+    open_boards.add(first)
+    for i in range(1, 5):
+        cache.put(_png(i), 'image/png')
+    assert first in cache
+    assert cache.total <= 200
+
+
+def test_old_files_go_at_the_soft_cap(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=200, keep_recent=0)
+    digests = [cache.put(_png(i), 'image/png') for i in range(3)]
+    assert cache.total == 200 and digests[0] not in cache
+
+
+@pytest.fixture
+def http(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'images', ImageCache(str(tmp_path), 1 << 20))
+    monkeypatch.setattr(server, 'upload_limits', RateLimiter({}))
+    return server.app.test_client()
+
+
+def test_upload_is_validated(http):
+    assert http.post('/backgrounds', data=b'',
+                     content_type='image/png').status_code == 400
+    assert http.post('/backgrounds', data=b'GIF89a',
+                     content_type='text/html').status_code == 415
+    reply = http.post('/backgrounds', data=SVG, content_type='image/svg+xml')
+    assert reply.status_code == 201
+    body = reply.get_json()
+    assert body['url'] == '/backgrounds/' + body['hash']
+
+
+def test_multipart_upload_and_undecodable_image(http, monkeypatch):
+    reply = http.post('/backgrounds', content_type='multipart/form-data',
+                      data={'image': (io.BytesIO(SVG), 'a.svg', 'image/svg+xml')})
+    assert reply.status_code == 201
+
+    def broken(data, mimetype):
+        raise ValueError('not an image')
+    monkeypatch.setattr(server.pipeline, 'process', broken)
+    assert http.post('/backgrounds', data=b'\x89PNG',
+                     content_type='image/png').status_code == 415
+
+
+def test_background_is_revalidated_by_etag(http):
+    digest = http.post('/backgrounds', data=SVG,
+                       content_type='image/svg+xml').get_json()['hash']
+    first = http.get('/backgrounds/' + digest)
+    assert first.status_code == 200 and first.data == SVG
+    assert first.headers['ETag'] == '"%s"' % digest
+    assert 'immutable' in first.headers['Cache-Control']
+    again = http.get('/backgrounds/' + digest,
+                     headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304 and again.data == b''
+    assert http.get('/backgrounds/' + '0' * 64).status_code == 404
+
+
+def test_background_is_served_sandboxed(http):
+    digest = http.post('/backgrounds', data=SVG,
+                       content_type='image/svg+xml').get_json()['hash']
+    reply = http.get('/backgrounds/' + digest)
+    assert reply.headers['Content-Security-Policy'] == "sandbox; default-src 'none'"
+    assert reply.headers['X-Content-Type-Options'] == 'nosniff'
+    # ▶ an SVG opened directly must download, not render on this origin
+    assert reply.headers['Content-Disposition'] == 'attachment'
+
+
+def test_pool_result_is_collected_without_a_waiting_thread(monkeypatch):
+    monkeypatch.setattr(images_module, 'Image', object())
+    monkeypatch.setattr(images_module, 'normalize',
+                        lambda data, *options: (data[::-1], 'image/webp', None))
+    collected = []
+
+    def collect(future):
+        collected.append(future)
+        return wait_for(None, future)
+
+    pipeline = ImagePipeline(1, lambda fn, *args: run_blocking(None, fn, *args),
+                             2560, 80, 32, collect)
+    pipeline.pool = ThreadPoolExecutor(1)
+    try:
+        assert pipeline.process(b'abc', 'image/png') == (b'cba', 'image/webp', None)
+    finally:
+        pipeline.close()
+    assert len(collected) == 1
+
+
+def test_uploads_are_rate_limited_per_address(monkeypatch):
+    monkeypatch.setattr(server, 'upload_limits',
+                        RateLimiter(parse_rules('upload=0.001/2')))
+    monkeypatch.setattr(server, '_store_image', lambda body, mimetype: ('d', None))
+    client = server.app.test_client()
+    post = lambda addr: client.post('/backgrounds', data=b'x', content_type='image/png',
+                                    environ_base={'REMOTE_ADDR': addr})
+    assert [post('10.0.0.1').status_code for _ in range(3)] == [201, 201, 429]
+    assert post('10.0.0.2').status_code == 201
@@ -0,0 +1,45 @@
+import pytest
+
+import server
+
+# --------------------------------------------------------------------
+# Inbound limits: a socket's own bucket strikes, the shared room bucket
+# only throttles.
+# --------------------------------------------------------------------
+
+
+@pytest.fixture
+def room(connect, code):
+    return [connect(), connect()], code
+
+
+def _refusals(client):
+    return [packet['args'][0]['reason'] for packet in client.get_received()
+            if packet['name'] == 'rate_limited']
+
+
+def test_room_bucket_throttles_without_striking(room, monkeypatch):
+    monkeypatch.setattr(server, 'socket_limits', server.RateLimiter({}))
+    monkeypatch.setattr(server, 'room_limits',
+                        server.RateLimiter({'update_paths': (0, 5)}))
+    (flooder, bystander), code = room
+    for _ in range(40):
+        flooder.emit('update_paths', {'session_code': code, 'paths': []})
+    bystander.get_received()
+    for _ in range(30):
+        bystander.emit('update_paths', {'session_code': code, 'paths': []})
+    assert flooder.is_connected() and bystander.is_connected()
+    assert set(_refusals(bystander)) == {'room_rate'}
+
+
+def test_socket_bucket_strikes_disconnect(room, monkeypatch):
+    monkeypatch.setattr(server, 'socket_limits',
+                        server.RateLimiter({'update_paths': (0, 1)}))
+    monkeypatch.setattr(server, 'room_limits', server.RateLimiter({}))
+    (flooder, bystander), code = room
+    sent = 0
+    while flooder.is_connected() and sent < 30:
+        flooder.emit('update_paths', {'session_code': code, 'paths': []})
+        sent += 1
+    assert not flooder.is_connected()
+    assert bystander.is_connected()
@@ -0,0 +1,8 @@
+import server
+
+
+def test_metrics_never_list_session_codes(connect, code):
+    connect()
+    body = server.app.test_client().get('/metrics').get_data(as_text=True)
+    assert code not in body
+    assert 'session="%s"' % server.session_label(code) in body
@@ -0,0 +1,37 @@
+import server
+from store import create_store
+
+
+def _stroke(stroke_id, x):
+    return {'id': stroke_id,
+            'points': [{'x': x, 'y': x}, {'x': x + 1, 'y': x}]}
+
+
+def test_board_rehydrates_from_its_snapshot_after_a_restart(
+        tmp_path, monkeypatch, unlimited, connect, code):
+    path = str(tmp_path / 'sessions.db')
+    monkeypatch.setattr(server, 'store', create_store(
+        None, path, on_load=server._prune_workers))
+    client = connect()
+    for i in range(3):
+        client.emit('add_stroke', {'session_code': code,
+                                   'stroke': _stroke('s%d' % i, i * 10)},
+                    callback=True)
+    assert server.store.flush() == 1
+    # ▶ killed: no disconnect, the snapshot still counts `client`
+    server.store.snapshots.close()
+
+    monkeypatch.setattr(server, 'WORKER_ID', 'restarted')
+    monkeypatch.setattr(server, 'store', create_store(
+        None, path, on_load=server._prune_workers))
+    sess = server.store.get(code)
+    assert [p['id'] for p in sess['paths']] == ['s0', 's1', 's2']
+    assert server._occupancy(sess) == 0
+    assert not any(sess['encodings'].values())
+
+    again = connect()
+    snapshot = [p['args'][0] for p in again.get_received()
+                if p['name'] == 'session_data'][0]
+    assert [p['id'] for p in snapshot['paths']] == ['s0', 's1', 's2']
+    again.emit('undo_request', {'session_code': code}, callback=True)
+    assert [p['id'] for p in server.store.get(code)['paths']] == ['s0', 's1']
@@ -0,0 +1,85 @@
+import json
+from itertools import count
+
+import pytest
+
+import recorder as recorder_module
+from recorder import Recorder
+
+# --------------------------------------------------------------------
+# Recordings: keyframes every few ops, replays that seek to the last
+# keyframe before `from`, and a bad entry that costs only its own line.
+# --------------------------------------------------------------------
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    ticks = count(1)
+    monkeypatch.setattr(recorder_module.time, 'time',
+                        lambda: float(next(ticks)))
+
+
+def _state(board_id, paths=()):
+    return {'board_id': board_id, 'paths': list(paths)}
+
+
+def _play(rec, code, start=None, stop=None):
+    return [json.loads(line) for line in
+            b''.join(rec.replay(code, start, stop)).splitlines()]
+
+
+def _record(rec, code, version, payload, board_id='b1'):
+    if rec.needs_keyframe(code, board_id, version - 1):
+        rec.keyframe(code, board_id, version - 1, _state(board_id))
+    rec.record(code, version, 'stroke_added', payload)
+
+
+def test_replay_seeks_to_the_keyframe_before_start(tmp_path, clock):
+    rec = Recorder(str(tmp_path), keyframe_every=3)
+    for version in range(1, 8):
+        _record(rec, 'c', version, {'stroke': {'id': 's%d' % version}})
+        rec.flush()
+
+    frames = rec.keyframes('c')
+    assert [k['v'] for k in frames] == [0, 3, 6]
+    whole = _play(rec, 'c')
+    assert [line.get('e', 'k') for line in whole].count('k') == 3
+    assert [line['v'] for line in whole if 'e' in line] == list(range(1, 8))
+
+    # ▶ from a time between the 2nd and 3rd keyframe: the 2nd keyframe on
+    start = frames[1]['t'] + 1
+    seeked = _play(rec, 'c', start)
+    assert 'k' in seeked[0] and seeked[0]['v'] == 3
+    assert [line['v'] for line in seeked if 'e' in line] == [4, 5, 6, 7]
+    assert all(line['t'] <= start + 2 for line in _play(rec, 'c', start,
+                                                         start + 2))
+
+
+def test_bad_entry_costs_only_its_own_line(tmp_path, clock):
+    rec = Recorder(str(tmp_path))
+    _record(rec, 'a', 1, {'stroke': {'id': 'a1', 'blob': b'\x00\x01'}})
+    _record(rec, 'b', 1, {'stroke': {'id': 'b1'}})
+    _record(rec, 'b', 2, {'stroke': {'id': 'b2', 'bad': object()}})
+    _record(rec, 'b', 3, {'stroke': {'id': 'b3'}})
+    rec.flush()
+
+    assert rec.dropped == 1
+    a = _play(rec, 'a')
+    assert a[1]['p']['stroke']['blob'] == 'AAE='
+    assert [line['v'] for line in _play(rec, 'b') if 'e' in line] == [1, 3]
+    # ▶ b lost a line, so its next op comes with a fresh keyframe
+    assert rec.needs_keyframe('b', 'b1', 3)
+    assert not rec.needs_keyframe('a', 'b1', 1)
+
+
+def test_unwritable_keyframe_is_queued_again(tmp_path, clock):
+    rec = Recorder(str(tmp_path))
+    rec.keyframe('c', 'b1', 0, _state('b1', [{'id': 'x', 'bad': object()}]))
+    rec.record('c', 1, 'stroke_added', {'stroke': {'id': 's1'}})
+    rec.flush()
+    assert not rec.exists('c')      # ▶ no op without the keyframe before it
+    _record(rec, 'c', 2, {'stroke': {'id': 's2'}})
+    rec.flush()
+    lines = _play(rec, 'c')
+    assert 'k' in lines[0] and lines[0]['v'] == 1
+    assert [line['v'] for line in lines if 'e' in line] == [2]
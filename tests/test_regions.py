@@ -0,0 +1,34 @@
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize('value', ['-inf,-inf,inf,inf', 'nan,0,1,1',
+                                   [0, 0, 1e400, 1], '0,0,1', None])
+def test_malformed_rects_are_refused(value):
+    assert server._parse_rect(value) is None
+
+
+def test_non_finite_viewport_gets_a_full_snapshot(connect, code):
+    client = connect('&viewport=-inf,-inf,inf,inf')
+    assert server.store.get(code)['encodings']['json'] == 1
+    snapshot = [p['args'][0] for p in client.get_received()
+                if p['name'] == 'session_data']
+    assert len(snapshot) == 1 and 'viewport' not in snapshot[0]
+    client.emit('query_region', {'session_code': code, 'rect': 'nan,0,1,1'})
+    assert client.get_received() == []
+
+
+def test_region_reply_follows_the_queued_events(connect, code, monkeypatch):
+    monkeypatch.setattr(server, 'BATCH_INTERVAL', 1.0)
+    monkeypatch.setattr(server, '_flush_task', object())   # ▶ never flushed by time
+    alice, bob = connect(), connect()
+    bob.get_received()
+    alice.emit('add_stroke', {'session_code': code, 'stroke': {
+        'id': 'a1', 'points': [[0, 0], [5, 5]]}})
+    bob.emit('query_region', {'session_code': code, 'rect': [-1, -1, 10, 10]})
+    received = bob.get_received()
+    assert [p['name'] for p in received] == ['stroke_added', 'region_strokes']
+    added, region = (p['args'][0] for p in received)
+    assert region['version'] == added['version']
+    assert [s['id'] for s in region['strokes']] == ['a1']
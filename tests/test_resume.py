@@ -0,0 +1,14 @@
+import server
+
+
+def test_resume_needs_the_board_id(connect, code):
+    first = connect()
+    first.emit('add_stroke', {'session_code': code,
+                              'stroke': {'id': 's1', 'points': [[0, 0]]}})
+    board_id = server.store.get(code)['board_id']
+    for query, expected in (('&since=0', 'session_data'),
+                            ('&since=0&board_id=other', 'session_data'),
+                            ('&since=0&board_id=' + board_id, 'catch_up')):
+        client = connect(query)
+        assert [p['name'] for p in client.get_received()] == [expected]
+        client.disconnect()
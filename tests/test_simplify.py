@@ -0,0 +1,99 @@
+import pytest
+
+import server
+import simplify
+from codec import pack_points, unpack_points
+from simplify import rdp_mask, simplify_points, simplify_stroke
+
+# --------------------------------------------------------------------
+# RDP and coordinate rounding on their own, then update_paths resending
+# strokes the session already stored in simplified form.
+# --------------------------------------------------------------------
+ZIGZAG = [{'x': x, 'y': 0.4 if x % 2 else 0} for x in range(10)] + \
+    [{'x': 10, 'y': 5}, {'x': 11, 'y': 0}]
+
+
+def test_rdp_keeps_endpoints_and_points_off_the_line():
+    kept = simplify_points(ZIGZAG, tolerance=1)
+    assert kept == [{'x': 0, 'y': 0}, {'x': 9, 'y': 0.4},
+                    {'x': 10, 'y': 5}, {'x': 11, 'y': 0}]
+    # ▶ under the wobble everything stays
+    assert simplify_points(ZIGZAG, tolerance=0.1) == ZIGZAG
+
+
+def test_short_strokes_and_bad_points_pass_through():
+    assert rdp_mask([0, 1], [0, 0], 5) == [True, True]
+    odd = [{'pressure': 1}, {'pressure': 2}, {'pressure': 3}]
+    assert simplify_points(odd, tolerance=1) is odd
+
+
+def test_pure_python_and_numpy_agree(monkeypatch):
+    numpy = pytest.importorskip('numpy')
+    xs = [i * 0.5 for i in range(200)]
+    ys = [(i * 7919 % 13) / 4 for i in range(200)]
+    fast = rdp_mask(xs, ys, 0.8)
+    monkeypatch.setattr(simplify, 'numpy', None)
+    assert rdp_mask(xs, ys, 0.8) == fast
+
+
+def test_rounding_to_decimals():
+    points = [{'x': 1.234, 'y': 5.678, 'pressure': 0.5}, [2.25, 3.75, 0.1]]
+    assert simplify_points(points, decimals=1) == [
+        {'x': 1.2, 'y': 5.7, 'pressure': 0.5}, [2.2, 3.8, 0.1]]
+    whole = simplify_points([{'x': 1.6, 'y': 2.4}], decimals=0)
+    assert whole == [{'x': 2, 'y': 2}] and isinstance(whole[0]['x'], int)
+
+
+def test_rounding_lets_rdp_drop_repeats():
+    points = [{'x': 0, 'y': 0}, {'x': 0.01, 'y': 0.02},
+              {'x': 0.04, 'y': 0}, {'x': 3, 'y': 3}]
+    assert simplify_points(points, tolerance=0.001, decimals=1) == [
+        {'x': 0.0, 'y': 0.0}, {'x': 3.0, 'y': 3.0}]
+
+
+def test_packed_points_are_simplified_but_not_rounded():
+    packed = pack_points([[x, 0] for x in range(5)] + [[5, 5]])
+    assert simplify_points(packed, decimals=0) is packed
+    assert unpack_points(simplify_points(packed, tolerance=0.5)) == \
+        [{'x': 0, 'y': 0}, {'x': 4, 'y': 0}, {'x': 5, 'y': 5}]
+
+
+def test_simplify_stroke_copies_only_when_points_change():
+    stroke = {'id': 'a', 'color': 'red', 'points': ZIGZAG}
+    assert simplify_stroke(stroke) is stroke
+    simpler = simplify_stroke(stroke, tolerance=1)
+    assert simpler is not stroke and stroke['points'] is ZIGZAG
+    assert simpler['color'] == 'red' and len(simpler['points']) == 4
+
+
+# --------------------------------------------------------------------
+# update_paths: the sender keeps its raw strokes and sends them again
+# --------------------------------------------------------------------
+def test_resent_strokes_keep_their_stored_outline(connect, code):
+    client = connect()
+    client.emit('set_simplification', {'session_code': code, 'tolerance': 1},
+                callback=True)
+    raw = [{'id': 'a', 'points': ZIGZAG},
+           {'id': 'b', 'points': [{'x': 0, 'y': 20 + i % 2 * 0.3}
+                                  for i in range(6)]}]
+    client.emit('update_paths', {'session_code': code, 'paths': raw},
+                callback=True)
+    sess = server.store.get(code)
+    first, second = sess['paths']
+    assert len(first['points']) == 4 and len(second['points']) == 2
+    assert sess['drawn']['a'] == (12, ZIGZAG[0], ZIGZAG[-1])
+
+    # ▶ `a` comes back as drawn, `b` with a point added at the end
+    changed = dict(raw[1], points=raw[1]['points'] + [{'x': 9, 'y': 29}])
+    undo_depth = len(sess['undo_stack'])
+    client.emit('update_paths', {'session_code': code,
+                                 'paths': [dict(raw[0]), changed]},
+                callback=True)
+    sess = server.store.get(code)
+    assert sess['paths'][0] is first        # ▶ not simplified again
+    # ▶ `b` is simplified afresh, from the points as sent
+    assert sess['paths'][1]['points'] == [{'x': 0, 'y': 20}, {'x': 9, 'y': 29}]
+    assert sess['drawn']['b'][0] == 7
+    assert len(sess['undo_stack']) == undo_depth + 1
+    index, removed, inserted = sess['undo_stack'][-1]
+    assert index == 1 and [p['id'] for p in inserted] == ['b']
@@ -0,0 +1,178 @@
+import pickle
+
+import pytest
+
+import server
+from frozen import thaw
+from store import RedisSessionStore
+
+fakeredis = pytest.importorskip('fakeredis')
+
+# --------------------------------------------------------------------
+# RedisSessionStore against fakeredis: what one worker saves item by
+# item, another worker – fresh, or holding an older copy – reads back
+# whole, and boards pickled whole by earlier versions still load.
+# --------------------------------------------------------------------
+
+
+def _store(client):
+    return RedisSessionStore(client, parts=server.REDIS_PARTS,
+                             derived=server.REDIS_DERIVED,
+                             rebuild=server._rebuild_indexes)
+
+
+def _plain(sess):
+    """The stored state of a session, frozen history entries thawed"""
+    return {
+        'paths': sess['paths'],
+        'undo': [tuple(map(thaw, e)) for e in sess['undo_stack']],
+        'redo': [tuple(map(thaw, e)) for e in sess['redo_stack']],
+        'op_log': list(sess['op_log']),
+        'codes': sess['codes'],
+        'tombstones': list(sess['tombstones']),
+        'version': sess['version'],
+        'clock': sess['clock'],
+        'stroke_index': sorted(sess['stroke_index']),
+        'code_index': sess['code_index'],
+    }
+
+
+@pytest.fixture
+def redis_session(monkeypatch, unlimited, connect, code):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(server, 'store', _store(client))
+    return client, connect(), code
+
+
+def _stroke(stroke_id, x):
+    return {'id': stroke_id,
+            'points': [{'x': x, 'y': x}, {'x': x + 1, 'y': x}]}
+
+
+def test_round_trip_through_a_second_worker(redis_session):
+    client, sio, code = redis_session
+
+    def send(event, **data):
+        sio.emit(event, dict(data, session_code=code), callback=True)
+
+    for i in range(12):         # ▶ more undo entries than HISTORY_HOT
+        send('add_stroke', stroke=_stroke('s%d' % i, i * 10))
+    send('append_points', id='s3', points=[{'x': 99, 'y': 99}])
+    send('undo_request')
+    send('erase_region', rect=[0, 0, 25, 25])
+    send('add_code', code='abc')
+    send('add_code', code='def')
+    send('crdt_ops', ops=[
+        {'op': 'add', 'stroke': {'id': 'al:1', 'clock': 1,
+                                 'points': [[500, 500]]}},
+        {'op': 'remove', 'id': 'al:1', 'clock': 2}])
+
+    live = server.store.get(code)
+    fresh = _store(client).get(code)
+    assert fresh is not live
+    assert _plain(fresh) == _plain(live)
+    assert len(live['paths']) == 8 and live['codes'] == ['abc', 'def']
+    assert server._region_positions(fresh, (0, 0, 1000, 1000)) == \
+        server._region_positions(live, (0, 0, 1000, 1000))
+
+    meta = pickle.loads(client.hget(server.store._key(code), 'meta'))
+    assert not set(meta) & set(server.REDIS_DERIVED)
+
+
+def test_stale_copy_only_reads_what_changed():
+    client = fakeredis.FakeRedis()
+    writer, reader = _store(client), _store(client)
+    with writer.session('b', server.new_session) as sess:
+        sess['paths'].extend(_stroke('s%d' % i, i) for i in range(5))
+    held = reader.get('b')
+
+    with writer.session('b') as sess:
+        sess['paths'][2]['points'].append({'x': 7, 'y': 7})
+        sess['paths'].append(_stroke('s5', 50))
+        del sess['paths'][0]
+
+    reads, hmget = [], client.hmget
+
+    def counted(key, *fields):
+        reads.append((key, fields))
+        return hmget(key, *fields)
+
+    client.hmget = counted
+    got = reader.get('b')
+    client.hmget = hmget
+    # ▶ only the grown and the new stroke are read; the rest are the
+    #   objects the reader already held
+    assert [len(fields[0]) for key, fields in reads
+            if ':part:' in key] == [2]
+    assert got is not held
+    assert _plain(got) == _plain(_store(client).get('b'))
+    assert got['paths'][0] is held['paths'][1]
+    assert got['paths'][2] is held['paths'][3]
+
+
+def test_whole_pickle_from_an_older_version_is_upgraded():
+    client = fakeredis.FakeRedis()
+    legacy = server.new_session()
+    legacy['paths'].extend(_stroke('s%d' % i, i) for i in range(3))
+    legacy['stroke_index'] = server._index_strokes(legacy['paths'])
+    legacy['version'] = 3
+    client.set('whiteboard:session:old', pickle.dumps(legacy))
+
+    store = _store(client)
+    with store.session('old') as sess:
+        assert sess['paths'] == legacy['paths']
+        sess['paths'].append(_stroke('s3', 30))
+    assert client.type('whiteboard:session:old') == b'hash'
+
+    fresh = _store(client).get('old')
+    assert [s['id'] for s in fresh['paths']] == ['s0', 's1', 's2', 's3']
+    assert sorted(fresh['stroke_index']) == ['s0', 's1', 's2', 's3']
+    assert fresh['version'] == 3
+
+
+def test_undo_after_a_reload_keeps_appends_to_erase_survivors(redis_session):
+    client, sio, code = redis_session
+
+    def send(event, **data):
+        sio.emit(event, dict(data, session_code=code), callback=True)
+
+    send('add_stroke', stroke=_stroke('s0', 0))
+    send('add_stroke', stroke={'id': 's1', 'points': [{'x': 10, 'y': 90},
+                                                      {'x': 11, 'y': 90}]})
+    send('add_stroke', stroke=_stroke('s2', 20))
+    # ▶ s1 survives inside the erase's window, so it sits on both sides
+    #   of the undo entry
+    send('erase_region', rect=[-1, -1, 30, 30])
+    assert [s['id'] for s in server.store.get(code)['paths']] == ['s1']
+    server.store.cache.clear()
+    send('append_points', id='s1', points=[{'x': 99, 'y': 99}])
+    server.store.cache.clear()
+    send('undo_request')
+
+    sess = server.store.get(code)
+    assert [s['id'] for s in sess['paths']] == ['s0', 's1', 's2']
+    assert len(sess['stroke_index']['s1']['points']) == 3
+    assert sess['paths'][1] is sess['stroke_index']['s1']
+
+    server.store.cache.clear()
+    send('redo_request')
+    sess = server.store.get(code)
+    assert [s['id'] for s in sess['paths']] == ['s1']
+    assert len(sess['paths'][0]['points']) == 3
+
+
+def test_sockets_of_a_dead_worker_stop_counting(redis_session, monkeypatch, connect):
+    client, sio, code = redis_session
+    old = server.WORKER_ID
+    server.store.beat(old, 60)
+    # ▶ the worker holding `sio` is redeployed: this is a new process
+    monkeypatch.setattr(server, 'WORKER_ID', 'restarted')
+    other = connect()
+    assert server._occupancy(server.store.get(code)) == 2
+
+    client.delete(server.store.worker_prefix + old)    # ▶ its heartbeat ran out
+    other.disconnect()
+    sess = server.store.get(code)
+    assert server._occupancy(sess) == 0
+    assert sess['workers'] == {} and not any(sess['encodings'].values())
+    assert code in server.empty_wheel      # ▶ released if nobody returns
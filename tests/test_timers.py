@@ -0,0 +1,76 @@
+from timers import TimerWheel
+
+# --------------------------------------------------------------------
+# TimerWheel on a hand-driven clock
+# --------------------------------------------------------------------
+
+
+def _wheel(tick=1.0):
+    now, fired = [100.0], []
+    wheel = TimerWheel(fired.append, tick=tick, clock=lambda: now[0])
+    return wheel, now, fired
+
+
+def test_keys_fire_once_when_due():
+    wheel, now, fired = _wheel()
+    wheel.reset('a', 5)
+    now[0] = 104.5
+    assert wheel.advance() == [] and 'a' in wheel
+    now[0] = 105.0
+    assert wheel.advance() == ['a']
+    assert fired == [['a']] and 'a' not in wheel and len(wheel) == 0
+    now[0] = 200.0
+    assert wheel.advance() == []
+
+
+def test_due_keys_fire_in_one_batch():
+    wheel, now, fired = _wheel()
+    for key in 'abc':
+        wheel.reset(key, 2)
+    wheel.reset('later', 20)
+    now[0] = 103.0
+    wheel.advance()
+    assert [sorted(batch) for batch in fired] == [['a', 'b', 'c']]
+    assert len(wheel) == 1
+
+
+def test_cancelled_keys_never_fire():
+    wheel, now, fired = _wheel()
+    wheel.reset('a', 1)
+    wheel.reset('b', 1)
+    wheel.cancel('a')
+    wheel.cancel('missing')
+    now[0] = 110.0
+    assert wheel.advance() == ['b']
+
+
+def test_reset_moves_the_deadline_either_way():
+    wheel, now, fired = _wheel()
+    wheel.reset('later', 2)
+    wheel.reset('sooner', 10)
+    wheel.reset('later', 8)     # ▶ re-filed lazily from its old slot
+    wheel.reset('sooner', 1)
+    now[0] = 103.0
+    assert wheel.advance() == ['sooner']
+    now[0] = 107.0
+    assert wheel.advance() == []
+    now[0] = 108.0
+    assert wheel.advance() == ['later']
+
+
+def test_keys_fire_in_deadline_order_across_ticks():
+    wheel, now, fired = _wheel(tick=0.5)
+    for key, delay in (('c', 3), ('a', 1), ('d', 4), ('b', 2)):
+        wheel.reset(key, delay)
+    while now[0] < 105:
+        now[0] += 0.5
+        wheel.advance()
+    assert fired == [['a'], ['b'], ['c'], ['d']]
+
+
+def test_a_late_advance_catches_up():
+    wheel, now, fired = _wheel()
+    wheel.reset('a', 1)
+    wheel.reset('b', 30)
+    now[0] = 1000.0             # ▶ the loop stalled for a long while
+    assert sorted(wheel.advance()) == ['a', 'b']
@@ -0,0 +1,61 @@
+import time
+
+# --------------------------------------------------------------------
+# Hashed timing wheel
+#
+# Deadlines live in a plain dict, so re-arming a key is a single field
+# update. Buckets are only touched when a slot comes due: keys whose
+# deadline moved on in the meantime are re-filed, the rest fire as one
+# batch. One background task calls advance() for every wheel.
+# --------------------------------------------------------------------
+class TimerWheel:
+    def __init__(self, callback, tick=1.0, clock=time.monotonic):
+        self.callback = callback    # ▶ called with a list of expired keys
+        self.tick = tick
+        self.clock = clock
+        self.deadlines = {}         # ▶ key -> absolute deadline
+        self.buckets = {}           # ▶ slot -> set of keys
+        self.current = int(clock() // tick)
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    def _file(self, key, deadline):
+        slot = max(int(deadline // self.tick), self.current)
+        self.buckets.setdefault(slot, set()).add(key)
+
+    def reset(self, key, delay):
+        """(Re)arm key to fire `delay` seconds from now"""
+        deadline = self.clock() + delay
+        previous = self.deadlines.get(key)
+        self.deadlines[key] = deadline
+        # ▶ an earlier bucket re-files the key lazily when it comes due
+        if previous is None or previous > deadline:
+            self._file(key, deadline)
+
+    def cancel(self, key):
+        self.deadlines.pop(key, None)
+
+    def advance(self):
+        """Fire everything that is due; returns the expired keys"""
+        now = self.clock()
+        last = int(now // self.tick)
+        expired = []
+        while self.current <= last:
+            for key in self.buckets.pop(self.current, ()):
+                deadline = self.deadlines.get(key)
+                if deadline is None:
+                    continue            # ▶ cancelled
+                if deadline <= now:
+                    del self.deadlines[key]
+                    expired.append(key)
+                else:
+                    slot = max(int(deadline // self.tick), self.current + 1)
+                    self.buckets.setdefault(slot, set()).add(key)
+            self.current += 1
+        if expired:
+            self.callback(expired)
+        return expired